@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+"""
+Benchmarks importing synthetic MTGJSON data, and compares the results with an earlier run.
+
+    python benchmark.py --output before.json
+    python benchmark.py --compare before.json
+
+Set MAGIC_CARDS_TEST_DATABASE=postgresql to run against a local PostgreSQL database.
+"""
+from __future__ import unicode_literals, absolute_import
+
+import argparse
+import json
+import os
+import sys
+
+import django
+from django.conf import settings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sets', type=int, default=20, help='Number of sets to generate.')
+    parser.add_argument('--cards-per-set', type=int, default=250, help='Number of printings in each set.')
+    parser.add_argument('--reprint-ratio', type=float, default=0.3, help='Fraction of printings that are reprints.')
+    parser.add_argument('--type-variety', type=int, default=50, help='Number of distinct subtypes.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated data.')
+    parser.add_argument('--repeat', type=int, default=3, help='Keep the fastest of this many runs.')
+    parser.add_argument('--output', metavar='FILE', help='Write the results to FILE as JSON.')
+    parser.add_argument('--compare', metavar='FILE', help='Compare the results with those in FILE.')
+    parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='Report a regression when a scenario is slower than in --compare by more than this fraction.')
+    args = parser.parse_args(argv)
+
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'tests.settings'
+    django.setup()
+    # Don't let query logging skew the timings.
+    settings.DEBUG = False
+
+    from django.db import connection
+    from tests.benchmarks.runner import compare, run_benchmark
+
+    config = {
+        'num_sets': args.sets,
+        'cards_per_set': args.cards_per_set,
+        'reprint_ratio': args.reprint_ratio,
+        'type_variety': args.type_variety,
+        'seed': args.seed,
+    }
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        results = run_benchmark(config, args.repeat)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    for name, summary in results['scenarios'].items():
+        print('{:<10} {:>8.3f} s {:>6} queries {:>8} rows {:>10.0f} printings/s'.format(
+            name, summary['seconds'], summary['queries'], summary['rows'], summary['printings_per_second']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lines, regressed = compare(baseline, results, args.threshold)
+        print()
+        print('\n'.join(lines))
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
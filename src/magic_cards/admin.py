@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Card, Set, Printing, CardSupertype, CardType, CardSubtype, Artist
+from .models import Card, Set, Printing, CardSupertype, CardType, CardSubtype, Artist, SetImportState
 
 
 @admin.register(Card)
@@ -38,3 +38,9 @@ class CardTypeAdmin(admin.ModelAdmin):
 @admin.register(CardSubtype)
 class CardSubtypeAdmin(admin.ModelAdmin):
     search_fields = ['name']
+
+
+@admin.register(SetImportState)
+class SetImportStateAdmin(admin.ModelAdmin):
+    list_display = ['code', 'mtgjson_version', 'imported_at']
+    search_fields = ['code']
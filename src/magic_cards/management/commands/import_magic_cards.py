@@ -1,8 +1,13 @@
-from django.core.management import BaseCommand
+import json
+import sys
+import tracemalloc
+
+from django.core.management import BaseCommand, CommandError
+from django.core.management.base import OutputWrapper
 import inflect
 
-from magic_cards.models import Card, Printing, Set
 from magic_cards.utils.import_cards import import_cards, Everything
+from magic_cards.utils.plan import plan_import
 
 
 class Command(BaseCommand):
@@ -10,10 +15,55 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('set_code', nargs='*', type=str)
+        parser.add_argument(
+            '--source',
+            help='Import from a local AllSetFiles.zip, directory of set files, or AllPrintings.json, '
+                 'or from another URL, instead of downloading from MTGJSON.')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Re-import sets even if their data is unchanged since they were last imported.')
+        parser.add_argument(
+            '--workers', type=int,
+            help='Decode sets in this many processes, in parallel with writing them to the database.')
+        parser.add_argument(
+            '--checkpoint-every', type=int, metavar='N',
+            help='Commit after every N sets instead of importing everything in one transaction.')
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Continue an interrupted checkpointed import after the last set it committed.')
+        parser.add_argument(
+            '--fast-load', action='store_true',
+            help='If the database has no cards yet, load them in bulk with the fastest method the database supports.')
+        parser.add_argument(
+            '--staged', action='store_true',
+            help='Decode every set before writing any of them, then write them all in one short transaction.')
+        parser.add_argument(
+            '--stats', action='store_true',
+            help='Print the time, queries, rows written, and peak memory of each phase of the import.')
+        parser.add_argument(
+            '--stats-json', metavar='FILE',
+            help='Write the statistics of the import to FILE as JSON, or to standard output if FILE is "-".')
+        parser.add_argument(
+            '--trace-memory', action='store_true',
+            help='With --stats or --stats-json, trace memory allocations to find the peak of each phase. This '
+                 'slows the import down.')
+        parser.add_argument(
+            '--plan', action='store_true',
+            help='Report what the import would change, without writing anything.')
+        parser.add_argument(
+            '--plan-json', metavar='FILE',
+            help='With --plan, write the objects that would change to FILE as JSON, or to standard output if '
+                 'FILE is "-".')
+        parser.add_argument(
+            '--database',
+            help='With --plan, compare against this database, such as a read-only replica.')
 
     def handle(self, *args, **options):
-        models_to_track = [Set, Card, Printing]
-        initial = {model: model.objects.count() for model in models_to_track}
+        if options['plan']:
+            return self.handle_plan(**options)
+        if options['staged'] and (options['checkpoint_every'] or options['resume']):
+            raise CommandError("--staged can't be combined with --checkpoint-every or --resume.")
+        self.messages = self.get_messages(options['stats_json'], **options)
 
         p = inflect.engine()
         set_codes = options['set_code']
@@ -23,14 +73,99 @@ class Command(BaseCommand):
         else:
             set_string = 'all sets'
 
-        self.stdout.write(p.inflect("Beginning import of {}.".format(set_string)))
-        import_cards(set_codes or Everything)
-        self.stdout.write("Import complete.")
-
-        final = {model: model.objects.count() for model in models_to_track}
-        status_strings = [
-            p.inflect(
-                "{0} new num({0},)plural_noun({1})".format(final[model] - initial[model], model._meta.object_name))
-            for model in models_to_track
-        ]
-        self.stdout.write("Added {}.".format(p.join(status_strings)))
+        self.messages.write(p.inflect("Beginning import of {}.".format(set_string)))
+        trace_memory = options['trace_memory'] and not tracemalloc.is_tracing()
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            report = import_cards(
+                set_codes or Everything, source=options['source'], force=options['force'],
+                workers=options['workers'], checkpoint_every=options['checkpoint_every'], resume=options['resume'],
+                fast_load=options['fast_load'], staged=options['staged'])
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+        self.messages.write("Import complete.")
+
+        # The counts come from the import itself, so the tables don't need to be counted again.
+        self.messages.write("Added {}.".format(describe_changes(p, report.changes, 'created', 'new')))
+        for kind, verb in [('updated', 'Updated'), ('deleted', 'Deleted')]:
+            if any(getattr(report.changes[name], kind) for name in TRACKED_MODELS):
+                self.messages.write("{} {}.".format(verb, describe_changes(p, report.changes, kind)))
+        if options['verbosity'] >= 2:
+            for code, changes in report.set_changes.items():
+                self.messages.write("{}: {}.".format(code, describe_changes(p, changes, 'created', 'new')))
+                if any(changes[name].updated for name in TRACKED_MODELS):
+                    self.messages.write("{}: updated {}.".format(code, describe_changes(p, changes, 'updated')))
+
+        if options['stats']:
+            self.write_stats(report)
+        if options['stats_json'] == '-':
+            self.stdout.write(json.dumps(report.as_dict(), indent=2))
+        elif options['stats_json']:
+            with open(options['stats_json'], 'w') as f:
+                json.dump(report.as_dict(), f, indent=2)
+
+    def handle_plan(self, **options):
+        self.messages = self.get_messages(options['plan_json'], **options)
+        set_codes = options['set_code']
+        plan = plan_import(
+            set_codes or Everything, source=options['source'], force=options['force'], workers=options['workers'],
+            using=options['database'])
+
+        for name, counts in plan.counts().items():
+            self.messages.write("{}: {created} to create, {updated} to update, {pruned} to prune.".format(
+                name, **counts))
+        if plan.skipped:
+            p = inflect.engine()
+            self.messages.write(p.inflect("Skipping num({0}) unchanged plural_noun(set).".format(plan.skipped)))
+
+        if options['plan_json'] == '-':
+            self.stdout.write(json.dumps(plan.as_dict(), indent=2))
+        elif options['plan_json']:
+            with open(options['plan_json'], 'w') as f:
+                json.dump(plan.as_dict(), f, indent=2)
+
+    def get_messages(self, json_file, **options):
+        """
+        Returns where to write the messages for people: standard output, unless the JSON of `json_file`
+        is written there, so that it can be piped to a program as it is.
+        """
+        if json_file == '-':
+            return OutputWrapper(options.get('stderr') or sys.stderr)
+        return self.stdout
+
+    def write_stats(self, report):
+        row_format = '{:<10} {:>10} {:>8} {:>8} {:>10} {:>12}'
+        self.messages.write(row_format.format('Phase', 'Time (s)', 'Queries', 'Rows', 'Rows/s', 'Peak memory'))
+        for name, stats in report.phases.items():
+            self.messages.write(row_format.format(
+                name, '{:.3f}'.format(stats.seconds), stats.queries, stats.rows,
+                '{:.0f}'.format(stats.rows_per_second), format_bytes(stats.peak_memory)))
+        # The total is the peak of the whole process, which is known even when memory is not traced.
+        self.messages.write(row_format.format(
+            'total', '{:.3f}'.format(report.seconds), report.queries, '', '', format_bytes(report.peak_memory)))
+        if all(stats.peak_memory is None for stats in report.phases.values()):
+            self.messages.write("Pass --trace-memory for the peak memory of each phase.")
+
+
+# The models whose changes are summarized after an import.
+TRACKED_MODELS = ('Set', 'Card', 'Printing')
+
+
+def describe_changes(p, changes, kind, adjective=None):
+    """
+    Describes the number of each of `TRACKED_MODELS` in `changes` that were `kind` (created, updated,
+    or deleted), using the inflect engine `p`.
+    """
+    prefix = adjective + ' ' if adjective else ''
+    return p.join([
+        p.inflect("{0} {1}num({0},)plural_noun({2})".format(getattr(changes[name], kind), prefix, name))
+        for name in TRACKED_MODELS
+    ])
+
+
+def format_bytes(num_bytes):
+    if num_bytes is None:
+        return '-'
+    return '{:.1f} MB'.format(num_bytes / (1024 * 1024))
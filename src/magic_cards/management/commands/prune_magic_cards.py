@@ -0,0 +1,20 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+import inflect
+
+from magic_cards.utils.import_cards import prune_orphans
+
+
+class Command(BaseCommand):
+    help = 'Deletes supertypes, types, and subtypes that no longer have any cards.'
+
+    def handle(self, *args, **options):
+        p = inflect.engine()
+        with transaction.atomic():
+            deleted = prune_orphans()
+
+        status_strings = [
+            p.inflect("{0} num({0},)plural_noun({1})".format(count, model._meta.object_name))
+            for model, count in deleted.items()
+        ]
+        self.stdout.write("Deleted {}.".format(p.join(status_strings)))
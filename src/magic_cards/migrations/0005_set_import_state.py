@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magic_cards', '0004_auto_20231130_1721'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SetImportState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=8, unique=True)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('mtgjson_version', models.CharField(blank=True, max_length=63)),
+                ('imported_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
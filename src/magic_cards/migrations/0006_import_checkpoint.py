@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 20:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magic_cards', '0005_set_import_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=8, unique=True)),
+                ('completed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 21:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magic_cards', '0006_import_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='oracle_id',
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='printing',
+            name='uuid',
+            field=models.UUIDField(blank=True, null=True, unique=True),
+        ),
+    ]
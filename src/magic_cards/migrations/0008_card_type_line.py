@@ -0,0 +1,42 @@
+# Generated by Django 2.2.28 on 2026-10-18 22:05
+
+from django.db import migrations, models
+
+
+def fill_type_lines(apps, schema_editor):
+    # The historical models have none of the helpers of magic_cards.models, so build the lines here.
+    Card = apps.get_model('magic_cards', 'Card')
+    cards = list(Card.objects.using(schema_editor.connection.alias).prefetch_related(
+        'supertypes', 'types', 'subtypes'))
+    for card in cards:
+        supertypes = [t.name for t in card.supertypes.all()]
+        types = [t.name for t in card.types.all()]
+        subtypes = [t.name for t in card.subtypes.all()]
+        card.type_line = ' '.join(supertypes + types)
+        if subtypes:
+            card.type_line += ' — ' + ' '.join(subtypes)
+        card.type_line = card.type_line.strip()
+        card.type_names = ','.join(sorted(set(supertypes + types + subtypes)))
+    Card.objects.using(schema_editor.connection.alias).bulk_update(
+        cards, ['type_line', 'type_names'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magic_cards', '0007_mtgjson_identifiers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='type_line',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='type_names',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(fill_type_lines, migrations.RunPython.noop),
+    ]
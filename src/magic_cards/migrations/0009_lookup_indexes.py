@@ -0,0 +1,40 @@
+# Generated by Django 2.2.28 on 2026-10-18 22:40
+
+from django.db import migrations, models
+
+# Databases that can index an expression with this SQL. Elsewhere, `Card.objects.named()` still
+# works, without the index.
+LOWER_NAME_INDEX_VENDORS = ('postgresql', 'sqlite')
+
+
+def create_lower_name_index(apps, schema_editor):
+    if schema_editor.connection.vendor in LOWER_NAME_INDEX_VENDORS:
+        schema_editor.execute('CREATE INDEX card_name_lower_idx ON magic_cards_card (LOWER(name))')
+
+
+def drop_lower_name_index(apps, schema_editor):
+    if schema_editor.connection.vendor in LOWER_NAME_INDEX_VENDORS:
+        schema_editor.execute('DROP INDEX IF EXISTS card_name_lower_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magic_cards', '0008_card_type_line'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='printing',
+            index=models.Index(fields=['multiverse_id'], name='printing_multiverse_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='printing',
+            index=models.Index(fields=['set', 'number'], name='printing_set_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='printing',
+            index=models.Index(fields=['card', 'set'], name='printing_card_set_idx'),
+        ),
+        migrations.RunPython(create_lower_name_index, drop_lower_name_index),
+    ]
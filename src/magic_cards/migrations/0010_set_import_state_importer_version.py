@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 23:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magic_cards', '0009_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='setimportstate',
+            name='importer_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,11 +1,15 @@
 from __future__ import unicode_literals
 
-import random
-
 from django.db import models
+from django.db.models import Prefetch
+from django.db.models.functions import Lower
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
 from django.utils.encoding import python_2_unicode_compatible
 from django_light_enums import enum
 
+from magic_cards.utils.sampling import sample_ids
+
 
 @python_2_unicode_compatible
 class NameMixin(object):
@@ -13,7 +17,59 @@ class NameMixin(object):
         return self.name
 
 
+def build_type_line(supertypes, types, subtypes):
+    """
+    Returns the type line of a card with the given type names, e.g. "Legendary Creature — Elf Warrior".
+    """
+    type_line = ' '.join(list(supertypes) + list(types))
+    if subtypes:
+        type_line += ' \u2014 ' + ' '.join(subtypes)
+    return type_line.strip()
+
+
+def build_type_names(supertypes, types, subtypes):
+    """
+    Returns the sorted names of all of a card's types, separated by commas.
+    """
+    return ','.join(sorted(set(supertypes) | set(types) | set(subtypes)))
+
+
+class CardQuerySet(models.QuerySet):
+    def named(self, name):
+        """
+        Returns the cards whose name is `name`, ignoring case.
+
+        Unlike `name__iexact`, this compares `LOWER(name)`, so that the index on it can be used where
+        the database has one.
+        """
+        return self.annotate(name_lower=Lower('name')).filter(name_lower=name.lower())
+
+    def with_types(self):
+        """
+        Prefetches everything that displaying the cards needs: their supertypes, types, and subtypes,
+        and their printings with the set and artist of each, in a fixed number of queries.
+        """
+        return self.prefetch_related(
+            'supertypes', 'types', 'subtypes',
+            Prefetch('printings', queryset=Printing.objects.select_related('set', 'artist')),
+        )
+
+    def update_type_lines(self):
+        """
+        Recomputes the `type_line` and `type_names` of these cards from their types.
+        """
+        cards = list(self.prefetch_related('supertypes', 'types', 'subtypes').order_by())
+        for card in cards:
+            card.set_type_line(
+                [t.name for t in card.supertypes.all()], [t.name for t in card.types.all()],
+                [t.name for t in card.subtypes.all()])
+        self.model.objects.bulk_update(cards, ['type_line', 'type_names'], batch_size=500)
+        return len(cards)
+
+
 class Card(NameMixin, models.Model):
+    objects = CardQuerySet.as_manager()
+
     name = models.CharField(max_length=255, unique=True)
     mana_cost = models.CharField(max_length=63, blank=True)
 
@@ -25,18 +81,52 @@ class Card(NameMixin, models.Model):
     power = models.CharField(max_length=7, blank=True)
     toughness = models.CharField(max_length=7, blank=True)
     loyalty = models.CharField(max_length=8, null=True, blank=True)
+    # Shared by the faces of double-faced and split cards, which are separate Cards.
+    oracle_id = models.UUIDField(null=True, blank=True, db_index=True)
+
+    # Kept in line with supertypes, types and subtypes, so that they can be shown without a join.
+    type_line = models.CharField(max_length=255, blank=True)
+    type_names = models.TextField(blank=True)
+
+    def set_type_line(self, supertypes, types, subtypes):
+        self.type_line = build_type_line(supertypes, types, subtypes)
+        self.type_names = build_type_names(supertypes, types, subtypes)
+
+    @property
+    def type_name_list(self):
+        return self.type_names.split(',') if self.type_names else []
 
 
 class Set(NameMixin, models.Model):
     name = models.CharField(max_length=63)
     code = models.CharField(max_length=8, unique=True)
 
+    def generate_boosters(self, num, seed=None):
+        """
+        Returns a list of `num` booster packs of this set, each a list of printings.
+
+        See `magic_cards.utils.boosters.generate_boosters`.
+        """
+        from magic_cards.utils.boosters import generate_boosters
+        return generate_boosters(self, num, seed)
+
+    def generate_sealed_pool(self, num_packs=6, seed=None):
+        """
+        Returns a list of the printings in a sealed pool of `num_packs` booster packs of this set.
+        """
+        from magic_cards.utils.boosters import generate_sealed_pool
+        return generate_sealed_pool(self, num_packs, seed)
+
 
 class PrintingQuerySet(models.QuerySet):
-    def random(self, num):
-        num = int(num)
-        printing_ids = set(self.values_list('id', flat=True))
-        random_ids = random.sample(printing_ids, num)
+    def random(self, num, seed=None):
+        """
+        Returns `num` distinct printings from this queryset, chosen at random. With the same `seed`,
+        the same printings are chosen (as long as the printings haven't changed).
+
+        See `magic_cards.utils.sampling.sample_ids` for how they are chosen.
+        """
+        random_ids = sample_ids(self, num, seed)
         return self.filter(id__in=random_ids)
 
 
@@ -66,6 +156,14 @@ class Printing(models.Model):
                                related_name='printings')
     number = models.CharField(max_length=64, blank=True)
     multiverse_id = models.PositiveIntegerField(blank=True, null=True)
+    uuid = models.UUIDField(unique=True, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['multiverse_id'], name='printing_multiverse_id_idx'),
+            models.Index(fields=['set', 'number'], name='printing_set_number_idx'),
+            models.Index(fields=['card', 'set'], name='printing_card_set_idx'),
+        ]
 
     @property
     def image_url(self):
@@ -89,9 +187,58 @@ class CardSubtype(NameMixin, models.Model):
     name = models.CharField(max_length=32, unique=True)
 
 
+@receiver(m2m_changed, sender=Card.supertypes.through)
+@receiver(m2m_changed, sender=Card.types.through)
+@receiver(m2m_changed, sender=Card.subtypes.through)
+def update_type_lines(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keeps the type lines of cards in line with changes to their types through the ORM. The importer
+    writes the type lines along with the types themselves.
+    """
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            Card.objects.filter(pk=instance.pk).update_type_lines()
+            instance.refresh_from_db(fields=['type_line', 'type_names'])
+    elif action == 'pre_clear':
+        # The cards are no longer known once the type's relations have been cleared.
+        instance._cleared_card_ids = list(instance.card_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        Card.objects.filter(pk__in=instance.__dict__.pop('_cleared_card_ids', [])).update_type_lines()
+    elif action in ('post_add', 'post_remove'):
+        Card.objects.filter(pk__in=pk_set).update_type_lines()
+
+
 @python_2_unicode_compatible
 class Artist(models.Model):
     full_name = models.CharField(max_length=127, unique=True)
 
     def __str__(self):
         return self.full_name
+
+
+@python_2_unicode_compatible
+class SetImportState(models.Model):
+    """
+    Records the MTGJSON data that a set was last successfully imported from.
+    """
+    code = models.CharField(max_length=8, unique=True)
+    content_hash = models.CharField(max_length=64)
+    mtgjson_version = models.CharField(max_length=63, blank=True)
+    # The `IMPORTER_VERSION` of the import. Sets imported by other versions are always imported again.
+    importer_version = models.PositiveIntegerField(default=0)
+    imported_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.code
+
+
+@python_2_unicode_compatible
+class ImportCheckpoint(models.Model):
+    """
+    Records a set that a checkpointed import has committed, so that an interrupted import can resume.
+    """
+    code = models.CharField(max_length=8, unique=True)
+    completed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.code
@@ -0,0 +1,10 @@
+from django.dispatch import Signal
+
+# Sent by the importer before it starts, with the `ImportReport` it will fill in as `report`.
+import_started = Signal()
+
+# Sent by the importer after it writes each set, with the set's `code` and the `report` so far.
+set_imported = Signal()
+
+# Sent by the importer when it finishes, with its complete `ImportReport` as `report`.
+import_finished = Signal()
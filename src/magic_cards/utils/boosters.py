@@ -0,0 +1,142 @@
+"""
+Generates booster packs and sealed pools from pools of each set's printings by rarity, which are
+loaded once and then kept in memory.
+"""
+import random
+from collections import defaultdict
+
+from django.db.models.signals import post_save
+
+from magic_cards.models import Printing
+from magic_cards.signals import import_finished
+from magic_cards.utils.random import WeightedSampler
+
+Rarity = Printing.Rarity
+
+# The slots of a booster pack, in order, as `(rarity, count)`.
+PACK_SLOTS = (
+    (Rarity.RARE, 1),
+    (Rarity.UNCOMMON, 3),
+    (Rarity.COMMON, 10),
+    (Rarity.BASIC_LAND, 1),
+)
+# The chance that the rare slot of a pack holds a mythic rare instead, in sets that have them.
+MYTHIC_CHANCE = 1 / 8
+# Where a slot is filled from when its set has too few printings of its rarity. Commons are made up
+# with uncommons, and everything else with the next rarity down.
+RARITY_FALLBACKS = {
+    Rarity.MYTHIC: Rarity.RARE,
+    Rarity.RARE: Rarity.UNCOMMON,
+    Rarity.UNCOMMON: Rarity.COMMON,
+    Rarity.COMMON: Rarity.UNCOMMON,
+    Rarity.BASIC_LAND: Rarity.COMMON,
+}
+# The number of packs in a sealed pool.
+SEALED_PACKS = 6
+# The supertype of the cards that fill the basic land slot. MTGJSON gives basic lands the rarity
+# "common", so they can't be told apart from commons by their rarity.
+BASIC_SUPERTYPE = 'Basic'
+
+
+class BoosterPools(object):
+    """
+    The printings of a set that can be opened in its boosters, grouped by rarity. Basic lands are
+    grouped together, whatever their rarity.
+    """
+
+    def __init__(self, printings):
+        self.pools = defaultdict(list)
+        for printing in printings:
+            if BASIC_SUPERTYPE in printing.card.type_name_list:
+                self.pools[Rarity.BASIC_LAND].append(printing)
+            else:
+                self.pools[printing.rarity].append(printing)
+
+    def rare_sampler(self, rng):
+        """
+        Returns a `WeightedSampler` of the rarity of the rare slot of a pack.
+        """
+        if not self.pools[Rarity.MYTHIC]:
+            return WeightedSampler({Rarity.RARE: 1}, rng)
+        return WeightedSampler({Rarity.RARE: 1 - MYTHIC_CHANCE, Rarity.MYTHIC: MYTHIC_CHANCE}, rng)
+
+    def pack(self, rng, rare_rarity=Rarity.RARE):
+        """
+        Returns a list of the printings in a new booster pack, drawn with the `random.Random` `rng`,
+        whose rare slot holds a printing of `rare_rarity`. No printing is in a pack more than once.
+        """
+        pack = []
+        drawn = defaultdict(list)
+        for rarity, count in PACK_SLOTS:
+            if rarity == Rarity.RARE:
+                rarity = rare_rarity
+            self.draw(rng, rarity, count, pack, drawn)
+        return pack
+
+    def draw(self, rng, rarity, count, pack, drawn):
+        """
+        Adds `count` printings of `rarity` to `pack`, or of other rarities (see `RARITY_FALLBACKS`) if
+        there are not enough. `drawn` holds the printings already drawn from each pool, which are not
+        drawn again. If the set runs out of printings, the pack is left short.
+        """
+        tried = set()
+        while count and rarity is not None and rarity not in tried:
+            tried.add(rarity)
+            pool = self.pools[rarity]
+            already_drawn = drawn[rarity]
+            chosen = rng.sample(pool, min(len(pool), count + len(already_drawn)))
+            if already_drawn:
+                chosen = [printing for printing in chosen if printing not in already_drawn]
+            chosen = chosen[:count]
+            pack.extend(chosen)
+            already_drawn.extend(chosen)
+            count -= len(chosen)
+            rarity = RARITY_FALLBACKS.get(rarity)
+
+
+class PoolCache(object):
+    """
+    The `BoosterPools` of each set, loaded with one query the first time the set's boosters are
+    generated. They are dropped whenever an import finishes or a printing is created.
+    """
+
+    def __init__(self):
+        self.pools = {}
+
+    def get(self, magic_set):
+        key = (magic_set._state.db, magic_set.pk)
+        if key not in self.pools:
+            printings = magic_set.printings.exclude(rarity=Rarity.SPECIAL).select_related('card').order_by('pk')
+            self.pools[key] = BoosterPools(printings)
+        return self.pools[key]
+
+    def clear(self, sender=None, **kwargs):
+        if kwargs.get('created', True):
+            self.pools.clear()
+
+
+pool_cache = PoolCache()
+import_finished.connect(pool_cache.clear, dispatch_uid='magic_cards.utils.boosters.import_finished')
+post_save.connect(pool_cache.clear, sender=Printing, dispatch_uid='magic_cards.utils.boosters.post_save')
+
+
+def generate_boosters(magic_set, num, seed=None):
+    """
+    Returns a list of `num` booster packs of `magic_set`, each a list of printings.
+
+    A pack has a rare (or, one time in eight, a mythic rare), three uncommons, ten commons, and a
+    basic land. With the same `seed`, the same packs are generated. The printings are shared with
+    the set's cached pools, and should not be modified.
+    """
+    rng = random.Random(seed)
+    pools = pool_cache.get(magic_set)
+    # Roll the rare slot of every pack at once.
+    rare_rarities = pools.rare_sampler(rng).sample(num)
+    return [pools.pack(rng, rare_rarity) for rare_rarity in rare_rarities]
+
+
+def generate_sealed_pool(magic_set, num_packs=SEALED_PACKS, seed=None):
+    """
+    Returns a list of the printings in a sealed pool of `num_packs` booster packs of `magic_set`.
+    """
+    return [printing for pack in generate_boosters(magic_set, num_packs, seed) for printing in pack]
@@ -0,0 +1,174 @@
+"""
+Engines for loading rows into the database faster than the ORM can, for the first import.
+"""
+import io
+
+from django.core.management.color import no_style
+
+BATCH_SIZE = 500
+
+# Fields of these types need no conversion before they are sent to the database.
+PLAIN_FIELD_TYPES = {
+    'AutoField', 'CharField', 'ForeignKey', 'IntegerField', 'PositiveIntegerField', 'TextField',
+}
+
+
+class BulkLoader(object):
+    """
+    Loads rows into a database with the ORM's `bulk_create`. This works with every database, and is
+    the fallback for those without a faster engine.
+
+    A loader is also a context manager, which tunes the database connection for loading while it is
+    active. Some settings can't be changed inside a transaction, so it should be entered before the
+    import's transaction begins.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def insert(self, model, fields, rows):
+        """
+        Inserts `rows`, which are tuples of the values of `fields` (attribute names), into the table
+        of `model`.
+        """
+        model.objects.using(self.connection.alias).bulk_create(
+            [model(**dict(zip(fields, row))) for row in rows], batch_size=BATCH_SIZE)
+
+    def reset_sequences(self, models):
+        """
+        Brings the sequences that assign the primary keys of `models` past the keys that were loaded.
+        """
+        statements = self.connection.ops.sequence_reset_sql(no_style(), models)
+        with self.connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+    def prepare(self, model, fields, rows):
+        """
+        Yields `rows` with their values converted for the database, as the ORM would.
+        """
+        converters = []
+        for i, name in enumerate(fields):
+            field = model._meta.get_field(name)
+            if field.get_internal_type() not in PLAIN_FIELD_TYPES:
+                converters.append((i, field))
+        for row in rows:
+            if converters:
+                row = list(row)
+                for i, field in converters:
+                    row[i] = field.get_db_prep_save(row[i], self.connection)
+            yield row
+
+    def columns(self, model, fields):
+        quote_name = self.connection.ops.quote_name
+        return quote_name(model._meta.db_table), [
+            quote_name(model._meta.get_field(name).column) for name in fields]
+
+
+class SQLiteBulkLoader(BulkLoader):
+    """
+    Loads rows into SQLite with `executemany`, with the connection tuned for writing in bulk.
+    """
+    PRAGMAS = (
+        ('journal_mode', 'MEMORY'),
+        ('synchronous', 'OFF'),
+        ('cache_size', '-262144'),
+        ('temp_store', 'MEMORY'),
+    )
+    # SQLite refuses to change these inside a transaction.
+    OUTSIDE_TRANSACTION_PRAGMAS = ('journal_mode', 'synchronous', 'temp_store')
+
+    def __enter__(self):
+        self.saved_pragmas = []
+        with self.connection.cursor() as cursor:
+            for name, value in self.PRAGMAS:
+                if self.connection.in_atomic_block and name in self.OUTSIDE_TRANSACTION_PRAGMAS:
+                    continue
+                cursor.execute('PRAGMA {}'.format(name))
+                self.saved_pragmas.append((name, cursor.fetchone()[0]))
+                cursor.execute('PRAGMA {} = {}'.format(name, value))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self.connection.cursor() as cursor:
+            for name, value in reversed(self.saved_pragmas):
+                cursor.execute('PRAGMA {} = {}'.format(name, value))
+
+    def insert(self, model, fields, rows):
+        table, columns = self.columns(model, fields)
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            table, ', '.join(columns), ', '.join(['%s'] * len(columns)))
+        with self.connection.cursor() as cursor:
+            cursor.executemany(sql, self.prepare(model, fields, rows))
+
+
+class CopyFile(io.TextIOBase):
+    """
+    A file of `rows` in the text format of PostgreSQL's `COPY`, which is only generated as it is read.
+    """
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = ''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.buffer += '\t'.join(copy_value(value) for value in row) + '\n'
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class PostgresBulkLoader(BulkLoader):
+    """
+    Loads rows into PostgreSQL by streaming them with `COPY ... FROM STDIN`.
+    """
+
+    def __enter__(self):
+        if not self.connection.in_atomic_block:
+            with self.connection.cursor() as cursor:
+                cursor.execute('SET synchronous_commit TO OFF')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.connection.in_atomic_block:
+            with self.connection.cursor() as cursor:
+                cursor.execute('RESET synchronous_commit')
+
+    def insert(self, model, fields, rows):
+        table, columns = self.columns(model, fields)
+        sql = 'COPY {} ({}) FROM STDIN'.format(table, ', '.join(columns))
+        with self.connection.cursor() as cursor:
+            cursor.copy_expert(sql, CopyFile(self.prepare(model, fields, rows)))
+
+
+BULK_LOADERS = {
+    'postgresql': PostgresBulkLoader,
+    'sqlite': SQLiteBulkLoader,
+}
+
+
+def get_bulk_loader(connection):
+    """
+    Returns the fastest `BulkLoader` for `connection`'s database.
+    """
+    return BULK_LOADERS.get(connection.vendor, BulkLoader)(connection)
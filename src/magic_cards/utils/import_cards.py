@@ -1,35 +1,55 @@
-import io
+import hashlib
 import itertools
-import json
-import zipfile
-from contextlib import closing
+import uuid
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
 
-import requests
-from django.db import transaction
+import django
+from django.db import connections, router, transaction
+from django.db.models import Max, signals
 
-from magic_cards.models import Artist, Card, CardSubtype, CardSupertype, CardType, Printing, Set
+from magic_cards.models import (
+    Artist, Card, CardSubtype, CardSupertype, CardType, ImportCheckpoint, Printing, Set, SetImportState,
+    build_type_line, build_type_names)
+from magic_cards.signals import import_finished, import_started, set_imported
+from magic_cards.utils.bulk_load import get_bulk_loader
+from magic_cards.utils.report import ImportReport
+from magic_cards.utils.sources import MTG_JSON_URL, Everything, SetFile, get_source  # noqa: F401
 
-MTG_JSON_URL = 'https://mtgjson.com/api/v5/AllSetFiles.zip'
+BATCH_SIZE = 500
+# The version of what the importer stores of each set. Bump it when imports start storing something
+# they didn't before, so that sets imported by older versions are imported again even if their data
+# has not changed.
+IMPORTER_VERSION = 1
 
+# The fields of a Card that are updated when a set is re-imported.
+CARD_FIELDS = ('mana_cost', 'text', 'power', 'toughness', 'loyalty', 'oracle_id', 'type_line', 'type_names')
+# The fields of a Card that are derived from its supertypes, types and subtypes.
+TYPE_LINE_FIELDS = ('type_line', 'type_names')
+# The fields of a Printing that are updated when a printing with the same uuid is re-imported.
+PRINTING_FIELDS = ('card', 'set', 'rarity', 'flavor_text', 'artist', 'number', 'multiverse_id', 'uuid')
 
-class Everything:
-    """
-    Sentinel value for downloading all sets (i.e. skipping nothing).
-    """
-    pass
+CardRow = namedtuple('CardRow', ('name',) + CARD_FIELDS + ('supertypes', 'types', 'subtypes'))
+PrintingRow = namedtuple('PrintingRow', [
+    'card_name', 'rarity', 'flavor_text', 'artist', 'number', 'multiverse_id', 'uuid'])
+SetRows = namedtuple('SetRows', ['code', 'name', 'cards', 'printings'])
 
+# The many-to-many fields of Card that hold its types, with the model of each.
+TYPE_RELATIONS = (
+    ('supertypes', CardSupertype),
+    ('types', CardType),
+    ('subtypes', CardSubtype),
+)
 
-def fetch_data():
-    r = requests.get(MTG_JSON_URL)
-    sets_data = {}
-    with closing(r), zipfile.ZipFile(io.BytesIO(r.content)) as archive:
-        unzipped_files = archive.infolist()
-        for zipinfo in unzipped_files:
-            decoded_data = archive.read(zipinfo).decode('utf-8')
-            this_set = json.loads(decoded_data)
-            code = this_set["data"]["code"]
-            sets_data[code] = this_set["data"]
-    return sets_data
+
+def fetch_data(source=None, set_codes=Everything):
+    """
+    Yields `(code, data)` for each set in `source`, which defaults to the latest MTGJSON archive.
+
+    See `magic_cards.utils.sources.get_source` for the accepted values of `source`. When `set_codes`
+    is given, sets that were not asked for are skipped without being decoded where possible.
+    """
+    yield from get_source(source).iter_sets(set_codes)
 
 
 def parse_rarity(string):
@@ -65,132 +85,886 @@ class ModelCache(dict):
             created = True
         return result, created
 
+    def bulk_get_or_create(self, model, field, values):
+        """
+        Makes sure that the cache holds an object of class `model` for each of `values`. All of the
+        objects that are not found are created based on `field=value` with a single bulk insert.
+        Returns the number of objects created.
+        """
+        missing = {}
+        for value in values:
+            if value.lower() not in self[model]:
+                missing.setdefault(value.lower(), model(**{field: value}))
+        if missing:
+            for obj in bulk_upsert(model, list(missing.values()), field, [field]):
+                self[model][getattr(obj, field).lower()] = obj
+        return len(missing)
+
+
+def iter_card_data(data):
+    """
+    Yields the MTGJSON data for each card in a set, skipping tokens.
+    """
+    all_cards_data = itertools.chain(
+        data['cards'],
+        data.get('tokens', []),
+    )
+    for card_data in all_cards_data:
+        # Skip tokens
+        layout = card_data['layout']
+        if layout in ('token', 'art_series'):
+            continue
+        yield card_data
+
+
+def normalize_set(code, data):
+    """
+    Flattens a set's MTGJSON `data` into a `SetRows` of plain values, ready to be written.
+
+    `cards` maps each distinct card name in the set to its `CardRow`, and `printings` holds a
+    `PrintingRow` for every card in the set, in order.
+    """
+    cards = {}
+    printings = []
+    for card_data in iter_card_data(data):
+        # Card info
+        name = card_data['name']
+        loyalty = card_data.get('loyalty', None)
+        multiverse_id = card_data.get('multiverseId', None)  # Missing on certain sets
+
+        # Check if this is a DFC
+        layout = card_data.get('layout')
+        if layout in ('transform', 'modal_dfc', 'double_faced_token'):
+            name = card_data.get('faceName', name)
+        supertypes = tuple(card_data.get('supertypes', []))
+        types = tuple(card_data['types'])
+        subtypes = tuple(card_data.get('subtypes', []))
+
+        cards[name] = CardRow(
+            name=name,
+            mana_cost=card_data.get('manaCost', ''),
+            text=card_data.get('text', ''),
+            power=card_data.get('power', ''),
+            toughness=card_data.get('toughness', ''),
+            loyalty=str(loyalty) if loyalty is not None else None,
+            oracle_id=parse_uuid(card_data.get('identifiers', {}).get('scryfallOracleId')),
+            type_line=build_type_line(supertypes, types, subtypes),
+            type_names=build_type_names(supertypes, types, subtypes),
+            supertypes=supertypes,
+            types=types,
+            subtypes=subtypes,
+        )
+
+        # Printing info
+        printings.append(PrintingRow(
+            card_name=name,
+            rarity=parse_rarity(card_data.get('rarity', '')),  # Absent on tokens
+            flavor_text=card_data.get('flavor', ''),
+            artist=card_data.get('artist'),  # Missing on certain cards
+            number=card_data.get('number', ''),  # Absent on old sets
+            multiverse_id=int(multiverse_id) if multiverse_id else None,
+            uuid=parse_uuid(card_data.get('uuid')),  # Absent before MTGJSON 4
+        ))
+    return SetRows(code=code, name=data['name'], cards=cards, printings=printings)
+
+
+def parse_uuid(value):
+    return uuid.UUID(value) if value else None
+
+
+def upsert_cards(card_rows):
+    """
+    Creates or updates a `Card` for each of `card_rows`, a dictionary of `CardRow`s keyed by name.
+
+    Existing cards are looked up by name in bulk, and only those whose Oracle fields have changed
+    are written. Returns a tuple of `(cards, created, updated)`, where `cards` maps each name to its
+    `Card`, and `created` and `updated` are the sets of names that were newly created or updated.
+    """
+    cards = Card.objects.in_bulk(list(card_rows), field_name='name')
+    cards_to_create = []
+    cards_to_update = []
+    for name, row in card_rows.items():
+        card = cards.get(name)
+        if card is None:
+            cards[name] = Card(name=name, **{field: getattr(row, field) for field in CARD_FIELDS})
+            cards_to_create.append(cards[name])
+            continue
+        changed = False
+        for field in CARD_FIELDS:
+            if getattr(card, field) != getattr(row, field):
+                setattr(card, field, getattr(row, field))
+                changed = True
+        if changed:
+            cards_to_update.append(card)
+
+    if cards_to_create:
+        cards_to_create = bulk_upsert(Card, cards_to_create, 'name', CARD_FIELDS)
+        cards.update((card.name, card) for card in cards_to_create)
+    if cards_to_update:
+        Card.objects.bulk_update(cards_to_update, CARD_FIELDS, batch_size=BATCH_SIZE)
+    return cards, {card.name for card in cards_to_create}, {card.name for card in cards_to_update}
+
+
+def bulk_upsert(model, objs, unique_field, update_fields):
+    """
+    Inserts `objs` in bulk, returning the saved objects with their primary keys set.
+
+    Where the database supports it, this is a native upsert (`INSERT ... ON CONFLICT DO UPDATE`),
+    so a row with the same `unique_field` that appeared since it was looked up has its
+    `update_fields` updated rather than causing an error.
+    """
+    connection = connections[router.db_for_write(model)]
+    if getattr(connection.features, 'supports_update_conflicts_with_target', False):
+        objs = model.objects.bulk_create(
+            objs, batch_size=BATCH_SIZE,
+            update_conflicts=True, unique_fields=[unique_field], update_fields=update_fields)
+    else:
+        objs = model.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+
+    # Not every backend returns the primary keys of rows created in bulk, so look up the rest.
+    missing = [getattr(obj, unique_field) for obj in objs if obj.pk is None]
+    if missing:
+        saved = model.objects.in_bulk(missing, field_name=unique_field)
+        objs = [saved[getattr(obj, unique_field)] if obj.pk is None else obj for obj in objs]
+    return objs
+
+
+def chunked(values, size=BATCH_SIZE):
+    """
+    Splits the list `values` into lists of at most `size`, e.g. to bound the parameters of a query.
+    """
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def assign_types(cache, cards, card_rows, created_names=()):
+    """
+    Brings the supertypes, types and subtypes of `cards` in line with `card_rows`.
+
+    The wanted relations are computed in memory and diffed against the existing rows of each
+    through table, which are loaded in one query. Only the difference is written, with one bulk
+    insert of the missing rows and one bulk delete of the stale ones. Cards in `created_names` are
+    known to have no types yet, so their existing rows are not looked up.
+
+    Returns a tuple of the number of rows inserted and deleted, in total, and the set of the names of
+    the cards whose types changed.
+    """
+    num_changed = 0
+    changed_ids = set()
+    existing_card_ids = [cards[name].pk for name in card_rows if name not in created_names]
+    for attname, model in TYPE_RELATIONS:
+        field = Card._meta.get_field(attname)
+        through = field.remote_field.through
+        card_column = field.m2m_column_name()
+        type_column = field.m2m_reverse_name()
+
+        wanted = set()
+        for name, row in card_rows.items():
+            for type_name in getattr(row, attname):
+                obj, _ = cache.get_or_create(model, 'name', type_name)
+                wanted.add((cards[name].pk, obj.pk))
+
+        existing = {}
+        for card_ids in chunked(existing_card_ids):
+            relations = through.objects.filter(**{card_column + '__in': card_ids})
+            for pk, card_id, type_id in relations.values_list('pk', card_column, type_column):
+                existing[(card_id, type_id)] = pk
+
+        stale = [pk for key, pk in existing.items() if key not in wanted]
+        changed_ids.update(card_id for card_id, type_id in existing if (card_id, type_id) not in wanted)
+        for pks in chunked(stale):
+            through.objects.filter(pk__in=pks).delete()
+        missing = sorted(wanted.difference(existing))
+        if missing:
+            through.objects.bulk_create([
+                through(**{card_column: card_id, type_column: type_id}) for card_id, type_id in missing
+            ], batch_size=BATCH_SIZE)
+        changed_ids.update(card_id for card_id, type_id in missing)
+        num_changed += len(stale) + len(missing)
+    return num_changed, {name for name in card_rows if cards[name].pk in changed_ids}
+
+
+def printing_fingerprint(card_id, rarity, artist_id, number, multiverse_id, flavor_text):
+    """
+    Returns a compact, hashable summary of a printing's fields, for comparing printings in memory.
+    """
+    flavor_hash = hashlib.md5(flavor_text.encode('utf-8')).digest()
+    return card_id, rarity, artist_id, number, multiverse_id, flavor_hash
+
+
+class PrintingIndex(object):
+    """
+    The printings already in a set, for matching incoming printings against in memory.
+
+    A printing with an MTGJSON uuid is matched by it, and is changed in place if its fields differ.
+    Printings without one are matched by fingerprint, since none of their fields are unique for sets
+    without proper multiverse_ids. Printings that were imported before uuids were stored have none,
+    so they are matched by fingerprint too, and are given the uuid of the printing that matches.
+    Printings of other sets can be added with `add_moved`, for when MTGJSON moves a printing.
+    """
+    CREATE = 'create'
+    UPDATE = 'update'
+
+    def __init__(self, printings=()):
+        self.by_uuid = {}
+        self.without_uuid = defaultdict(list)
+        self.fingerprints = set()
+        for pk, printing_uuid, fingerprint in printings:
+            self.add(pk, printing_uuid, fingerprint)
+
+    def add(self, pk, printing_uuid, fingerprint):
+        self.fingerprints.add(fingerprint)
+        if printing_uuid is None:
+            self.without_uuid[fingerprint].append(pk)
+        else:
+            self.by_uuid[printing_uuid] = (pk, fingerprint)
+
+    def add_moved(self, pk, printing_uuid):
+        """
+        Adds a printing of another set, which is always updated if it matches, to move it to this one.
+        """
+        self.by_uuid[printing_uuid] = (pk, None)
+
+    def match(self, printing_uuid, fingerprint):
+        """
+        Records an incoming printing, returning a tuple of `(action, pk)`: `CREATE` and None if it
+        is new, `UPDATE` and the primary key of the printing to change if it has changed, or None
+        and None if it is already in the set as it is.
+        """
+        if printing_uuid is None:
+            if fingerprint in self.fingerprints:
+                return None, None
+            self.fingerprints.add(fingerprint)
+            return self.CREATE, None
+
+        if printing_uuid in self.by_uuid:
+            pk, old_fingerprint = self.by_uuid[printing_uuid]
+            if pk is None or old_fingerprint == fingerprint:
+                return None, None
+            self.by_uuid[printing_uuid] = (pk, fingerprint)
+            return self.UPDATE, pk
+        self.fingerprints.add(fingerprint)
+        pks = self.without_uuid.get(fingerprint)
+        pk = pks.pop() if pks else None
+        self.by_uuid[printing_uuid] = (pk, fingerprint)
+        return (self.CREATE, None) if pk is None else (self.UPDATE, pk)
+
+
+def existing_printings(magic_sets):
+    """
+    Returns a `PrintingIndex` of the printings already in each of `magic_sets`, keyed by set id.
+    """
+    indexes = defaultdict(PrintingIndex)
+    for set_ids in chunked([magic_set.pk for magic_set in magic_sets]):
+        values = Printing.objects.filter(set_id__in=set_ids).values_list(
+            'set_id', 'pk', 'uuid', 'card_id', 'rarity', 'artist_id', 'number', 'multiverse_id', 'flavor_text')
+        for set_id, pk, printing_uuid, *printing_values in values.iterator():
+            indexes[set_id].add(pk, printing_uuid, printing_fingerprint(*printing_values))
+    return indexes
+
+
+def add_moved_printings(index, printings, printing_rows):
+    """
+    Adds the printings in the queryset `printings`, which are those of other sets, whose uuids are in
+    `printing_rows` but not in `index`. Uuids are unique across all sets, so a printing that MTGJSON
+    has moved to another set is moved along with it, rather than created again.
+    """
+    uuids = sorted({row.uuid for row in printing_rows if row.uuid is not None and row.uuid not in index.by_uuid})
+    for batch in chunked(uuids):
+        for pk, printing_uuid in printings.filter(uuid__in=batch).values_list('pk', 'uuid').iterator():
+            index.add_moved(pk, printing_uuid)
+
+
+def create_printings(cache, magic_set, set_created, cards, printing_rows):
+    """
+    Creates the printings of `magic_set` in `printing_rows` that don't already exist, and updates
+    those that have changed, returning a tuple of the number created and the number updated.
+    """
+    index = PrintingIndex() if set_created else existing_printings([magic_set])[magic_set.pk]
+    printings_to_create, printings_to_update = build_printings(
+        cache, magic_set, set_created, cards, printing_rows, index)
+    save_printings(printings_to_create, printings_to_update)
+    return len(printings_to_create), len(printings_to_update)
+
+
+def build_printings(cache, magic_set, set_created, cards, printing_rows, index):
+    """
+    Returns a tuple of the unsaved printings of `magic_set` in `printing_rows` that are not in its
+    `PrintingIndex` yet, and of those to update.
+
+    If the Set was just created, printings without a uuid don't need to be checked against the
+    others, and are all created.
+    """
+    add_moved_printings(index, Printing.objects.exclude(set_id=magic_set.pk), printing_rows)
+    printings_to_create = []
+    printings_to_update = []
+    for row in printing_rows:
+        if row.artist:
+            artist, _ = cache.get_or_create(Artist, 'full_name', row.artist)
+        else:
+            artist = None
+        card = cards[row.card_name]
+        if set_created and row.uuid is None:
+            action, pk = PrintingIndex.CREATE, None
+        else:
+            action, pk = index.match(row.uuid, printing_fingerprint(
+                card.pk, row.rarity, artist.pk if artist else None, row.number, row.multiverse_id,
+                row.flavor_text))
+        if action is None:
+            continue
+        printing = Printing(
+            pk=pk,
+            card=card,
+            set=magic_set,
+            rarity=row.rarity,
+            flavor_text=row.flavor_text,
+            artist=artist,
+            number=row.number,
+            multiverse_id=row.multiverse_id,
+            uuid=row.uuid,
+        )
+        if action == PrintingIndex.CREATE:
+            printings_to_create.append(printing)
+        else:
+            printings_to_update.append(printing)
+    return printings_to_create, printings_to_update
+
+
+def save_printings(printings_to_create, printings_to_update):
+    if printings_to_create:
+        Printing.objects.bulk_create(printings_to_create, batch_size=BATCH_SIZE)
+    if printings_to_update:
+        Printing.objects.bulk_update(printings_to_update, PRINTING_FIELDS, batch_size=BATCH_SIZE)
+
+
+def write_set(cache, rows, report=None):
+    """
+    Writes a single set's `SetRows` to the database, recording each phase in `report` if given.
+    """
+    if report is None:
+        report = ImportReport()
+
+    # Create the set, and create or update cards
+    with report.phase('cards') as stats:
+        magic_set, set_created = cache.get_or_create(Set, 'code', rows.code, name=rows.name)
+        cards, created_names, updated_names = upsert_cards(rows.cards)
+        stats.rows += int(set_created) + len(created_names) + len(updated_names)
+    with report.phase('types') as stats:
+        num_types = count_types(cache)
+        num_changed, retyped_names = assign_types(cache, cards, rows.cards, created_names)
+        stats.rows += num_changed
+    report.record(Set, created=int(set_created), code=rows.code)
+    report.record(Card, created=len(created_names), updated=len((updated_names | retyped_names) - created_names),
+                  code=rows.code)
+    record_types(report, cache, num_types, code=rows.code)
+
+    # Create artists
+    with report.phase('artists') as stats:
+        num_created = cache.bulk_get_or_create(
+            Artist, 'full_name', {row.artist for row in rows.printings if row.artist})
+        stats.rows += num_created
+    report.record(Artist, created=num_created, code=rows.code)
+
+    # Create printings
+    with report.phase('printings') as stats:
+        num_created, num_updated = create_printings(cache, magic_set, set_created, cards, rows.printings)
+        stats.rows += num_created + num_updated
+    report.record(Printing, created=num_created, updated=num_updated, code=rows.code)
 
-def parse_data(sets_data, set_codes):
-    # Load supertypes, types, and subtypes into memory
+
+def count_types(cache):
+    """
+    Returns the number of supertypes, types, and subtypes in `cache`, keyed by model.
+    """
+    return {model: len(cache[model]) for attname, model in TYPE_RELATIONS}
+
+
+def record_types(report, cache, num_types, code=None):
+    """
+    Records the supertypes, types, and subtypes that were added to `cache` since it held `num_types`.
+    """
+    for model, num in num_types.items():
+        report.record(model, created=len(cache[model]) - num, code=code)
+
+
+def is_unchanged(import_states, code, content_hash):
+    """
+    Returns whether `code` was last imported from a file whose contents hashed to `content_hash`, by
+    this version of the importer.
+    """
+    state = import_states.get(code)
+    if content_hash is None or state is None:
+        return False
+    return state.content_hash == content_hash and state.importer_version == IMPORTER_VERSION
+
+
+def record_import(import_states, code, content_hash, meta):
+    """
+    Records that the set `code` was imported from a file whose contents hashed to `content_hash`.
+    """
+    if content_hash is None:
+        # Without the set's file, there is nothing to compare the next import against.
+        SetImportState.objects.filter(code=code).delete()
+        import_states.pop(code, None)
+        return
+    import_states[code], _ = SetImportState.objects.update_or_create(code=code, defaults={
+        'content_hash': content_hash,
+        'mtgjson_version': meta.get('version', ''),
+        'importer_version': IMPORTER_VERSION,
+    })
+
+
+def decode_set_file(set_file):
+    """
+    Decodes and normalizes a `SetFile`, returning a tuple of its `SetRows` and MTGJSON metadata.
+    """
+    code, data = set_file.decode()
+    return normalize_set(code, data), set_file.meta
+
+
+def completed(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def iter_set_rows(sets_data, import_states, force=False, workers=None, skip_codes=(), report=None):
+    """
+    Yields `(rows, content_hash, meta)` for each set in `sets_data`, in order.
+
+    A `SetFile` that is identical to the one its set was last imported from is skipped without being
+    decoded, unless `force` is set, as is one whose code is known to be in `skip_codes`. With
+    `workers`, set files are decoded and normalized in a pool of that many processes while the sets
+    before them are written to the database.
+
+    The time spent reading `sets_data` and decoding it is recorded in `report`, if given.
+    """
+    if report is None:
+        report = ImportReport()
+    executor = None
+    window = 0
+    if workers:
+        executor = ProcessPoolExecutor(workers, initializer=django.setup)
+        window = 2 * workers
+    pending = deque()
+    try:
+        for item in report.timed('fetch', sets_data):
+            if isinstance(item, SetFile):
+                if item.code in skip_codes:
+                    continue
+                content_hash = item.content_hash
+                if not force and is_unchanged(import_states, item.code, content_hash):
+                    report.skipped += 1
+                    continue
+                if executor:
+                    # Memory-mapped contents can't be sent to another process.
+                    item.raw = bytes(item.raw)
+                    pending.append((content_hash, executor.submit(decode_set_file, item)))
+                else:
+                    with report.phase('decode'):
+                        pending.append((content_hash, completed(decode_set_file(item))))
+            else:
+                with report.phase('decode'):
+                    pending.append((None, completed((normalize_set(*item), {}))))
+            # Release this set before the next one is decoded.
+            del item
+            while len(pending) > window:
+                content_hash, future = pending.popleft()
+                with report.phase('decode'):
+                    rows, meta = future.result()
+                yield rows, content_hash, meta
+        while pending:
+            content_hash, future = pending.popleft()
+            with report.phase('decode'):
+                rows, meta = future.result()
+            yield rows, content_hash, meta
+    finally:
+        if executor:
+            for content_hash, future in pending:
+                future.cancel()
+            executor.shutdown()
+
+
+def parse_data(sets_data, set_codes, force=False, workers=None, checkpoint_every=None, resume=False,
+               report=None, loader=None, staged=False):
+    """
+    Imports `sets_data` into the database.
+
+    `sets_data` is either a dictionary of set data keyed by set code, or an iterable of
+    `(code, data)` tuples such as the one returned by `fetch_data`, or of `SetFile`s. A `SetFile`
+    that is identical to the one its set was last imported from is skipped without being decoded,
+    unless `force` is set.
+
+    With `workers`, set files are decoded in that many processes, in parallel with the database
+    writes. The sets are still written one at a time and in order, so the result is the same.
+
+    With `checkpoint_every`, the import commits after every that many sets, and records each
+    committed set as an `ImportCheckpoint`. If such an import is interrupted, running it again with
+    `resume` skips the sets that were already committed. This must not be called inside a
+    transaction, or there would be nothing to resume from.
+
+    With a `BulkLoader` as `loader`, an import into a database that has no sets, cards, or printings
+    yet is loaded with it, all at once (see `load_sets`).
+
+    With `staged`, every set is read, decoded, and compared with the database before anything is
+    written, and then all of the writes happen at once, in a single transaction (see
+    `write_staged_sets`). This must not be called inside a transaction, or it would be held open
+    while the sets are decoded.
+
+    Returns an `ImportReport` of the import, which is filled in as it goes if one is given.
+    """
+    if hasattr(sets_data, 'items'):
+        sets_data = sets_data.items()
+    if report is None:
+        report = ImportReport()
+
+    import_started.send(sender=ImportReport, report=report)
+    with report.measure(connections[router.db_for_write(Card)]):
+        import_sets(sets_data, set_codes, report, force, workers, checkpoint_every, resume, loader, staged)
+    import_finished.send(sender=ImportReport, report=report)
+    return report
+
+
+def import_sets(sets_data, set_codes, report, force, workers, checkpoint_every, resume, loader, staged):
+    """
+    Does the work of `parse_data`.
+    """
+
+    # Load supertypes, types, subtypes, and artists into memory
     cache = ModelCache()
     for model in [CardSupertype, CardType, CardSubtype]:
         cache[model] = {obj.name.lower(): obj for obj in model.objects.all()}
-    # Load relevant sets into memory
+    cache[Artist] = {obj.full_name.lower(): obj for obj in Artist.objects.all()}
+    # Load relevant sets and their import states into memory
     if set_codes is Everything:
         cache[Set] = {obj.code.lower(): obj for obj in Set.objects.all()}
+        import_states = {state.code: state for state in SetImportState.objects.all()}
     else:
         cache[Set] = {obj.code.lower(): obj for obj in Set.objects.filter(code__in=set_codes)}
+        import_states = {state.code: state for state in SetImportState.objects.filter(code__in=set_codes)}
+    # A set whose row has been deleted since it was imported is imported again, however unchanged its data.
+    import_states = {code: state for code, state in import_states.items() if code.lower() in cache[Set]}
+    # Load the sets that an interrupted import already committed
+    if resume:
+        committed = set(ImportCheckpoint.objects.values_list('code', flat=True))
+    else:
+        committed = set()
+        if checkpoint_every:
+            ImportCheckpoint.objects.all().delete()
 
-    # Process the data set-by-set
-    for code, data in sets_data.items():
+    # Process the data set-by-set, in a transaction for every `checkpoint_every` sets
+    set_rows = iter_set_rows(sets_data, import_states, force, workers, skip_codes=committed, report=report)
+    if staged:
+        # Decode every set before the transaction begins, so that it only lasts as long as the writes.
+        set_rows = [
+            (rows, content_hash, meta) for rows, content_hash, meta in set_rows
+            if set_codes is Everything or rows.code in set_codes
+        ]
+        with transaction.atomic():
+            if loader is not None and is_empty():
+                load_sets(cache, set_rows, set_codes, import_states, loader, report)
+            else:
+                write_staged_sets(cache, set_rows, import_states, report)
+            clean_up(report, clear_checkpoints=False)
+        return
 
-        # Skip sets that have not been chosen
-        if set_codes is not Everything and code not in set_codes:
-            continue
+    if loader is not None and not checkpoint_every and is_empty():
+        with transaction.atomic():
+            load_sets(cache, set_rows, set_codes, import_states, loader, report)
+    else:
+        write_sets(cache, set_rows, set_codes, import_states, committed, force, checkpoint_every, report)
+    clean_up(report, clear_checkpoints=checkpoint_every or resume)
 
-        # Create the set
-        magic_set, set_created = cache.get_or_create(Set, 'code', code, name=data['name'])
 
+def clean_up(report, clear_checkpoints):
+    """
+    Removes what is left over once the sets in `set_codes` have been written, and with
+    `clear_checkpoints`, the checkpoints of the import.
+    """
+    with transaction.atomic(), report.phase('cleanup') as stats:
+        # Clean up any supertypes, subtypes, and types that have no Cards left.
+        for model, num_deleted in prune_orphans().items():
+            report.record(model, deleted=num_deleted)
+            stats.rows += num_deleted
+
+        # The import is complete, so there is nothing left to resume.
+        if clear_checkpoints:
+            ImportCheckpoint.objects.all().delete()
+
+
+def write_sets(cache, set_rows, set_codes, import_states, committed, force, checkpoint_every, report):
+    """
+    Writes each set in `set_rows` to the database in turn, in a transaction for every
+    `checkpoint_every` sets.
+    """
+    while True:
+        with transaction.atomic():
+            num_sets = 0
+            for rows, content_hash, meta in itertools.islice(set_rows, checkpoint_every):
+                num_sets += 1
+                # Skip sets that have not been chosen, have been committed, or have not changed
+                if set_codes is not Everything and rows.code not in set_codes:
+                    continue
+                if rows.code in committed:
+                    continue
+                if force or not is_unchanged(import_states, rows.code, content_hash):
+                    write_set(cache, rows, report)
+                    record_import(import_states, rows.code, content_hash, meta)
+                    report.sets.append(rows.code)
+                    set_imported.send(sender=ImportReport, code=rows.code, report=report)
+                if checkpoint_every:
+                    ImportCheckpoint.objects.create(code=rows.code)
+        if not checkpoint_every or num_sets < checkpoint_every:
+            break
+
+
+def write_staged_sets(cache, staged_sets, import_states, report):
+    """
+    Writes all of `staged_sets`, a list of `(rows, content_hash, meta)` that have already been
+    decoded, with a fixed number of bulk queries per table rather than per set.
+
+    The result is the same as writing the sets one at a time: a card's fields and types are those of
+    its last printing, and a printing is only created if its set has no printing with the same uuid
+    (or without one, like it). Because the writes are not interleaved with reading the data, the
+    transaction they are made in is short, and readers see either the catalog from before the import
+    or the one after it.
+
+    In the report, a card that was created counts towards the first set it is in, and one that was
+    updated towards the last.
+    """
+    with report.phase('cards') as stats:
+        new_sets = OrderedDict()
+        for rows, content_hash, meta in staged_sets:
+            if rows.code.lower() not in cache[Set]:
+                new_sets.setdefault(rows.code.lower(), Set(code=rows.code, name=rows.name))
+        if new_sets:
+            for magic_set in bulk_upsert(Set, list(new_sets.values()), 'code', ['name']):
+                cache[Set][magic_set.code.lower()] = magic_set
+
+        card_rows = {}
+        first_codes = {}
+        last_codes = {}
+        for rows, content_hash, meta in staged_sets:
+            card_rows.update(rows.cards)
+            for name in rows.cards:
+                first_codes.setdefault(name, rows.code)
+                last_codes[name] = rows.code
+        cards, created_names, updated_names = upsert_cards(card_rows)
+        stats.rows += len(new_sets) + len(created_names) + len(updated_names)
+    with report.phase('types') as stats:
+        num_types = count_types(cache)
+        num_changed, retyped_names = assign_types(cache, cards, card_rows, created_names)
+        stats.rows += num_changed
+    for name in created_names:
+        report.record(Card, created=1, code=first_codes[name])
+    for name in (updated_names | retyped_names) - created_names:
+        report.record(Card, updated=1, code=last_codes[name])
+    record_types(report, cache, num_types)
+
+    with report.phase('artists') as stats:
+        num_created = cache.bulk_get_or_create(Artist, 'full_name', {
+            row.artist for rows, content_hash, meta in staged_sets for row in rows.printings if row.artist})
+        stats.rows += num_created
+    report.record(Artist, created=num_created)
+
+    with report.phase('printings') as stats:
+        codes = {rows.code.lower() for rows, content_hash, meta in staged_sets}
+        indexes = existing_printings([cache[Set][code] for code in codes if code not in new_sets])
         printings_to_create = []
+        printings_to_update = []
+        for rows, content_hash, meta in staged_sets:
+            magic_set = cache[Set][rows.code.lower()]
+            set_created = new_sets.pop(rows.code.lower(), None) is not None
+            to_create, to_update = build_printings(
+                cache, magic_set, set_created, cards, rows.printings, indexes[magic_set.pk])
+            report.record(Set, created=int(set_created), code=rows.code)
+            report.record(Printing, created=len(to_create), updated=len(to_update), code=rows.code)
+            printings_to_create.extend(to_create)
+            printings_to_update.extend(to_update)
+        save_printings(printings_to_create, printings_to_update)
+        stats.rows += len(printings_to_create) + len(printings_to_update)
 
-        # Create cards
-        all_cards_data = itertools.chain(
-            data['cards'],
-            data.get('tokens', []),
-        )
-        for card_data in all_cards_data:
-            # Skip tokens
-            layout = card_data['layout']
-            if layout in ('token', 'art_series'):
-                continue
-
-            # Card info
-            name = card_data['name']
-            mana_cost = card_data.get('manaCost', '')
-            text = card_data.get('text', '')
-            power = card_data.get('power', '')
-            toughness = card_data.get('toughness', '')
-            loyalty = card_data.get('loyalty', None)
-
-            # Check if this is a DFC
-            layout = card_data.get('layout')
-            if layout in ('transform', 'modal_dfc', 'double_faced_token'):
-                name = card_data.get('faceName', name)
-
-            card, created = Card.objects.update_or_create(
-                name=name, defaults={
-                    'mana_cost': mana_cost,
-                    'text': text,
-                    'power': power,
-                    'toughness': toughness,
-                    'loyalty': loyalty,
-                })
-            supertypes = card_data.get('supertypes', [])
-            types = card_data['types']
-            subtypes = card_data.get('subtypes', [])
-            if not created:
-                card.supertypes.clear()
-                card.types.clear()
-                card.subtypes.clear()
-            for supertype_name in supertypes:
-                supertype, _ = cache.get_or_create(CardSupertype, 'name', supertype_name)
-                card.supertypes.add(supertype)
-            for type_name in types:
-                card_type, _ = cache.get_or_create(CardType, 'name', type_name)
-                card.types.add(card_type)
-            for subtype_name in subtypes:
-                subtype, _ = cache.get_or_create(CardSubtype, 'name', subtype_name)
-                card.subtypes.add(subtype)
-
-            # Printing info
-            artist_name = card_data.get('artist') # Missing on certain cards
-            if artist_name:
-                artist, _ = Artist.objects.get_or_create(full_name=artist_name)
-            else:
-                artist = None
-            multiverse_id = card_data.get('multiverseId', None)  # Missing on certain sets
-            flavor_text = card_data.get('flavor', '')
-            rarity = card_data.get('rarity', '')  # Absent on tokens
-            number = card_data.get('number', '')  # Absent on old sets
-            # If the Set was just created, we don't need to check if the Printing already exists,
-            # and we can leverage bulk_create.
-            printing_kwargs = {
-                'card': card,
-                'set': magic_set,
-                'rarity': parse_rarity(rarity),
-                'flavor_text': flavor_text,
-                'artist': artist,
-                'number': number,
-                'multiverse_id': multiverse_id
-            }
-            if set_created:
-                printings_to_create.append(Printing(**printing_kwargs))
-            else:
-                # Use .filter().exists() followed by a create() instead of get_or_create,
-                # since these kwargs aren't unique for sets without proper multiverse_ids.
-                if not Printing.objects.filter(**printing_kwargs).exists():
-                    Printing.objects.create(**printing_kwargs)
-
-        if printings_to_create:
-            Printing.objects.bulk_create(printings_to_create)
-
-    # Remove extra Printings caused by data that is duplicated on MTGJSON.
-    # https://github.com/mtgjson/mtgjson/issues/388
-    if set_codes is Everything or 'BOK' in set_codes:
-        bugged_card_names = ['Jaraku the Interloper', 'Scarmaker']
-        for name in bugged_card_names:
-            extra_printings = Printing.objects.filter(
-                set__code='BOK', card__name=name)[1:].values_list(
-                    'pk', flat=True)
-            Printing.objects.filter(pk__in=list(extra_printings)).delete()
-
-    # Clean up any supertypes, subtypes, and types that have no Cards left.
-    for model in [CardSubtype, CardType, CardSupertype]:
-        for obj in model.objects.all():
-            if obj.card_set.count() == 0:
-                obj.delete()
-
-
-@transaction.atomic
-def import_cards(set_codes=Everything):
-    sets_data = fetch_data()
-    parse_data(sets_data, set_codes)
+    for rows, content_hash, meta in staged_sets:
+        record_import(import_states, rows.code, content_hash, meta)
+        report.sets.append(rows.code)
+    for rows, content_hash, meta in staged_sets:
+        set_imported.send(sender=ImportReport, code=rows.code, report=report)
+
+
+def is_empty():
+    """
+    Returns whether the database has no sets, cards, or printings yet.
+    """
+    return not any(model.objects.exists() for model in [Set, Card, Printing])
+
+
+def load_sets(cache, set_rows, set_codes, import_states, loader, report):
+    """
+    Imports the sets in `set_rows` into a database that has no sets, cards, or printings yet, with a
+    single bulk load of each table by `loader` once every set has been read.
+
+    The result is the same as writing the sets one at a time: a card's fields and types are those of
+    its last printing, and every printing is created. Primary keys are assigned in memory, so that
+    rows can refer to each other before they are loaded, and the database's sequences are moved past
+    them afterwards.
+    """
+    models = [Set, CardSupertype, CardType, CardSubtype, Artist, Card]
+    next_ids = {
+        model: itertools.count((model.objects.aggregate(max_id=Max('pk'))['max_id'] or 0) + 1)
+        for model in models
+    }
+    new_objs = defaultdict(list)
+
+    def get_or_add(model, field, value, **kwargs):
+        obj = cache[model].get(value.lower())
+        if obj is None:
+            kwargs[field] = value
+            obj = cache[model][value.lower()] = model(pk=next(next_ids[model]), **kwargs)
+            new_objs[model].append(obj)
+        return obj
+
+    card_rows = {}
+    card_ids = {}
+    printing_rows = []
+    uuids = set()
+    for rows, content_hash, meta in set_rows:
+        if set_codes is not Everything and rows.code not in set_codes:
+            continue
+        num_sets = len(new_objs[Set])
+        magic_set = get_or_add(Set, 'code', rows.code, name=rows.name)
+        report.record(Set, created=len(new_objs[Set]) - num_sets, code=rows.code)
+        num_cards = len(card_ids)
+        for name, row in rows.cards.items():
+            card_rows[name] = row
+            if name not in card_ids:
+                card_ids[name] = next(next_ids[Card])
+        report.record(Card, created=len(card_ids) - num_cards, code=rows.code)
+        num_printings = len(printing_rows)
+        for row in rows.printings:
+            if row.uuid is not None:
+                if row.uuid in uuids:
+                    continue
+                uuids.add(row.uuid)
+            artist = get_or_add(Artist, 'full_name', row.artist) if row.artist else None
+            printing_rows.append((
+                card_ids[row.card_name], magic_set.pk, row.rarity, row.flavor_text, artist.pk if artist else None,
+                row.number, row.multiverse_id, row.uuid))
+        report.record(Printing, created=len(printing_rows) - num_printings, code=rows.code)
+        record_import(import_states, rows.code, content_hash, meta)
+        report.sets.append(rows.code)
+
+    with report.phase('cards') as stats:
+        loader.insert(Set, ('id', 'name', 'code'), [(obj.pk, obj.name, obj.code) for obj in new_objs[Set]])
+        loader.insert(Card, ('id', 'name') + CARD_FIELDS, [
+            (card_ids[name], name) + tuple(getattr(row, field) for field in CARD_FIELDS)
+            for name, row in card_rows.items()
+        ])
+        stats.rows += len(new_objs[Set]) + len(card_rows)
+    with report.phase('types') as stats:
+        for attname, model in TYPE_RELATIONS:
+            relations = sorted({
+                (card_ids[name], get_or_add(model, 'name', type_name).pk)
+                for name, row in card_rows.items() for type_name in getattr(row, attname)
+            })
+            field = Card._meta.get_field(attname)
+            loader.insert(model, ('id', 'name'), [(obj.pk, obj.name) for obj in new_objs[model]])
+            loader.insert(field.remote_field.through, (field.m2m_column_name(), field.m2m_reverse_name()), relations)
+            stats.rows += len(new_objs[model]) + len(relations)
+    with report.phase('artists') as stats:
+        loader.insert(Artist, ('id', 'full_name'), [(obj.pk, obj.full_name) for obj in new_objs[Artist]])
+        stats.rows += len(new_objs[Artist])
+    with report.phase('printings') as stats:
+        loader.insert(Printing, (
+            'card_id', 'set_id', 'rarity', 'flavor_text', 'artist_id', 'number', 'multiverse_id', 'uuid'),
+            printing_rows)
+        stats.rows += len(printing_rows)
+    loader.reset_sequences(models)
+    for model in [CardSupertype, CardType, CardSubtype, Artist]:
+        report.record(model, created=len(new_objs[model]))
+
+    for code in report.sets:
+        set_imported.send(sender=ImportReport, code=code, report=report)
+
+
+def prune_orphans():
+    """
+    Deletes the supertypes, types, and subtypes that no longer have any Cards.
+
+    Each model is pruned with a single query, however many rows it has, unless something listens for
+    its `pre_delete` or `post_delete` signals, in which case it is pruned with `QuerySet.delete()` so
+    that they are sent. Returns a dictionary of the number of objects deleted, keyed by model.
+    """
+    deleted = {}
+    for attname, model in TYPE_RELATIONS:
+        if signals.pre_delete.has_listeners(model) or signals.post_delete.has_listeners(model):
+            _, num_deleted = model.objects.filter(card__isnull=True).delete()
+            deleted[model] = num_deleted.get(model._meta.label, 0)
+            continue
+        # Orphans have no through rows to cascade to, so a single NOT EXISTS statement deletes them,
+        # where QuerySet.delete() would fetch them and look for through rows first.
+        field = Card._meta.get_field(attname)
+        through = field.remote_field.through._meta
+        connection = connections[router.db_for_write(model)]
+        qn = connection.ops.quote_name
+        sql = 'DELETE FROM {table} WHERE NOT EXISTS (SELECT 1 FROM {through} WHERE {through}.{column} = {table}.{pk})'
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(
+                table=qn(model._meta.db_table),
+                pk=qn(model._meta.pk.column),
+                through=qn(through.db_table),
+                column=qn(through.get_field(field.m2m_reverse_field_name()).column),
+            ))
+            deleted[model] = cursor.rowcount
+    return deleted
+
+
+def import_cards(set_codes=Everything, source=None, force=False, workers=None, checkpoint_every=None,
+                 resume=False, fast_load=False, staged=False):
+    """
+    Imports the sets in `set_codes` (by default, all of them) from `source`.
+
+    Sets that are unchanged since they were last imported are skipped, unless `force` is set.
+    With `workers`, sets are decoded in that many processes while others are being written.
+
+    By default, the whole import happens in a single transaction. With `checkpoint_every`, it
+    commits after every that many sets instead, and an interrupted import can be continued from the
+    last commit with `resume` (which checkpoints every set unless told otherwise).
+
+    With `fast_load`, the first import into an empty database bypasses the ORM, and loads each table
+    at once with the fastest engine for the database (such as `COPY` on PostgreSQL). Into a database
+    that is not empty, the import is made as usual.
+
+    With `staged`, every set is decoded before anything is written, and the writes are then made in
+    one short transaction, so that the catalog is never locked or half-imported for long while the
+    data is downloaded and decoded. This holds every set in memory at once, and can't be combined
+    with `checkpoint_every`.
+
+    Returns an `ImportReport` of where the import's time went and what it wrote.
+    """
+    if staged and (checkpoint_every or resume):
+        raise ValueError("A staged import can't be checkpointed.")
+    set_files = get_source(source).iter_set_files(set_codes)
+    if resume and not checkpoint_every:
+        checkpoint_every = 1
+    if fast_load and not is_empty():
+        # The loader tunes the connection for speed over durability, which is only safe while there is
+        # no catalog to lose.
+        fast_load = False
+    if checkpoint_every:
+        return parse_data(set_files, set_codes, force=force, workers=workers,
+                          checkpoint_every=checkpoint_every, resume=resume)
+    if staged:
+        # The import starts its own transaction once the sets have been decoded.
+        if fast_load:
+            with get_bulk_loader(connections[router.db_for_write(Card)]) as loader:
+                return parse_data(set_files, set_codes, force=force, workers=workers, loader=loader, staged=True)
+        return parse_data(set_files, set_codes, force=force, workers=workers, staged=True)
+    if fast_load:
+        # The loader tunes the connection, which may only be possible outside of a transaction.
+        with get_bulk_loader(connections[router.db_for_write(Card)]) as loader, transaction.atomic():
+            return parse_data(set_files, set_codes, force=force, workers=workers, loader=loader)
+    with transaction.atomic():
+        return parse_data(set_files, set_codes, force=force, workers=workers)
 
 
 if __name__ == "__main__":
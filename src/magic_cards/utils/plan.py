@@ -0,0 +1,223 @@
+"""
+Plans an import without writing anything, by diffing the incoming data against the database in memory.
+"""
+from collections import OrderedDict, defaultdict
+
+from django.db import connections, router, transaction
+
+from magic_cards.models import (
+    Artist, Card, CardSubtype, CardSupertype, CardType, Printing, Set, SetImportState)
+from magic_cards.utils.import_cards import (
+    CARD_FIELDS, TYPE_LINE_FIELDS, TYPE_RELATIONS, PrintingIndex, add_moved_printings, iter_set_rows,
+    printing_fingerprint)
+from magic_cards.utils.report import ImportReport
+from magic_cards.utils.sources import Everything, get_source
+
+
+class ModelPlan(object):
+    """
+    The objects of one model that an import would create, update, or prune.
+    """
+
+    def __init__(self):
+        self.created = []
+        self.updated = []
+        self.pruned = []
+
+    def counts(self):
+        return OrderedDict([
+            ('created', len(self.created)),
+            ('updated', len(self.updated)),
+            ('pruned', len(self.pruned)),
+        ])
+
+    def as_dict(self):
+        return OrderedDict([
+            ('created', self.created),
+            ('updated', self.updated),
+            ('pruned', self.pruned),
+        ])
+
+
+class ImportPlan(object):
+    """
+    What an import would do, as returned by `plan_import`.
+
+    Indexing a plan by model gives its `ModelPlan`. Cards are identified by name, sets by code,
+    types and artists by name, and printings by `(set code, card name, number)`. Updated cards are
+    listed with the names of the fields that would change. `skipped` counts the sets that would be
+    skipped because they have not changed.
+    """
+    MODELS = (Set, Card, CardSupertype, CardType, CardSubtype, Artist, Printing)
+
+    def __init__(self):
+        self.models = OrderedDict((model, ModelPlan()) for model in self.MODELS)
+        self.skipped = 0
+
+    def __getitem__(self, model):
+        return self.models[model]
+
+    def counts(self):
+        return OrderedDict((model._meta.object_name, plan.counts()) for model, plan in self.models.items())
+
+    def as_dict(self):
+        return OrderedDict([
+            ('skipped', self.skipped),
+            ('counts', self.counts()),
+            ('models', OrderedDict(
+                (model._meta.object_name, plan.as_dict()) for model, plan in self.models.items())),
+        ])
+
+
+class Planner(object):
+    """
+    Holds the current state of the database in memory, and applies sets to it as an import would.
+    """
+
+    def __init__(self, using, set_codes=Everything):
+        self.plan = ImportPlan()
+        self.updated_cards = OrderedDict()
+        self.using = using
+
+        # Each of these is loaded with a single query.
+        self.set_codes = {code.lower() for code in Set.objects.using(using).values_list('code', flat=True)}
+        self.artists = {name.lower() for name in Artist.objects.using(using).values_list('full_name', flat=True)}
+        self.cards = {}
+        card_names = {}
+        for values in Card.objects.using(using).values_list('pk', 'name', *CARD_FIELDS).iterator():
+            card_names[values[0]] = values[1]
+            self.cards[values[1]] = dict(zip(CARD_FIELDS, values[2:]))
+
+        self.types = {}
+        self.card_types = defaultdict(lambda: {attname: set() for attname, model in TYPE_RELATIONS})
+        for attname, model in TYPE_RELATIONS:
+            names = dict(model.objects.using(using).values_list('pk', 'name'))
+            self.types[model] = {name.lower(): name for name in names.values()}
+            field = Card._meta.get_field(attname)
+            through = field.remote_field.through.objects.using(using)
+            for card_id, type_id in through.values_list(field.m2m_column_name(), field.m2m_reverse_name()).iterator():
+                self.card_types[card_names[card_id]][attname].add(names[type_id].lower())
+
+        printings = Printing.objects.using(using)
+        if set_codes is not Everything:
+            printings = printings.filter(set__code__in=set_codes)
+        self.printings = defaultdict(PrintingIndex)
+        for code, pk, printing_uuid, card_name, rarity, artist, number, multiverse_id, flavor_text in (
+                printings.values_list(
+                    'set__code', 'pk', 'uuid', 'card__name', 'rarity', 'artist__full_name', 'number',
+                    'multiverse_id', 'flavor_text').iterator()):
+            self.printings[code.lower()].add(pk, printing_uuid, printing_fingerprint(
+                card_name, rarity, artist.lower() if artist else None, number, multiverse_id, flavor_text))
+
+    def apply_set(self, rows):
+        """
+        Records what writing a set's `SetRows` would do, and updates the state to match.
+        """
+        set_created = rows.code.lower() not in self.set_codes
+        if set_created:
+            self.set_codes.add(rows.code.lower())
+            self.plan[Set].created.append(rows.code)
+
+        for name, row in rows.cards.items():
+            card = self.cards.get(name)
+            if card is None:
+                self.cards[name] = {field: getattr(row, field) for field in CARD_FIELDS}
+                self.plan[Card].created.append(name)
+                changed = []
+            else:
+                changed = [field for field in CARD_FIELDS if card[field] != getattr(row, field)]
+                card.update((field, getattr(row, field)) for field in changed)
+
+            card_types = self.card_types[name]
+            for attname, model in TYPE_RELATIONS:
+                wanted = set()
+                for type_name in getattr(row, attname):
+                    if type_name.lower() not in self.types[model]:
+                        self.types[model][type_name.lower()] = type_name
+                        self.plan[model].created.append(type_name)
+                    wanted.add(type_name.lower())
+                if wanted != card_types[attname]:
+                    card_types[attname] = wanted
+                    if card is not None:
+                        changed.append(attname)
+            if any(attname in changed for attname, model in TYPE_RELATIONS):
+                # The type line follows from the types, so it is only worth listing on its own.
+                changed = [field for field in changed if field not in TYPE_LINE_FIELDS]
+            if changed:
+                fields = self.updated_cards.setdefault(name, [])
+                fields.extend(field for field in changed if field not in fields)
+
+        for row in rows.printings:
+            if row.artist and row.artist.lower() not in self.artists:
+                self.artists.add(row.artist.lower())
+                self.plan[Artist].created.append(row.artist)
+
+        # As in `build_printings`, the printings of a new set without a uuid are not compared.
+        index = self.printings[rows.code.lower()]
+        add_moved_printings(
+            index, Printing.objects.using(self.using).exclude(set__code__iexact=rows.code), rows.printings)
+        for row in rows.printings:
+            if set_created and row.uuid is None:
+                action = PrintingIndex.CREATE
+            else:
+                action, pk = index.match(row.uuid, printing_fingerprint(
+                    row.card_name, row.rarity, row.artist.lower() if row.artist else None, row.number,
+                    row.multiverse_id, row.flavor_text))
+            if action == PrintingIndex.CREATE:
+                self.plan[Printing].created.append([rows.code, row.card_name, row.number])
+            elif action == PrintingIndex.UPDATE:
+                self.plan[Printing].updated.append([rows.code, row.card_name, row.number])
+
+    def finish(self):
+        """
+        Records the cards that would be updated, and the types that no card would use after the import.
+        """
+        self.plan[Card].updated = [{'name': name, 'fields': fields} for name, fields in self.updated_cards.items()]
+        for attname, model in TYPE_RELATIONS:
+            used = set()
+            for card_types in self.card_types.values():
+                used.update(card_types[attname])
+            self.plan[model].pruned = sorted(
+                name for key, name in self.types[model].items() if key not in used)
+
+
+def plan_data(sets_data, set_codes, force=False, workers=None, using=None):
+    """
+    Returns an `ImportPlan` of what `parse_data` would do with `sets_data`, without writing anything.
+
+    The current state of the database (by default, the one that cards are read from) is loaded in a
+    few bulk queries, inside a read-only transaction where the database supports one, so a replica
+    can be planned against.
+    """
+    if hasattr(sets_data, 'items'):
+        sets_data = sets_data.items()
+    using = using or router.db_for_read(Card)
+    connection = connections[using]
+
+    with transaction.atomic(using=using):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION READ ONLY')
+        planner = Planner(using, set_codes)
+        import_states = SetImportState.objects.using(using)
+        if set_codes is not Everything:
+            import_states = import_states.filter(code__in=set_codes)
+        import_states = {state.code: state for state in import_states if state.code.lower() in planner.set_codes}
+
+        report = ImportReport()
+        for rows, content_hash, meta in iter_set_rows(sets_data, import_states, force, workers, report=report):
+            if set_codes is not Everything and rows.code not in set_codes:
+                continue
+            planner.apply_set(rows)
+        planner.finish()
+
+    planner.plan.skipped = report.skipped
+    return planner.plan
+
+
+def plan_import(set_codes=Everything, source=None, force=False, workers=None, using=None):
+    """
+    Returns an `ImportPlan` of what `import_cards` would do with the same arguments.
+    """
+    set_files = get_source(source).iter_set_files(set_codes)
+    return plan_data(set_files, set_codes, force=force, workers=workers, using=using)
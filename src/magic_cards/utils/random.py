@@ -1,16 +1,89 @@
 import random
 
+try:
+    import numpy
+except ImportError:  # NumPy is optional, and only makes large batches faster
+    numpy = None
 
-def weighted_choice(choices):
+
+class WeightedSampler(object):
+    """
+    Draws labels at random in proportion to their weights, in constant time per draw.
+
+    `choices` is a dictionary with labels (buckets) as keys and weights (probabilities) as values.
+    The weights are turned into an alias table once, with Vose's method, so that each draw takes a
+    single random number however many labels there are. `rng` is the `random.Random` to draw with,
+    which makes the draws reproducible; by default, the `random` module's shared generator is used.
+    """
+
+    def __init__(self, choices, rng=None):
+        self.labels = []
+        weights = []
+        for label, weight in choices.items():
+            if weight < 0:
+                raise ValueError("Weights must not be negative")
+            self.labels.append(label)
+            weights.append(weight)
+        total = sum(weights)
+        if not total > 0:
+            raise ValueError("At least one weight must be positive")
+        self.rng = rng if rng is not None else random
+        self.probabilities, self.aliases = alias_table([weight / total for weight in weights])
+
+    def choice(self):
+        """
+        Returns a single label.
+        """
+        u = self.rng.random() * len(self.labels)
+        i = min(int(u), len(self.labels) - 1)
+        if u - i < self.probabilities[i]:
+            return self.labels[i]
+        return self.labels[self.aliases[i]]
+
+    def sample(self, num):
+        """
+        Returns a list of `num` labels, drawn independently, which are the same as `num` calls to
+        `choice()` would return. With NumPy, the alias table is looked up for all of them at once, but
+        the random numbers still come from `rng`, so that seeded draws don't depend on whether NumPy
+        is installed.
+        """
+        if numpy is None:
+            return [self.choice() for _ in range(num)]
+        u = numpy.fromiter((self.rng.random() for _ in range(num)), numpy.float64, num) * len(self.labels)
+        i = numpy.minimum(u.astype(numpy.intp), len(self.labels) - 1)
+        indexes = numpy.where(u - i < numpy.asarray(self.probabilities)[i], i, numpy.asarray(self.aliases)[i])
+        return [self.labels[index] for index in indexes.tolist()]
+
+
+def alias_table(probabilities):
+    """
+    Returns the probability and alias of each column of the alias table of `probabilities`, which
+    sum to 1, built with Vose's method.
+    """
+    n = len(probabilities)
+    scaled = [p * n for p in probabilities]
+    column_probabilities = [1.0] * n
+    aliases = list(range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        column_probabilities[less] = scaled[less]
+        aliases[less] = more
+        scaled[more] -= 1.0 - scaled[less]
+        if scaled[more] < 1.0:
+            small.append(more)
+        else:
+            large.append(more)
+    # Whatever is left is only short of 1 because of rounding, so it is always chosen.
+    return column_probabilities, aliases
+
+
+def weighted_choice(choices, rng=None):
     """
     Return a single element from a weighted sample.
 
     `choices` is a dictionary with labels (buckets) as keys and weights (probabilities) as values.
+    To draw from the same weights repeatedly, build a `WeightedSampler` once instead.
     """
-    total = sum(choices.values())
-    r = random.uniform(0, total)
-    items = sorted(choices.items(), key=lambda x: x[1])
-    for bucket, weight in items:
-        r -= weight
-        if r <= 0:
-            return bucket
+    return WeightedSampler(choices, rng).choice()
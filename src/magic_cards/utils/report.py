@@ -0,0 +1,208 @@
+"""
+Instrumentation for the importer: where an import's time, queries, and memory went.
+"""
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def peak_memory():
+    """
+    Returns the peak resident memory of this process so far, in bytes, or None if it is unknown.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, other platforms kilobytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def traced_peak():
+    """
+    Returns the peak memory traced by `tracemalloc` since this was last called, in bytes, or None if
+    memory is not being traced.
+    """
+    # Python 3.9 added reset_peak(), without which the peak can't be told apart from earlier ones.
+    if not tracemalloc.is_tracing() or not hasattr(tracemalloc, 'reset_peak'):
+        return None
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    return peak
+
+
+class PhaseStats(object):
+    """
+    Statistics for one phase of an import, accumulated over every set.
+
+    `peak_memory` is the most memory allocated at once while the phase ran, as traced by
+    `tracemalloc`. It is None unless memory was being traced.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.peak_memory = None
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            'seconds': self.seconds,
+            'queries': self.queries,
+            'rows': self.rows,
+            'rows_per_second': self.rows_per_second,
+            'peak_memory': self.peak_memory,
+        }
+
+
+class ModelChanges(object):
+    """
+    The number of objects of one model that an import created, updated, and deleted.
+    """
+
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.deleted = 0
+
+    def __bool__(self):
+        return bool(self.created or self.updated or self.deleted)
+
+    def as_dict(self):
+        return OrderedDict([
+            ('created', self.created),
+            ('updated', self.updated),
+            ('deleted', self.deleted),
+        ])
+
+
+class ImportReport(object):
+    """
+    A report of what an import did, as returned by `import_cards`.
+
+    `phases` holds the `PhaseStats` of each phase of the import. Time spent reading the source is
+    counted as `fetch`, decoding and normalizing sets as `decode`, and writing each kind of row
+    under its own name. `sets` lists the codes of the sets that were written, and `skipped` counts
+    the sets that were skipped because they had not changed.
+
+    `changes` holds the `ModelChanges` of each model, keyed by model name, as counted while the
+    import wrote them. `set_changes` breaks them down by set code, for the changes that belong to a
+    single set. When every set is written at once (a staged or bulk-loaded import), new types and
+    artists only count towards the totals.
+
+    `peak_memory` is the peak resident memory of the whole process, which includes whatever it used
+    before the import.
+    """
+    PHASES = ('fetch', 'decode', 'cards', 'types', 'artists', 'printings', 'cleanup')
+    MODELS = ('Set', 'Card', 'CardSupertype', 'CardType', 'CardSubtype', 'Artist', 'Printing')
+
+    def __init__(self):
+        self.phases = OrderedDict((name, PhaseStats(name)) for name in self.PHASES)
+        self.sets = []
+        self.skipped = 0
+        self.changes = OrderedDict((name, ModelChanges()) for name in self.MODELS)
+        self.set_changes = OrderedDict()
+        self.seconds = 0.0
+        self.queries = 0
+        self.peak_memory = None
+        self._active = []
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Counts the time and queries spent in this block towards the phase `name`.
+        """
+        stats = self.phases[name]
+        self._record_peak()
+        self._active.append(stats)
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            stats.seconds += time.perf_counter() - start
+            self._record_peak()
+            self._active.pop()
+
+    def _record_peak(self):
+        """
+        Counts the peak memory traced since this was last called towards every phase that is running.
+        """
+        peak = traced_peak()
+        if peak is None:
+            return
+        for stats in self._active:
+            stats.peak_memory = max(stats.peak_memory or 0, peak)
+
+    def timed(self, name, iterable):
+        """
+        Iterates over `iterable`, counting the time spent producing each item towards the phase `name`.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+            # Don't hold on to this item while the next one is produced.
+            del item
+
+    def record(self, model, created=0, updated=0, deleted=0, code=None):
+        """
+        Counts objects of `model` that the import created, updated, or deleted, towards the set
+        `code` as well if given.
+        """
+        counters = [self.changes[model._meta.object_name]]
+        if code is not None:
+            set_changes = self.set_changes.setdefault(
+                code, OrderedDict((name, ModelChanges()) for name in self.MODELS))
+            counters.append(set_changes[model._meta.object_name])
+        for changes in counters:
+            changes.created += created
+            changes.updated += updated
+            changes.deleted += deleted
+
+    @contextmanager
+    def measure(self, connection):
+        """
+        Measures the total time, queries, and memory of an import that runs in this block.
+        """
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(self._count_query):
+                yield self
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.peak_memory = peak_memory()
+
+    def _count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        if self._active:
+            self._active[-1].queries += 1
+        return execute(sql, params, many, context)
+
+    def as_dict(self):
+        return {
+            'seconds': self.seconds,
+            'queries': self.queries,
+            'peak_memory': self.peak_memory,
+            'sets': self.sets,
+            'skipped': self.skipped,
+            'changes': OrderedDict((name, changes.as_dict()) for name, changes in self.changes.items()),
+            'set_changes': OrderedDict(
+                (code, OrderedDict((name, changes.as_dict()) for name, changes in set_changes.items() if changes))
+                for code, set_changes in self.set_changes.items()),
+            'phases': OrderedDict((name, stats.as_dict()) for name, stats in self.phases.items()),
+        }
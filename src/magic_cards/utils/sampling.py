@@ -0,0 +1,168 @@
+"""
+Draws random samples of a queryset's rows without loading every primary key into Python.
+"""
+import math
+import random
+from array import array
+
+from django.db import connections
+from django.db.models import Max, Min
+from django.db.models.signals import post_save
+
+from magic_cards.signals import import_finished
+
+# Querysets with at most this many rows are sampled exactly, from a sorted list of their ids.
+EXACT_THRESHOLD = 1000
+# The most candidate ids that are checked against the database in a single query.
+PROBE_BATCH_SIZE = 500
+# The most queries that probing for a sample may take before another strategy is tried.
+PROBE_ROUNDS = 3
+# How many more rows than needed are drawn, to make up for those that are rejected.
+OVERSAMPLE = 2
+
+
+class IdCache(object):
+    """
+    The sorted primary keys of whole tables, kept in compact arrays so that repeated samples of a
+    table with sparse ids don't have to load them again.
+
+    A table's ids are dropped whenever an import finishes or a row is created through the ORM. Rows
+    deleted since the ids were cached are rejected like any other candidate that doesn't match.
+    """
+
+    def __init__(self):
+        self.ids = {}
+
+    def get(self, model, using):
+        key = (using, model._meta.db_table)
+        if key not in self.ids:
+            queryset = model._base_manager.using(using).order_by('pk').values_list('pk', flat=True)
+            self.ids[key] = array('q', queryset.iterator())
+        return self.ids[key]
+
+    def clear(self, sender=None, **kwargs):
+        if kwargs.get('created', True):
+            self.ids.clear()
+
+
+id_cache = IdCache()
+import_finished.connect(id_cache.clear, dispatch_uid='magic_cards.utils.sampling.import_finished')
+post_save.connect(id_cache.clear, sender='magic_cards.Printing', dispatch_uid='magic_cards.utils.sampling.post_save')
+
+
+def sample_ids(queryset, num, seed=None):
+    """
+    Returns a list of the primary keys of `num` distinct rows of `queryset`, chosen uniformly at
+    random. With the same `seed` and the same rows, the same sample is drawn.
+
+    The strategy depends on the size of the queryset and the database:
+
+    * A queryset with up to `EXACT_THRESHOLD` rows is sampled exactly from a sorted list of its ids.
+    * On PostgreSQL, a whole table is sampled with `TABLESAMPLE`.
+    * Otherwise, ids are drawn uniformly between the table's lowest and highest id, and those that
+      are not in the queryset are rejected, a batch at a time.
+    * If the ids are too sparse or the queryset too selective for that, candidates are drawn from a
+      cached array of the table's ids instead, and then, as a last resort, from the queryset's.
+
+    Raises `ValueError` if `queryset` has fewer than `num` rows, like `random.sample`.
+    """
+    rng = random.Random(seed)
+    num = int(num)
+    if num < 0:
+        raise ValueError("Sample larger than population or is negative")
+    if num == 0:
+        return []
+
+    query = queryset.query
+    if not query.can_filter() or query.distinct or query.combinator:
+        return exact_sample(queryset, num, rng)
+    ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:EXACT_THRESHOLD + 1])
+    if len(ids) <= EXACT_THRESHOLD:
+        return rng.sample(ids, num)
+
+    sampled = []
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql' and not query.has_filters():
+        sampled = tablesample(queryset, num, rng)
+    if len(sampled) < num:
+        sampled = probe(queryset, num, rng, sampled, range_draw(queryset, rng))
+    if len(sampled) < num:
+        sampled = probe(queryset, num, rng, sampled, cached_draw(queryset, rng))
+    if len(sampled) < num:
+        return exact_sample(queryset, num, rng)
+    return sampled
+
+
+def exact_sample(queryset, num, rng):
+    ids = sorted(queryset.values_list('pk', flat=True))
+    return rng.sample(ids, num)
+
+
+def tablesample(queryset, num, rng):
+    """
+    Returns up to `num` ids of the whole table of `queryset`, sampled by PostgreSQL's `TABLESAMPLE`.
+    """
+    connection = connections[queryset.db]
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    column = connection.ops.quote_name(queryset.model._meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [table])
+        row = cursor.fetchone()
+        # The table's size is only estimated once it has been analyzed.
+        if row is None or row[0] <= 0:
+            return []
+        percent = min(100.0, 100.0 * num * OVERSAMPLE / row[0])
+        cursor.execute('SELECT {} FROM {} TABLESAMPLE BERNOULLI (%s) REPEATABLE (%s) ORDER BY 1'.format(
+            column, table), [percent, rng.randrange(2 ** 31)])
+        ids = [row[0] for row in cursor.fetchall()]
+    return rng.sample(ids, min(num, len(ids)))
+
+
+def range_draw(queryset, rng):
+    """
+    Returns a function that draws candidate ids uniformly between the lowest and highest id of the
+    table of `queryset`.
+    """
+    bounds = queryset.model._base_manager.using(queryset.db).aggregate(low=Min('pk'), high=Max('pk'))
+
+    def draw(size):
+        if bounds['low'] is None:
+            return []
+        return [rng.randint(bounds['low'], bounds['high']) for _ in range(size)]
+    return draw
+
+
+def cached_draw(queryset, rng):
+    """
+    Returns a function that draws candidate ids from the cached ids of the table of `queryset`.
+    """
+    ids = id_cache.get(queryset.model, queryset.db)
+
+    def draw(size):
+        return rng.sample(ids, min(size, len(ids)))
+    return draw
+
+
+def probe(queryset, num, rng, sampled, draw):
+    """
+    Adds the ids drawn by `draw` that are rows of `queryset` to the list `sampled`, until it holds
+    `num` ids or `PROBE_ROUNDS` queries have been made, and returns it.
+    """
+    found = set(sampled)
+    acceptance = 1.0
+    for _ in range(PROBE_ROUNDS):
+        needed = num - len(sampled)
+        size = min(PROBE_BATCH_SIZE, int(math.ceil(needed * OVERSAMPLE / acceptance)))
+        candidates = []
+        for candidate in draw(size):
+            if candidate not in found:
+                found.add(candidate)
+                candidates.append(candidate)
+        if not candidates:
+            continue
+        matches = set(queryset.filter(pk__in=candidates).values_list('pk', flat=True))
+        sampled.extend(candidate for candidate in candidates if candidate in matches)
+        if len(sampled) >= num:
+            return sampled[:num]
+        acceptance = max(len(matches) / len(candidates), 1.0 / PROBE_BATCH_SIZE)
+    return sampled
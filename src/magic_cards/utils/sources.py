@@ -0,0 +1,571 @@
+"""
+Sources of MTGJSON set data for the importer.
+
+Every source yields `(code, data)` for each set it contains, decoding one set at a time.
+"""
+import hashlib
+import json
+import mmap
+import os
+import re
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+import requests
+from django.conf import settings
+
+MTG_JSON_URL = 'https://mtgjson.com/api/v5/AllSetFiles.zip'
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_ATTEMPTS = 3
+RANGE_BLOCK_SIZE = 64 * 1024
+RANGE_WORKERS = 4
+
+PEEK_SIZE = 4096
+
+_CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+_SET_FILE_NAME = re.compile(r'^([A-Za-z0-9]+)_?\.json$')
+_SET_CODE = re.compile(br'"code"\s*:\s*"([^"\\]+)"')
+_WHITESPACE = re.compile(br'[ \t\n\r]*')
+_STRING = re.compile(br'"[^"\\]*(?:\\.[^"\\]*)*"')
+_SCALAR = re.compile(br'[^,}\]\s]+')
+_BRACKETS = re.compile(br'"[^"\\]*(?:\\.[^"\\]*)*"|([\[{])|([\]}])')
+
+
+class Everything:
+    """
+    Sentinel value for downloading all sets (i.e. skipping nothing).
+    """
+    pass
+
+
+def download_archive(url=MTG_JSON_URL):
+    """
+    Streams the archive at `url` to an anonymous temporary file, which is returned rewound.
+    """
+    archive_file = tempfile.TemporaryFile()
+    with closing(requests.get(url, stream=True)) as r:
+        r.raise_for_status()
+        for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            archive_file.write(chunk)
+    archive_file.seek(0)
+    return archive_file
+
+
+class DownloadCache(object):
+    """
+    An on-disk cache of downloaded files in `directory`, keyed by URL.
+
+    A cached file is revalidated with `If-None-Match` and `If-Modified-Since` each time it is
+    fetched, so an unchanged file costs a single request. Files are streamed to disk in chunks, and
+    a download that is interrupted is resumed with a `Range` request where the server allows it.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def paths(self, url):
+        """
+        Returns the paths of the cached file for `url`, its partial download, and its metadata.
+        """
+        base = os.path.join(self.directory, hashlib.sha256(url.encode('utf-8')).hexdigest())
+        return base, base + '.part', base + '.json'
+
+    def fetch(self, url):
+        """
+        Returns the path of an up-to-date copy of the file at `url`, downloading it if necessary.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        for attempt in range(DOWNLOAD_ATTEMPTS):
+            try:
+                return self._fetch(url)
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError):
+                if attempt == DOWNLOAD_ATTEMPTS - 1:
+                    raise
+
+    def _fetch(self, url):
+        path, part_path, meta_path = self.paths(url)
+        meta = read_json(meta_path)
+        headers = {}
+        offset = 0
+        if meta.get('complete') and os.path.exists(path):
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        elif (meta.get('etag') or meta.get('last_modified')) and os.path.exists(part_path):
+            offset = os.path.getsize(part_path)
+            headers['Range'] = 'bytes={}-'.format(offset)
+            headers['If-Range'] = meta.get('etag') or meta['last_modified']
+
+        with closing(requests.get(url, headers=headers, stream=True)) as r:
+            if r.status_code == 304:
+                return path
+            if r.status_code == 416:
+                # The partial download can't be resumed, so start over.
+                os.remove(part_path)
+                return self._fetch(url)
+            r.raise_for_status()
+            if r.status_code != 206:
+                # The server sent the whole file, so start over.
+                offset = 0
+                meta = {
+                    'url': url,
+                    'etag': r.headers.get('ETag'),
+                    'last_modified': r.headers.get('Last-Modified'),
+                    'complete': False,
+                }
+                write_json(meta_path, meta)
+            expected_size = offset + int(r.headers.get('Content-Length', 0))
+            with open(part_path, 'ab' if offset else 'wb') as part_file:
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    part_file.write(chunk)
+                size = part_file.tell()
+        if size < expected_size:
+            raise requests.ConnectionError(
+                "Download of {} ended after {} of {} bytes.".format(url, size, expected_size))
+
+        os.replace(part_path, path)
+        meta['complete'] = True
+        write_json(meta_path, meta)
+        return path
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_json(path, value):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(value, f)
+    os.replace(path + '.tmp', path)
+
+
+class RangeNotSupported(Exception):
+    """
+    Raised when a server does not support range requests for a file.
+    """
+    pass
+
+
+def fetch_range(url, start, end):
+    """
+    Returns the bytes from `start` up to `end` of the file at `url`, with a range request.
+    """
+    with closing(requests.get(url, headers={'Range': 'bytes={}-{}'.format(start, end - 1)}, stream=True)) as r:
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise RangeNotSupported(url)
+        data = r.content
+    if len(data) != end - start:
+        raise requests.ConnectionError(
+            "Range {}-{} of {} returned {} bytes.".format(start, end - 1, url, len(data)))
+    return data
+
+
+class RemoteFile(object):
+    """
+    A read-only, seekable file at `url` that is read with range requests, e.g. for `zipfile`.
+
+    Opening it fetches the last `RANGE_BLOCK_SIZE` bytes, where a zip archive keeps its central
+    directory. Other reads are served from the spans of the file that have been fetched ahead of
+    time with `prefetch`, or else fetch at least a block from the server. Raises `RangeNotSupported`
+    if the server would send the whole file instead.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.position = 0
+        self.spans = {}
+        headers = {'Range': 'bytes=-{}'.format(RANGE_BLOCK_SIZE)}
+        with closing(requests.get(url, headers=headers, stream=True)) as r:
+            r.raise_for_status()
+            match = _CONTENT_RANGE.match(r.headers.get('Content-Range', ''))
+            if r.status_code != 206 or not match:
+                raise RangeNotSupported(url)
+            start, _, self.size = (int(value) for value in match.groups())
+            self.spans[start] = r.content
+
+    def prefetch(self, start, data):
+        self.spans[start] = data
+
+    def discard(self, start):
+        self.spans.pop(start, None)
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self.position = offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.size, self.position + size)
+        if end <= self.position:
+            return b''
+        for start, data in self.spans.items():
+            if start <= self.position and end <= start + len(data):
+                break
+        else:
+            start = self.position
+            data = fetch_range(self.url, start, min(self.size, max(end, start + RANGE_BLOCK_SIZE)))
+            self.spans[start] = data
+        result = data[self.position - start:end - start]
+        self.position = end
+        return result
+
+    def close(self):
+        self.spans.clear()
+
+
+class MappedFile(mmap.mmap):
+    """
+    A read-only memory map that can stand in for a file object, e.g. for `zipfile`.
+    """
+
+    def seekable(self):
+        return True
+
+
+def map_file(path):
+    """
+    Memory-maps the file at `path` for reading.
+    """
+    with open(path, 'rb') as f:
+        return MappedFile(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class SetFile(object):
+    """
+    A single set's MTGJSON file, which is only decoded on demand.
+
+    `raw` holds the file's bytes; for a memory-mapped file, these are only valid until the source
+    moves on to the next set. `code` is the set's code if it is known before decoding, e.g. from the
+    file's name, and `meta` is MTGJSON's metadata (such as its version), once it is known.
+    """
+
+    def __init__(self, raw, code=None, meta=None):
+        self.raw = raw
+        self.code = code
+        self.meta = meta or {}
+
+    @property
+    def content_hash(self):
+        return hashlib.sha256(self.raw).hexdigest()
+
+    def decode(self):
+        """
+        Decodes the file, returning a tuple of `(code, data)`.
+        """
+        this_set = json.loads(str(self.raw, 'utf-8'))
+        self.meta = this_set.get("meta", {})
+        self.code = this_set["data"]["code"]
+        return self.code, this_set["data"]
+
+
+class SetValue(SetFile):
+    """
+    A single set's value from AllPrintings.json, which is the set's data alone.
+    """
+
+    def decode(self):
+        return self.code, json.loads(str(self.raw, 'utf-8'))
+
+
+def set_code_from_filename(filename):
+    """
+    Returns the set code that names a set file, or None if the name is not a set code.
+
+    Set files whose code is a reserved name on Windows have an underscore appended, e.g. `CON_.json`.
+    """
+    match = _SET_FILE_NAME.match(os.path.basename(filename))
+    return match.group(1) if match else None
+
+
+def peek_set_code(header):
+    """
+    Returns the set code found in the first bytes of a set file, or None if it is not there.
+    """
+    match = _SET_CODE.search(header)
+    return match.group(1).decode('utf-8') if match else None
+
+
+def normalize_set_codes(set_codes):
+    if set_codes is Everything:
+        return Everything
+    return {code.upper() for code in set_codes}
+
+
+def is_wanted(code, set_codes):
+    """
+    Returns whether a file whose set code appears to be `code` must be decoded for `set_codes`.
+
+    Files with an unknown code are always decoded.
+    """
+    return set_codes is Everything or code is None or code.upper() in set_codes
+
+
+def iter_archive_files(archive_file, set_codes=Everything):
+    """
+    Yields a `SetFile` for each set in a zipped MTGJSON archive.
+
+    When `set_codes` is given, members are picked by file name (or failing that, by the start of
+    their contents), and other sets are never decompressed.
+    """
+    set_codes = normalize_set_codes(set_codes)
+    with zipfile.ZipFile(archive_file) as archive:
+        for zipinfo in archive.infolist():
+            code = set_code_from_filename(zipinfo.filename)
+            if set_codes is not Everything:
+                if code is None:
+                    with archive.open(zipinfo) as member:
+                        code = peek_set_code(member.read(PEEK_SIZE))
+                if not is_wanted(code, set_codes):
+                    continue
+            yield SetFile(archive.read(zipinfo), code)
+
+
+def iter_archive(archive_file, set_codes=Everything):
+    """
+    Yields `(code, data)` for each set in a zipped MTGJSON archive.
+
+    Sets are decoded one at a time, so only the set currently being consumed is held in memory.
+    """
+    for set_file in iter_archive_files(archive_file, set_codes):
+        yield set_file.decode()
+
+
+def _skip_whitespace(buf, idx):
+    return _WHITESPACE.match(buf, idx).end()
+
+
+def _consume(buf, idx, char):
+    idx = _skip_whitespace(buf, idx)
+    if buf[idx:idx + 1] != char:
+        raise ValueError("Expecting {!r} at position {}".format(char.decode('ascii'), idx))
+    return _skip_whitespace(buf, idx + 1)
+
+
+def _value_end(buf, idx):
+    """
+    Returns the position just past the JSON value that starts at `buf[idx]`.
+    """
+    if buf[idx:idx + 1] not in (b'{', b'['):
+        return (_STRING.match(buf, idx) or _SCALAR.match(buf, idx)).end()
+    depth = 0
+    for match in _BRACKETS.finditer(buf, idx):
+        if match.lastindex == 1:
+            depth += 1
+        elif match.lastindex == 2:
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    raise ValueError("Unterminated JSON value at position {}".format(idx))
+
+
+def iter_members(buf, idx=0, nested=(), parent=None):
+    """
+    Yields `(parent, key, start, end)` for each member of the JSON object that starts at `buf[idx]`,
+    where `buf[start:end]` is the member's value, still encoded, and returns the position just past
+    the object.
+
+    Only the keys are decoded, so a large document can be walked without loading all of it. The value
+    of a member whose key is in `nested` must be an object, and its own members are yielded in its
+    place, with that key as their `parent`. It is scanned once, as its members are reached, rather
+    than skipped over first.
+    """
+    idx = _consume(buf, idx, b'{')
+    if buf[idx:idx + 1] == b'}':
+        return idx + 1
+    while True:
+        match = _STRING.match(buf, idx)
+        if not match:
+            raise ValueError("Expecting property name at position {}".format(idx))
+        key = json.loads(match.group().decode('utf-8'))
+        start = _consume(buf, match.end(), b':')
+        if key in nested:
+            end = yield from iter_members(buf, start, parent=key)
+        else:
+            end = _value_end(buf, start)
+            yield parent, key, start, end
+        idx = _skip_whitespace(buf, end)
+        if buf[idx:idx + 1] == b'}':
+            return idx + 1
+        idx = _consume(buf, idx, b',')
+
+
+class SetSource(object):
+    """
+    Base class for a source of MTGJSON set data.
+
+    Iterating over a source yields `(code, data)` for each set it contains. Subclasses implement
+    `iter_set_files`, which yields each set's `SetFile` before it is decoded. Both may be given the
+    codes of the sets that are wanted, so that the others can be skipped without decoding them;
+    they may still yield some sets that were not asked for.
+    """
+
+    def iter_set_files(self, set_codes=Everything):
+        raise NotImplementedError
+
+    def iter_sets(self, set_codes=Everything):
+        for set_file in self.iter_set_files(set_codes):
+            yield set_file.decode()
+
+    def __iter__(self):
+        return self.iter_sets()
+
+
+class RemoteArchiveSource(SetSource):
+    """
+    An AllSetFiles.zip archive downloaded from `url`.
+
+    With `cache_dir`, the archive is kept in a `DownloadCache` in that directory, and is only
+    downloaded again when it has changed.
+    """
+
+    def __init__(self, url=MTG_JSON_URL, cache_dir=None):
+        self.url = url
+        self.cache_dir = cache_dir
+
+    def iter_set_files(self, set_codes=Everything):
+        if self.cache_dir:
+            archive_file = map_file(DownloadCache(self.cache_dir).fetch(self.url))
+        else:
+            archive_file = download_archive(self.url)
+        with closing(archive_file):
+            yield from iter_archive_files(archive_file, set_codes)
+
+
+class RemoteZipSource(RemoteArchiveSource):
+    """
+    An AllSetFiles.zip archive at `url`, from which only the wanted sets are fetched.
+
+    The archive's central directory is read with a range request, and then the byte ranges of the
+    wanted members are fetched, `RANGE_WORKERS` at a time. When every set is wanted, or the server
+    does not support range requests, the whole archive is downloaded instead.
+    """
+
+    def iter_set_files(self, set_codes=Everything):
+        if set_codes is Everything:
+            yield from super().iter_set_files(set_codes)
+            return
+        try:
+            remote_file = RemoteFile(self.url)
+        except RangeNotSupported:
+            yield from super().iter_set_files(set_codes)
+            return
+
+        set_codes = normalize_set_codes(set_codes)
+        with closing(remote_file), zipfile.ZipFile(remote_file) as archive:
+            # Each member runs from its local header up to the next member, or the central directory.
+            offsets = sorted(zipinfo.header_offset for zipinfo in archive.infolist()) + [archive.start_dir]
+            ends = dict(zip(offsets, offsets[1:]))
+            wanted = deque(
+                zipinfo for zipinfo in archive.infolist()
+                if is_wanted(set_code_from_filename(zipinfo.filename), set_codes))
+
+            with ThreadPoolExecutor(RANGE_WORKERS) as executor:
+                pending = deque()
+                while wanted or pending:
+                    while wanted and len(pending) < 2 * RANGE_WORKERS:
+                        zipinfo = wanted.popleft()
+                        start = zipinfo.header_offset
+                        pending.append((zipinfo, executor.submit(fetch_range, self.url, start, ends[start])))
+                    zipinfo, future = pending.popleft()
+                    remote_file.prefetch(zipinfo.header_offset, future.result())
+                    try:
+                        yield SetFile(archive.read(zipinfo), set_code_from_filename(zipinfo.filename))
+                    finally:
+                        remote_file.discard(zipinfo.header_offset)
+
+
+class ZipArchiveSource(SetSource):
+    """
+    A local copy of AllSetFiles.zip.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def iter_set_files(self, set_codes=Everything):
+        with closing(map_file(self.path)) as mapped:
+            yield from iter_archive_files(mapped, set_codes)
+
+
+class DirectorySource(SetSource):
+    """
+    A directory of individual set files, such as an unpacked AllSetFiles.zip.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def iter_set_files(self, set_codes=Everything):
+        set_codes = normalize_set_codes(set_codes)
+        for filename in sorted(os.listdir(self.path)):
+            path = os.path.join(self.path, filename)
+            if not filename.endswith('.json') or not os.path.isfile(path):
+                continue
+            code = set_code_from_filename(filename)
+            if not is_wanted(code, set_codes):
+                continue
+            with closing(map_file(path)) as mapped:
+                if code is None and not is_wanted(peek_set_code(mapped[:PEEK_SIZE]), set_codes):
+                    continue
+                yield SetFile(mapped, code)
+
+
+class AllPrintingsSource(SetSource):
+    """
+    A single AllPrintings.json file, containing every set keyed by code.
+
+    The file is scanned in place and each set's value is decoded on its own.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def iter_set_files(self, set_codes=Everything):
+        set_codes = normalize_set_codes(set_codes)
+        meta = {}
+        with closing(map_file(self.path)) as mapped:
+            for parent, key, start, end in iter_members(mapped, nested={'data'}):
+                if parent is None and key == 'meta':
+                    meta = json.loads(str(mapped[start:end], 'utf-8'))
+                elif parent == 'data' and is_wanted(key, set_codes):
+                    yield SetValue(mapped[start:end], key, meta)
+
+
+def get_source(source=None):
+    """
+    Returns the `SetSource` for `source`.
+
+    `source` may be an existing `SetSource`, a URL, or the path to a zip archive, a directory of set
+    files, or an AllPrintings.json file. By default, the latest archive is downloaded from MTGJSON.
+    Downloads are cached in the directory named by the `MAGIC_CARDS_CACHE_DIR` setting, if any.
+    """
+    cache_dir = getattr(settings, 'MAGIC_CARDS_CACHE_DIR', None)
+    if source is None:
+        return RemoteZipSource(cache_dir=cache_dir)
+    if isinstance(source, SetSource):
+        return source
+    if '://' in source:
+        return RemoteZipSource(source, cache_dir=cache_dir)
+    if os.path.isdir(source):
+        return DirectorySource(source)
+    if zipfile.is_zipfile(source):
+        return ZipArchiveSource(source)
+    return AllPrintingsSource(source)
@@ -0,0 +1,98 @@
+"""
+A deterministic generator of synthetic MTGJSON set data, for benchmarking the importer.
+"""
+import json
+import random
+import uuid
+import zipfile
+from collections import OrderedDict
+
+SUPERTYPES = ['Legendary', 'Basic', 'Snow', 'World']
+TYPES = ['Artifact', 'Creature', 'Enchantment', 'Instant', 'Sorcery', 'Land', 'Planeswalker']
+RARITIES = ['common', 'common', 'common', 'uncommon', 'uncommon', 'rare', 'mythic']
+COLORS = 'WUBRG'
+
+
+def generate_sets(num_sets=10, cards_per_set=100, reprint_ratio=0.2, type_variety=10, seed=0):
+    """
+    Returns an ordered dictionary of the MTGJSON data of `num_sets` synthetic sets, keyed by code.
+
+    Each set has `cards_per_set` printings. After the first set, each printing is a reprint of a
+    card from an earlier set with probability `reprint_ratio`, and otherwise a new card. Cards draw
+    their subtypes from a pool of `type_variety` names, and their artists from a pool of a similar
+    size. The same arguments always produce the same data.
+    """
+    rng = random.Random(seed)
+    subtypes = ['Subtype {}'.format(i) for i in range(type_variety)]
+    artists = ['Artist {}'.format(i) for i in range(max(type_variety, 1) * 3)]
+
+    card_pool = []
+    sets_data = OrderedDict()
+    multiverse_id = 1
+    for set_index in range(num_sets):
+        code = 'Z{:03d}'.format(set_index)
+        reprintable = list(card_pool)
+        cards = []
+        for i in range(cards_per_set):
+            if reprintable and rng.random() < reprint_ratio:
+                card = dict(rng.choice(reprintable))
+            else:
+                card = generate_card(rng, '{} Card {}'.format(code, i), subtypes)
+                card_pool.append(card)
+                card = dict(card)
+            card.update({
+                'rarity': rng.choice(RARITIES),
+                'number': str(i + 1),
+                'artist': rng.choice(artists),
+                'multiverseId': multiverse_id,
+                'uuid': str(uuid.uuid5(uuid.NAMESPACE_OID, '{}/{}'.format(code, i + 1))),
+            })
+            if rng.random() < 0.5:
+                card['flavor'] = 'Flavor text of printing {}.'.format(multiverse_id)
+            multiverse_id += 1
+            cards.append(card)
+        sets_data[code] = {
+            'name': 'Benchmark Set {}'.format(code),
+            'code': code,
+            'cards': cards,
+        }
+    return sets_data
+
+
+def generate_card(rng, name, subtypes):
+    """
+    Returns the Oracle fields of a new card called `name`.
+    """
+    types = [rng.choice(TYPES)]
+    if types[0] == 'Creature' and rng.random() < 0.2:
+        types.insert(0, 'Artifact')
+    supertypes = [rng.choice(SUPERTYPES)] if rng.random() < 0.1 else []
+    card_subtypes = sorted(set(rng.sample(subtypes, min(len(subtypes), rng.randint(0, 2)))))
+    card = {
+        'name': name,
+        'layout': 'normal',
+        'manaCost': '{{{}}}{{{}}}'.format(rng.randint(0, 6), rng.choice(COLORS)),
+        'type': ' '.join(supertypes + types) + (' — ' + ' '.join(card_subtypes) if card_subtypes else ''),
+        'supertypes': supertypes,
+        'types': types,
+        'subtypes': card_subtypes,
+        'text': 'Rules text of {}.'.format(name),
+        'identifiers': {'scryfallOracleId': str(uuid.uuid5(uuid.NAMESPACE_OID, name))},
+    }
+    if 'Creature' in types:
+        card['power'] = str(rng.randint(0, 8))
+        card['toughness'] = str(rng.randint(1, 8))
+    if 'Planeswalker' in types:
+        card['loyalty'] = rng.randint(2, 7)
+    return card
+
+
+def write_archive(sets_data, archive_file):
+    """
+    Writes `sets_data` in the format of MTGJSON's AllSetFiles.zip to `archive_file`, which may be a
+    path or a file object.
+    """
+    with zipfile.ZipFile(archive_file, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for code, data in sets_data.items():
+            archive.writestr('{}.json'.format(code), json.dumps({'meta': {}, 'data': data}))
+    return archive_file
@@ -0,0 +1,112 @@
+"""
+Benchmarks of the importer on synthetic data, and comparisons of their results.
+"""
+import copy
+import platform
+from collections import OrderedDict
+
+import django
+from django.db import connection, transaction
+
+from magic_cards.utils.import_cards import Everything, parse_data
+from tests.benchmarks.generator import generate_sets
+
+# Each scenario runs after the previous one, against the same database.
+SCENARIOS = ('initial', 'unchanged', 'updated')
+
+
+def updated_sets(sets_data, every=10):
+    """
+    Returns a copy of `sets_data` in which the text of every `every`th card of each set has changed.
+    """
+    sets_data = copy.deepcopy(sets_data)
+    for data in sets_data.values():
+        for card_data in data['cards'][::every]:
+            card_data['text'] = card_data.get('text', '') + ' Updated.'
+    return sets_data
+
+
+def summarize(report, num_printings):
+    """
+    Summarizes an `ImportReport` of importing `num_printings` printings.
+    """
+    return OrderedDict([
+        ('seconds', report.seconds),
+        ('queries', report.queries),
+        ('rows', sum(stats.rows for stats in report.phases.values())),
+        ('printings_per_second', num_printings / report.seconds if report.seconds else 0.0),
+        ('phases', report.as_dict()['phases']),
+    ])
+
+
+def run_scenarios(sets_data, repeat=1):
+    """
+    Imports `sets_data` into an empty database, again unchanged, and again with some cards updated,
+    returning the summary of each scenario's fastest run out of `repeat`.
+
+    Each run is rolled back afterwards, so the database must start empty.
+    """
+    num_printings = sum(len(data['cards']) for data in sets_data.values())
+    scenario_data = {
+        'initial': sets_data,
+        'unchanged': sets_data,
+        'updated': updated_sets(sets_data),
+    }
+    results = OrderedDict()
+    for _ in range(repeat):
+        with transaction.atomic():
+            for name in SCENARIOS:
+                summary = summarize(parse_data(scenario_data[name], Everything), num_printings)
+                if name not in results or summary['seconds'] < results[name]['seconds']:
+                    results[name] = summary
+            transaction.set_rollback(True)
+    return results
+
+
+def run_benchmark(config, repeat=1):
+    """
+    Runs the scenarios on the sets generated from `config` (the arguments of `generate_sets`),
+    returning the results along with what they were measured on.
+    """
+    return OrderedDict([
+        ('config', config),
+        ('environment', OrderedDict([
+            ('database', connection.vendor),
+            ('python', platform.python_version()),
+            ('django', django.get_version()),
+        ])),
+        ('scenarios', run_scenarios(generate_sets(**config), repeat)),
+    ])
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Compares two benchmark results, returning a tuple of the lines of a report and whether any
+    scenario regressed.
+
+    A scenario regressed if it took more than `threshold` (as a fraction) longer than in
+    `baseline`, or ran more queries.
+    """
+    lines = []
+    regressed = False
+    if baseline.get('config') != current.get('config'):
+        lines.append("Warning: the results were generated from different data.")
+    if baseline.get('environment') != current.get('environment'):
+        lines.append("Warning: the results were measured in different environments.")
+
+    row_format = '{:<10} {:>10} {:>10} {:>8} {:>8} {:>8} {}'
+    lines.append(row_format.format('Scenario', 'Before (s)', 'After (s)', 'Change', 'Queries', 'Before', ''))
+    for name, after in current['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            lines.append(row_format.format(
+                name, '-', '{:.3f}'.format(after['seconds']), '', after['queries'], '-', ''))
+            continue
+        change = (after['seconds'] - before['seconds']) / before['seconds'] if before['seconds'] else 0.0
+        scenario_regressed = change > threshold or after['queries'] > before['queries']
+        regressed = regressed or scenario_regressed
+        lines.append(row_format.format(
+            name, '{:.3f}'.format(before['seconds']), '{:.3f}'.format(after['seconds']),
+            '{:+.1%}'.format(change), after['queries'], before['queries'],
+            'REGRESSION' if scenario_regressed else ''))
+    return lines, regressed
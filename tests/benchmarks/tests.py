@@ -0,0 +1,130 @@
+import time
+
+from django.test import SimpleTestCase, TestCase
+
+from magic_cards.models import Card, CardSubtype, CardSupertype, CardType, Printing, Set
+from magic_cards.utils.import_cards import Everything, parse_data
+from tests.benchmarks.generator import generate_sets
+from tests.benchmarks.runner import SCENARIOS, compare, run_benchmark
+
+# The most queries that importing a set may take, however many cards it has.
+QUERIES_PER_SET = 13
+# The most queries that an import may take besides those of its sets and of creating new types.
+QUERIES_PER_IMPORT = 20
+
+
+class GeneratorTests(SimpleTestCase):
+
+    def test_deterministic(self):
+        self.assertEqual(generate_sets(3, 20, seed=1), generate_sets(3, 20, seed=1))
+        self.assertNotEqual(generate_sets(3, 20, seed=1), generate_sets(3, 20, seed=2))
+
+    def test_size(self):
+        sets_data = generate_sets(4, 25)
+
+        self.assertEqual(list(sets_data), ['Z000', 'Z001', 'Z002', 'Z003'])
+        for data in sets_data.values():
+            self.assertEqual(len(data['cards']), 25)
+
+    def test_reprint_ratio(self):
+        def num_cards(sets_data):
+            return len({card['name'] for data in sets_data.values() for card in data['cards']})
+
+        self.assertEqual(num_cards(generate_sets(5, 100, reprint_ratio=0)), 500)
+        self.assertLess(num_cards(generate_sets(5, 100, reprint_ratio=0.5)), 350)
+
+    def test_type_variety(self):
+        sets_data = generate_sets(5, 100, type_variety=7)
+
+        subtypes = {subtype for data in sets_data.values() for card in data['cards'] for subtype in card['subtypes']}
+        self.assertEqual(len(subtypes), 7)
+
+
+class ImportBenchmarkTests(TestCase):
+
+    def test_initial_import(self):
+        sets_data = generate_sets(5, 100, type_variety=20)
+
+        start = time.perf_counter()
+        report = parse_data(sets_data, Everything)
+        seconds = time.perf_counter() - start
+
+        self.assertEqual(Set.objects.count(), 5)
+        self.assertEqual(Printing.objects.count(), 500)
+        self.assertEqual(CardSubtype.objects.count(), 20)
+        # Each new type costs a query.
+        num_types = sum(model.objects.count() for model in [CardSupertype, CardType, CardSubtype])
+        self.assertLessEqual(report.queries, 5 * QUERIES_PER_SET + num_types + QUERIES_PER_IMPORT)
+        # A generous bound, to catch accidental per-row queries rather than measure speed.
+        self.assertLess(seconds, 10)
+
+    def test_queries_independent_of_set_size(self):
+        queries = []
+        for cards_per_set in [20, 200]:
+            sets_data = generate_sets(4, cards_per_set, seed=cards_per_set)
+            parse_data(sets_data, Everything)
+            queries.append(parse_data(sets_data, Everything).queries)
+            Card.objects.all().delete()
+            Set.objects.all().delete()
+
+        self.assertEqual(queries[0], queries[1])
+        self.assertLessEqual(queries[0], 4 * QUERIES_PER_SET + QUERIES_PER_IMPORT)
+
+    def test_unchanged_import_writes_nothing(self):
+        sets_data = generate_sets(5, 50)
+        parse_data(sets_data, Everything)
+
+        report = parse_data(sets_data, Everything)
+
+        for name in ['cards', 'types', 'artists', 'printings']:
+            self.assertEqual(report.phases[name].rows, 0)
+
+    def test_run_benchmark(self):
+        config = {'num_sets': 2, 'cards_per_set': 10, 'seed': 0}
+
+        results = run_benchmark(config)
+
+        self.assertEqual(results['config'], config)
+        self.assertEqual(list(results['scenarios']), list(SCENARIOS))
+        self.assertEqual(results['scenarios']['updated']['rows'], 2)
+        # Every run is rolled back.
+        self.assertFalse(Set.objects.exists())
+
+
+class BoosterBenchmarkTests(TestCase):
+
+    def test_booster_throughput(self):
+        parse_data(generate_sets(1, 250), Everything)
+        magic_set = Set.objects.get()
+        magic_set.generate_boosters(1)
+
+        start = time.perf_counter()
+        packs = magic_set.generate_boosters(10000, seed=0)
+        seconds = time.perf_counter() - start
+
+        self.assertEqual(len(packs), 10000)
+        # A generous bound for 10,000 packs a second, to catch accidental queries or quadratic draws.
+        self.assertLess(seconds, 5)
+
+
+class CompareTests(SimpleTestCase):
+
+    def results(self, seconds, queries):
+        return {'config': {}, 'environment': {}, 'scenarios': {'initial': {'seconds': seconds, 'queries': queries}}}
+
+    def test_no_regression(self):
+        lines, regressed = compare(self.results(1.0, 100), self.results(1.05, 100))
+
+        self.assertFalse(regressed)
+        self.assertIn('+5.0%', lines[-1])
+
+    def test_slower(self):
+        lines, regressed = compare(self.results(1.0, 100), self.results(1.5, 100))
+
+        self.assertTrue(regressed)
+        self.assertIn('REGRESSION', lines[-1])
+
+    def test_more_queries(self):
+        lines, regressed = compare(self.results(1.0, 100), self.results(0.5, 101))
+
+        self.assertTrue(regressed)
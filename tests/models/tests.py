@@ -1,10 +1,16 @@
 from __future__ import unicode_literals
 
+from unittest import mock, skipUnless
+
 import six
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-from magic_cards.models import Artist, Card, Printing, Set
+from magic_cards.models import Artist, Card, CardSubtype, CardSupertype, CardType, Printing, Set, build_type_line
+from magic_cards.utils import sampling
 from magic_cards.utils.import_cards import import_cards
+from magic_cards.utils.sampling import id_cache, sample_ids
 
 
 class UnicodeTests(TestCase):
@@ -43,6 +49,109 @@ class UnicodeTests(TestCase):
         self.assertEqual(byt, b"Piotr Jab\xc5\x82o\xc5\x84ski")
 
 
+class TypeLineTests(TestCase):
+    def setUp(self):
+        self.legendary = CardSupertype.objects.create(name="Legendary")
+        self.creature = CardType.objects.create(name="Creature")
+        self.elf = CardSubtype.objects.create(name="Elf")
+        self.warrior = CardSubtype.objects.create(name="Warrior")
+        self.card = Card.objects.create(name="Rhys the Exiled")
+
+    def test_build_type_line(self):
+        self.assertEqual(build_type_line([], ["Instant"], []), "Instant")
+        self.assertEqual(build_type_line(["Legendary"], ["Creature"], ["Elf", "Warrior"]),
+                         "Legendary Creature \u2014 Elf Warrior")
+
+    def test_forward_changes(self):
+        """
+        Changing a card's types through the ORM updates its type line.
+        """
+        self.card.supertypes.add(self.legendary)
+        self.card.types.add(self.creature)
+        self.card.subtypes.set([self.elf, self.warrior])
+        self.assertEqual(self.card.type_line, "Legendary Creature \u2014 Elf Warrior")
+        self.assertEqual(Card.objects.get().type_names, "Creature,Elf,Legendary,Warrior")
+        self.assertEqual(self.card.type_name_list, ["Creature", "Elf", "Legendary", "Warrior"])
+
+        self.card.subtypes.remove(self.warrior)
+        self.assertEqual(Card.objects.get().type_line, "Legendary Creature \u2014 Elf")
+        self.card.subtypes.clear()
+        self.card.supertypes.clear()
+        self.assertEqual(Card.objects.get().type_line, "Creature")
+        self.assertEqual(Card.objects.get().type_name_list, ["Creature"])
+
+    def test_printings_not_loaded(self):
+        """
+        Updating the type line only loads the card's types.
+        """
+        magic_set = Set.objects.create(name="Lorwyn", code="LRW")
+        Printing.objects.create(card=self.card, set=magic_set)
+        with CaptureQueriesContext(connection) as context:
+            self.card.types.add(self.creature)
+        self.assertFalse([query for query in context.captured_queries if 'magic_cards_printing' in query['sql']])
+
+    def test_reverse_changes(self):
+        """
+        Changing a type's cards through the ORM updates the type lines of those cards.
+        """
+        other = Card.objects.create(name="Elvish Warrior")
+        self.creature.card_set.add(self.card, other)
+        self.elf.card_set.add(self.card, other)
+        self.assertEqual(list(Card.objects.order_by('name').values_list('type_line', flat=True)),
+                         ["Creature \u2014 Elf", "Creature \u2014 Elf"])
+
+        self.elf.card_set.remove(other)
+        self.assertEqual(Card.objects.get(pk=other.pk).type_line, "Creature")
+        self.creature.card_set.clear()
+        self.assertEqual(list(Card.objects.order_by('name').values_list('type_line', flat=True)),
+                         ["", "\u2014 Elf"])
+
+    def test_with_types(self):
+        """
+        Cards and everything shown with them are loaded in a fixed number of queries.
+        """
+        artist = Artist.objects.create(full_name="Jim Murray")
+        for i in range(5):
+            card = Card.objects.create(name="Card {}".format(i))
+            card.types.add(self.creature)
+            card.subtypes.add(self.elf)
+            for code in ("LRW", "MOR"):
+                magic_set, _ = Set.objects.get_or_create(code=code, defaults={'name': code})
+                Printing.objects.create(card=card, set=magic_set, artist=artist)
+
+        with self.assertNumQueries(5):
+            cards = list(Card.objects.with_types())
+            for card in cards:
+                [t.name for t in card.supertypes.all()]
+                [t.name for t in card.types.all()]
+                [t.name for t in card.subtypes.all()]
+                [(p.set.code, p.artist.full_name) for p in card.printings.all()]
+        self.assertEqual(len(cards), 6)
+
+
+@skipUnless(connection.vendor == 'sqlite', "Reads SQLite's query plans")
+class IndexTests(TestCase):
+    def setUp(self):
+        self.card = Card.objects.create(name="Llanowar Elves")
+        self.set = Set.objects.create(name="Dominaria", code="DOM")
+
+    @staticmethod
+    def query_plan(queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return ' '.join(row[-1] for row in cursor.fetchall())
+
+    def test_printing_lookups_use_indexes(self):
+        self.assertIn('printing_multiverse_id_idx', self.query_plan(Printing.objects.filter(multiverse_id=442160)))
+        self.assertIn('printing_set_number_idx', self.query_plan(Printing.objects.filter(set=self.set, number='168')))
+        self.assertIn('printing_card_set_idx', self.query_plan(Printing.objects.filter(card=self.card, set=self.set)))
+
+    def test_case_insensitive_name_lookup_uses_index(self):
+        self.assertIn('card_name_lower_idx', self.query_plan(Card.objects.named("LLANOWAR ELVES")))
+        self.assertEqual(Card.objects.named("LLANOWAR ELVES").get(), self.card)
+
+
 class ImportScriptTests(TestCase):
     def test_long_card_name(self):
         """
@@ -66,3 +175,78 @@ class ImportScriptTests(TestCase):
 
         tracker = Card.objects.get(name="Ulvenwald Tracker")
         self.assertIsNone(tracker.loyalty)
+
+
+class PrintingRandomTests(TestCase):
+
+    def setUp(self):
+        magic_set = Set.objects.create(name="Synthetic Set", code="SYN")
+        cards = Card.objects.bulk_create([Card(name="Card {}".format(i)) for i in range(60)])
+        cards = Card.objects.filter(name__in=[card.name for card in cards])
+        Printing.objects.bulk_create([
+            Printing(card=card, set=magic_set, rarity=Printing.Rarity.RARE if i % 10 == 0 else Printing.Rarity.COMMON)
+            for i, card in enumerate(cards.order_by('name'))
+        ])
+        self.addCleanup(id_cache.clear)
+
+    def test_random(self):
+        printings = Printing.objects.random(5)
+
+        self.assertEqual(len(printings), 5)
+        self.assertEqual(len({printing.pk for printing in printings}), 5)
+
+    def test_seed(self):
+        def sample(seed):
+            return sorted(Printing.objects.random(5, seed=seed).values_list('pk', flat=True))
+
+        self.assertEqual(sample(1), sample(1))
+        self.assertNotEqual(sample(1), sample(2))
+
+    def test_filtered(self):
+        rares = Printing.objects.filter(rarity=Printing.Rarity.RARE)
+
+        self.assertEqual(set(rares.random(6)), set(rares))
+        with self.assertRaises(ValueError):
+            rares.random(7)
+
+    def test_large_queryset_probed(self):
+        with mock.patch.object(sampling, 'EXACT_THRESHOLD', 10):
+            with CaptureQueriesContext(connection) as context:
+                ids = sample_ids(Printing.objects.all(), 5, seed=0)
+            self.assertEqual(sample_ids(Printing.objects.all(), 5, seed=0), ids)
+
+        self.assertEqual(len(set(ids)), 5)
+        self.assertEqual(Printing.objects.filter(pk__in=ids).count(), 5)
+        # No query loads every id.
+        for query in context.captured_queries:
+            self.assertRegex(query['sql'], r'LIMIT|IN \(|MAX\(')
+
+    def test_large_filtered_queryset(self):
+        rares = Printing.objects.filter(rarity=Printing.Rarity.RARE)
+        with mock.patch.object(sampling, 'EXACT_THRESHOLD', 2):
+            ids = sample_ids(rares, 4, seed=0)
+
+        self.assertEqual(len(set(ids)), 4)
+        self.assertEqual(rares.filter(pk__in=ids).count(), 4)
+
+    def test_sparse_ids_cached(self):
+        Printing.objects.exclude(pk=Printing.objects.order_by('pk').first().pk).delete()
+        Printing.objects.create(pk=10 ** 9, card=Card.objects.first(), set=Set.objects.get())
+        with mock.patch.object(sampling, 'EXACT_THRESHOLD', 1):
+            ids = sample_ids(Printing.objects.all(), 2, seed=0)
+            self.assertEqual(len(id_cache.ids), 1)
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(sorted(sample_ids(Printing.objects.all(), 2, seed=0)), sorted(ids))
+
+        self.assertEqual(sorted(ids), sorted(Printing.objects.values_list('pk', flat=True)))
+        # The cached ids are not loaded again.
+        full_scans = [query for query in context.captured_queries
+                      if 'ORDER BY' in query['sql'] and 'LIMIT' not in query['sql']]
+        self.assertFalse(full_scans)
+
+    def test_cache_cleared(self):
+        id_cache.get(Printing, 'default')
+
+        Printing.objects.create(card=Card.objects.first(), set=Set.objects.get())
+
+        self.assertEqual(id_cache.ids, {})
@@ -1,6 +1,8 @@
 # -*- coding: utf-8
 from __future__ import unicode_literals, absolute_import
 
+import os
+
 import django
 
 DEBUG = True
@@ -16,6 +18,18 @@ DATABASES = {
     }
 }
 
+# Run the tests and benchmarks against a local PostgreSQL database instead, configured by the
+# usual PG* environment variables.
+if os.environ.get("MAGIC_CARDS_TEST_DATABASE") == "postgresql":
+    DATABASES["default"] = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": os.environ.get("PGDATABASE", "magic_cards"),
+        "USER": os.environ.get("PGUSER", ""),
+        "PASSWORD": os.environ.get("PGPASSWORD", ""),
+        "HOST": os.environ.get("PGHOST", ""),
+        "PORT": os.environ.get("PGPORT", ""),
+    }
+
 ROOT_URLCONF = "tests.urls"
 
 INSTALLED_APPS = [
@@ -1,21 +1,202 @@
+import collections
 import copy
 import json
 import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import tracemalloc
 import unittest
+import uuid
+import zipfile
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
 
-from django.core.management import call_command
+from django.core.management import CommandError, call_command
+from django.db import connection
 from django.db.models import Count
-from django.test import TestCase
+from django.db.models.signals import post_delete
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils.six import StringIO
 
-from magic_cards.models import Card, CardSubtype, Printing, Set
-from magic_cards.utils.import_cards import Everything, fetch_data, import_cards, parse_data
+from magic_cards.models import (
+    Artist, Card, CardSubtype, CardSupertype, CardType, ImportCheckpoint, Printing, Set, SetImportState)
+from magic_cards.signals import import_finished, import_started, set_imported
+from magic_cards.utils import (
+    boosters, import_cards as import_cards_module, random as random_module, sources as sources_module)
+from magic_cards.utils.bulk_load import BulkLoader, CopyFile, SQLiteBulkLoader, get_bulk_loader
+from magic_cards.utils.import_cards import (
+    IMPORTER_VERSION, Everything, fetch_data, import_cards, parse_data, prune_orphans)
+from magic_cards.utils.plan import plan_data, plan_import
+from magic_cards.utils.random import WeightedSampler, alias_table, weighted_choice
+from magic_cards.utils.report import ImportReport
+from magic_cards.utils.sources import (
+    AllPrintingsSource, DirectorySource, DownloadCache, SetFile, ZipArchiveSource, get_source, iter_archive)
+from tests.benchmarks.generator import generate_sets
 
 
 SOM_CARDS = 234
 SOM_PRINTINGS = 249
 
 
+def make_set(code, num_cards, padding=0):
+    """
+    Builds the MTGJSON data for a synthetic set of `num_cards` distinct commons.
+
+    `padding` adds that many characters of data that the importer reads but does not store.
+    """
+    return {
+        'name': 'Synthetic Set {}'.format(code),
+        'code': code,
+        'cards': [{
+            'name': '{} Card {}'.format(code, i),
+            'layout': 'normal',
+            'manaCost': '{1}',
+            'types': ['Artifact'],
+            'rarity': 'common',
+            'number': str(i + 1),
+            'artist': 'Synthetic Artist',
+            'foreignData': [{'text': 'x' * padding}],
+        } for i in range(num_cards)],
+    }
+
+
+def make_archive(sets_data, archive_file=None):
+    """
+    Writes `sets_data` in the format of MTGJSON's AllSetFiles.zip to `archive_file`, which may be a
+    path or a file object. By default, a new temporary file is used.
+    """
+    if archive_file is None:
+        archive_file = tempfile.TemporaryFile()
+    with zipfile.ZipFile(archive_file, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for code, data in sets_data.items():
+            archive.writestr('{}.json'.format(code), json.dumps({'meta': {}, 'data': data}))
+    if hasattr(archive_file, 'seek'):
+        archive_file.seek(0)
+    return archive_file
+
+
+def clear_catalog():
+    """
+    Deletes every set, card, printing, artist, and type, and the import state of every set.
+    """
+    for model in [Printing, Card, Set, SetImportState, Artist, CardSupertype, CardType, CardSubtype]:
+        model.objects.all().delete()
+
+
+class ArchiveTestMixin:
+
+    def make_tempdir(self):
+        """
+        Creates a temporary directory that is removed when the test finishes.
+        """
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        return tempdir
+
+    def archive_path(self, sets_data):
+        """
+        Writes `sets_data` to an AllSetFiles.zip in a new temporary directory, and returns its path.
+        """
+        return make_archive(sets_data, os.path.join(self.make_tempdir(), 'AllSetFiles.zip'))
+
+
+class ArchiveRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the `body` of an `ArchiveServer`, honoring conditional and range requests.
+    """
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        size = len(server.body)
+        start, end = 0, size
+        match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        if match and server.accept_ranges and self.headers.get('If-Range', server.etag) == server.etag:
+            first, last = match.groups()
+            if first:
+                start, end = int(first), min(size, int(last) + 1) if last else size
+            else:
+                start = max(0, size - int(last))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end - 1, size))
+        else:
+            self.send_response(200)
+        body = server.body[start:end]
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', server.etag)
+        self.end_headers()
+        if server.truncate_next:
+            # Simulate a dropped connection.
+            server.truncate_next = False
+            body = body[:len(body) // 2]
+        self.wfile.write(body)
+        server.bytes_sent += len(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ArchiveServer(HTTPServer):
+    """
+    A local stand-in for MTGJSON's web server, serving `body` with the ETag `etag`.
+    """
+
+    def __init__(self, body):
+        super().__init__(('127.0.0.1', 0), ArchiveRequestHandler)
+        self.body = body
+        self.etag = '"1"'
+        self.accept_ranges = True
+        self.truncate_next = False
+        self.requests = []
+        self.bytes_sent = 0
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/AllSetFiles.zip'.format(self.server_port)
+
+    def start(self, test_case):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        test_case.addCleanup(self.server_close)
+        test_case.addCleanup(self.shutdown)
+        return self
+
+
+def table_queries(context, table, verb=''):
+    """
+    Returns the SQL of the queries captured in `context` that read from or write to `table`,
+    optionally only those that start with `verb`.
+    """
+    pattern = re.compile(r'(SELECT {0}\.|INSERT INTO {0} |UPDATE {0} |DELETE FROM {0} )'.format(
+        re.escape(connection.ops.quote_name(table))))
+    return [
+        query['sql'] for query in context.captured_queries
+        if pattern.match(query['sql']) and query['sql'].startswith(verb)
+    ]
+
+
+def measure_peak_memory(func, *args):
+    """
+    Returns the peak memory traced by `tracemalloc` while calling `func(*args)`.
+    """
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
 class ImportTestBase:
 
     def check_common_set_constraints(self):
@@ -53,7 +234,7 @@ class ImportScriptTests(ImportTestBase, TestCase):
         "On Travis, only runs on Django 1.11 under Python 3.6")
     def test_import_all_cards(self):
         # Fetch the data directly to establish expectations.
-        sets_data = fetch_data()
+        sets_data = dict(fetch_data())
         expected_num_sets = len(sets_data)
         expected_num_printings = 0
         card_set = set()
@@ -62,7 +243,6 @@ class ImportScriptTests(ImportTestBase, TestCase):
             card_set |= set(card['name'] for card in nontokens)
             expected_num_printings += len(nontokens)
         expected_num_cards = len(card_set)
-        expected_num_printings -= 2  # Spurious data in Betrayers of Kamigawa
 
         parse_data(sets_data, Everything)
 
@@ -136,7 +316,7 @@ class ImportScriptTests(ImportTestBase, TestCase):
 
     def test_import_betrayers(self):
         """
-        Data integrity issues from a bug in MTGJSON are cleaned up by the import process.
+        Printings that MTGJSON once duplicated are only imported once.
         """
         import_cards(["BOK"])
 
@@ -194,12 +374,15 @@ class ImportScriptUpdateTests(TestCase):
         jackal_pup = Card.objects.first()
         self.assertEqual(jackal_pup.subtypes.count(), 1)
         self.assertEqual(jackal_pup.subtypes.first().name, original_subtype)
+        self.assertEqual(jackal_pup.type_line, 'Creature \u2014 Hound')
 
         # Import the final, updated data.
         parse_data(final_data, ['TMP'])
         jackal_pup.refresh_from_db()
         self.assertEqual(jackal_pup.subtypes.count(), 1)
         self.assertEqual(jackal_pup.subtypes.first().name, 'Jackal')
+        self.assertEqual(jackal_pup.type_line, 'Creature \u2014 Jackal')
+        self.assertEqual(jackal_pup.type_names, 'Creature,Jackal')
         # The Hound subtype has been deleted.
         self.assertFalse(CardSubtype.objects.filter(name=original_subtype).exists())
 
@@ -225,6 +408,1287 @@ class ImportScriptUpdateTests(TestCase):
         self.assertEqual(vraska.loyalty, 5)
 
 
+class IdentifierTests(ArchiveTestMixin, TestCase):
+
+    def setUp(self):
+        self.sets_data = {'AAA': make_set('AAA', 3)}
+        for i, card_data in enumerate(self.sets_data['AAA']['cards']):
+            card_data['uuid'] = str(uuid.uuid5(uuid.NAMESPACE_OID, 'AAA/{}'.format(i)))
+            card_data['identifiers'] = {'scryfallOracleId': str(uuid.uuid5(uuid.NAMESPACE_OID, card_data['name']))}
+
+    def test_identifiers_imported(self):
+        parse_data(self.sets_data, Everything)
+
+        card_data = self.sets_data['AAA']['cards'][0]
+        printing = Printing.objects.get(uuid=card_data['uuid'])
+        self.assertEqual(printing.card.name, 'AAA Card 0')
+        self.assertEqual(str(printing.card.oracle_id), card_data['identifiers']['scryfallOracleId'])
+
+    def test_printings_matched_by_uuid(self):
+        parse_data(self.sets_data, Everything)
+        printing = Printing.objects.get(uuid=self.sets_data['AAA']['cards'][1]['uuid'])
+        updated_data = copy.deepcopy(self.sets_data)
+        updated_data['AAA']['cards'][1].update(flavor='Corrected flavor text.', number='7')
+
+        with CaptureQueriesContext(connection) as context:
+            parse_data(updated_data, Everything)
+
+        self.assertEqual(Printing.objects.count(), 3)
+        printing.refresh_from_db()
+        self.assertEqual(printing.flavor_text, 'Corrected flavor text.')
+        self.assertEqual(printing.number, '7')
+        self.assertEqual(len(table_queries(context, 'magic_cards_printing', 'UPDATE')), 1)
+        self.assertEqual(len(table_queries(context, 'magic_cards_printing', 'INSERT')), 0)
+
+    def test_duplicate_uuid_imported_once(self):
+        self.sets_data['AAA']['cards'].append(dict(self.sets_data['AAA']['cards'][0]))
+
+        parse_data(self.sets_data, Everything)
+
+        self.assertEqual(Printing.objects.count(), 3)
+
+    def test_uuids_backfilled(self):
+        legacy_data = copy.deepcopy(self.sets_data)
+        for card_data in legacy_data['AAA']['cards']:
+            del card_data['uuid'], card_data['identifiers']
+        parse_data(legacy_data, Everything)
+        self.assertFalse(Printing.objects.filter(uuid__isnull=False).exists())
+        pks = sorted(Printing.objects.values_list('pk', flat=True))
+
+        parse_data(self.sets_data, Everything)
+
+        self.assertEqual(sorted(Printing.objects.values_list('pk', flat=True)), pks)
+        self.assertFalse(Printing.objects.filter(uuid__isnull=True).exists())
+        self.assertFalse(Card.objects.filter(oracle_id__isnull=True).exists())
+
+    def test_uuids_backfilled_from_unchanged_file(self):
+        """
+        Sets imported before the importer stored uuids are imported again, even if their file has not changed.
+        """
+        archive_path = self.archive_path(self.sets_data)
+        import_cards(source=archive_path)
+        # Make the import look like it was done before migration 0007.
+        Printing.objects.update(uuid=None)
+        Card.objects.update(oracle_id=None)
+        SetImportState.objects.update(importer_version=0)
+
+        import_cards(source=archive_path)
+
+        self.assertFalse(Printing.objects.filter(uuid__isnull=True).exists())
+        self.assertFalse(Card.objects.filter(oracle_id__isnull=True).exists())
+        self.assertEqual(SetImportState.objects.get().importer_version, IMPORTER_VERSION)
+
+    def test_staged_and_fast_load(self):
+        self.sets_data['AAA']['cards'].append(dict(self.sets_data['AAA']['cards'][0]))
+        for options in [{'staged': True}, {'loader': get_bulk_loader(connection)}]:
+            parse_data(self.sets_data, Everything, **options)
+
+            self.assertEqual(Printing.objects.filter(uuid__isnull=False).count(), 3)
+            clear_catalog()
+
+    def test_printing_moved_to_another_set(self):
+        """
+        A printing whose uuid MTGJSON moves to another set is moved, rather than created again.
+        """
+        moved_data = copy.deepcopy(self.sets_data)
+        moved_data['BBB'] = make_set('BBB', 0)
+        moved_data['BBB']['cards'].append(moved_data['AAA']['cards'].pop())
+        moved_uuid = moved_data['BBB']['cards'][0]['uuid']
+        for options in [{}, {'staged': True}]:
+            parse_data(self.sets_data, Everything, **options)
+            pk = Printing.objects.get(uuid=moved_uuid).pk
+
+            plan = plan_data(moved_data, Everything)
+            parse_data(moved_data, Everything, **options)
+
+            self.assertEqual(plan[Printing].created, [])
+            self.assertEqual(plan[Printing].updated, [['BBB', 'AAA Card 2', '3']])
+            self.assertEqual(Printing.objects.count(), 3)
+            printing = Printing.objects.get(uuid=moved_uuid)
+            self.assertEqual((printing.pk, printing.set.code), (pk, 'BBB'))
+            clear_catalog()
+
+    def test_plan(self):
+        parse_data(self.sets_data, Everything)
+        updated_data = copy.deepcopy(self.sets_data)
+        updated_data['AAA']['cards'][1]['flavor'] = 'Corrected flavor text.'
+
+        plan = plan_data(updated_data, Everything)
+
+        self.assertEqual(plan[Printing].created, [])
+        self.assertEqual(plan[Printing].updated, [['AAA', 'AAA Card 1', '2']])
+
+
+class StreamingImportTests(TestCase):
+
+    NUM_SETS = 6
+    CARDS_PER_SET = 60
+
+    def setUp(self):
+        codes = ['S{:02d}'.format(i) for i in range(self.NUM_SETS)]
+        sets_data = {code: make_set(code, self.CARDS_PER_SET, padding=4096) for code in codes}
+        self.archive_file = make_archive(sets_data)
+        self.addCleanup(self.archive_file.close)
+
+    def test_iter_archive(self):
+        sets = list(iter_archive(self.archive_file))
+        self.assertEqual([code for code, _ in sets], ['S{:02d}'.format(i) for i in range(self.NUM_SETS)])
+        self.assertEqual(len(sets[0][1]['cards']), self.CARDS_PER_SET)
+
+    def test_parse_data_accepts_iterable(self):
+        parse_data(iter_archive(self.archive_file), ['S01', 'S03'])
+
+        self.assertQuerysetEqual(Set.objects.order_by('code'), ['S01', 'S03'], transform=lambda x: x.code)
+        self.assertEqual(Card.objects.count(), 2 * self.CARDS_PER_SET)
+
+    def test_peak_memory_bounded_by_largest_set(self):
+        """
+        Streaming every set through the importer uses about as much memory as decoding just one.
+        """
+        with zipfile.ZipFile(self.archive_file) as archive:
+            zipinfo = archive.infolist()[0]
+            single_set_peak = measure_peak_memory(lambda: SetFile(archive.read(zipinfo)).decode())
+        self.archive_file.seek(0)
+
+        tracemalloc.start()
+        try:
+            report = parse_data(iter_archive(self.archive_file), Everything)
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(Set.objects.count(), self.NUM_SETS)
+        # The import resets the traced peak as each phase starts, so each phase has its own.
+        import_peak = max(stats.peak_memory for stats in report.phases.values() if stats.peak_memory is not None)
+        self.assertLess(import_peak, 2 * single_set_peak)
+
+
+class BulkImportTests(TestCase):
+
+    def test_card_queries_per_set(self):
+        """
+        Cards are read and written with a fixed number of queries per set, however large it is.
+        """
+        with CaptureQueriesContext(connection) as context:
+            parse_data({'AAA': make_set('AAA', 5), 'BBB': make_set('BBB', 400)}, Everything)
+
+        self.assertEqual(Card.objects.count(), 405)
+        self.assertLessEqual(len(table_queries(context, 'magic_cards_card')), 2 * 3)
+
+    def test_unchanged_cards_not_written(self):
+        sets_data = {'AAA': make_set('AAA', 50)}
+        parse_data(sets_data, Everything)
+
+        sets_data['AAA']['cards'][7]['text'] = 'Updated text.'
+        with CaptureQueriesContext(connection) as context:
+            parse_data(sets_data, Everything)
+
+        self.assertEqual(len(table_queries(context, 'magic_cards_card', 'INSERT')), 0)
+        self.assertEqual(len(table_queries(context, 'magic_cards_card', 'UPDATE')), 1)
+        self.assertEqual(Card.objects.get(name='AAA Card 7').text, 'Updated text.')
+        self.assertEqual(Card.objects.filter(text='').count(), 49)
+
+    def test_unchanged_types_not_written(self):
+        sets_data = {'AAA': make_set('AAA', 20)}
+        for card in sets_data['AAA']['cards']:
+            card.update({'supertypes': ['Legendary'], 'types': ['Artifact', 'Creature'], 'subtypes': ['Golem']})
+        parse_data(sets_data, Everything)
+
+        with CaptureQueriesContext(connection) as context:
+            parse_data(sets_data, Everything)
+
+        for table in ['magic_cards_card_supertypes', 'magic_cards_card_types', 'magic_cards_card_subtypes']:
+            self.assertEqual(table_queries(context, table, 'INSERT'), [])
+            self.assertEqual(table_queries(context, table, 'DELETE'), [])
+        self.assertEqual(Card.objects.filter(supertypes__name='Legendary', subtypes__name='Golem').count(), 20)
+
+    def test_changed_types_written_in_bulk(self):
+        sets_data = {'AAA': make_set('AAA', 20)}
+        parse_data(sets_data, Everything)
+
+        for card in sets_data['AAA']['cards'][:10]:
+            card.update({'types': ['Artifact', 'Creature'], 'subtypes': ['Golem']})
+        with CaptureQueriesContext(connection) as context:
+            parse_data(sets_data, Everything)
+
+        self.assertEqual(len(table_queries(context, 'magic_cards_card_types', 'INSERT')), 1)
+        self.assertEqual(len(table_queries(context, 'magic_cards_card_subtypes', 'INSERT')), 1)
+        self.assertEqual(table_queries(context, 'magic_cards_card_types', 'DELETE'), [])
+        self.assertEqual(Card.objects.filter(types__name='Creature').count(), 10)
+        self.assertEqual(Card.objects.filter(types__name='Artifact').count(), 20)
+
+        for card in sets_data['AAA']['cards'][:10]:
+            card.update({'types': ['Artifact'], 'subtypes': []})
+        with CaptureQueriesContext(connection) as context:
+            parse_data(sets_data, Everything)
+
+        # Stale relations are deleted by primary key; orphaned types are cleaned up separately.
+        for table in ['magic_cards_card_types', 'magic_cards_card_subtypes']:
+            deletes = [sql for sql in table_queries(context, table, 'DELETE') if '."id" IN' in sql]
+            self.assertEqual(len(deletes), 1)
+        self.assertFalse(Card.objects.filter(types__name='Creature').exists())
+        self.assertFalse(CardSubtype.objects.exists())
+
+    def test_artists_created_in_bulk(self):
+        sets_data = {'AAA': make_set('AAA', 30), 'BBB': make_set('BBB', 30)}
+        for i, card in enumerate(sets_data['AAA']['cards'] + sets_data['BBB']['cards']):
+            card['artist'] = 'Artist {}'.format(i % 40)
+        del sets_data['AAA']['cards'][0]['artist']
+
+        with CaptureQueriesContext(connection) as context:
+            parse_data(sets_data, Everything)
+
+        # One query to load the artists, then one insert for each set (followed by a lookup of the
+        # new primary keys on backends that don't return them).
+        self.assertEqual(len(table_queries(context, 'magic_cards_artist', 'INSERT')), 2)
+        self.assertLessEqual(len(table_queries(context, 'magic_cards_artist')), 5)
+        self.assertEqual(Artist.objects.count(), 40)
+        self.assertIsNone(Printing.objects.get(card__name='AAA Card 0').artist)
+        self.assertEqual(Printing.objects.get(card__name='BBB Card 5').artist.full_name, 'Artist 35')
+
+        with CaptureQueriesContext(connection) as context:
+            parse_data(sets_data, Everything)
+
+        self.assertEqual(len(table_queries(context, 'magic_cards_artist')), 1)
+
+    def test_existing_printings_not_recreated(self):
+        sets_data = {'AAA': make_set('AAA', 40)}
+        sets_data['AAA']['cards'][3]['flavor'] = 'Flavor text.'
+        for card in sets_data['AAA']['cards'][:10]:
+            card['multiverseId'] = None
+        parse_data(sets_data, Everything)
+
+        sets_data['AAA']['cards'].append(dict(sets_data['AAA']['cards'][3], number='41'))
+        with CaptureQueriesContext(connection) as context:
+            parse_data(sets_data, ['AAA'])
+
+        self.assertEqual(len(table_queries(context, 'magic_cards_printing', 'SELECT')), 1)
+        self.assertEqual(len(table_queries(context, 'magic_cards_printing', 'INSERT')), 1)
+        self.assertEqual(Printing.objects.count(), 41)
+        self.assertEqual(Printing.objects.filter(card__name='AAA Card 3', flavor_text='Flavor text.').count(), 2)
+
+    def test_reprint_updates_card(self):
+        parse_data({'AAA': make_set('AAA', 3)}, Everything)
+        reprint = make_set('BBB', 0)
+        reprint['cards'] = copy.deepcopy(make_set('AAA', 3)['cards'])
+        reprint['cards'][1]['manaCost'] = '{2}'
+
+        parse_data({'BBB': reprint}, Everything)
+
+        self.assertEqual(Card.objects.count(), 3)
+        self.assertEqual(Printing.objects.count(), 6)
+        self.assertEqual(Card.objects.get(name='AAA Card 1').mana_cost, '{2}')
+
+
+class PruneOrphansTests(TestCase):
+
+    def setUp(self):
+        card = Card.objects.create(name='Jackal Pup')
+        card.types.add(CardType.objects.create(name='Creature'))
+        card.subtypes.add(CardSubtype.objects.create(name='Jackal'))
+        CardSupertype.objects.create(name='Legendary')
+        CardType.objects.bulk_create(CardType(name='Type {}'.format(i)) for i in range(50))
+        CardSubtype.objects.bulk_create(CardSubtype(name='Subtype {}'.format(i)) for i in range(200))
+
+    def test_prune_orphans(self):
+        with self.assertNumQueries(3):
+            deleted = prune_orphans()
+
+        self.assertEqual(deleted, {CardSupertype: 1, CardType: 50, CardSubtype: 200})
+        self.assertQuerysetEqual(CardType.objects.all(), ['Creature'], transform=lambda x: x.name)
+        self.assertQuerysetEqual(CardSubtype.objects.all(), ['Jackal'], transform=lambda x: x.name)
+        self.assertFalse(CardSupertype.objects.exists())
+        self.assertEqual(Card.objects.get().types.count(), 1)
+
+    def test_prune_orphans_sends_delete_signals(self):
+        deleted_names = []
+
+        def receiver(sender, instance, **kwargs):
+            deleted_names.append(instance.name)
+        post_delete.connect(receiver, sender=CardSupertype)
+        self.addCleanup(post_delete.disconnect, receiver, sender=CardSupertype)
+
+        deleted = prune_orphans()
+
+        self.assertEqual(deleted, {CardSupertype: 1, CardType: 50, CardSubtype: 200})
+        self.assertEqual(deleted_names, ['Legendary'])
+        self.assertEqual(CardType.objects.count(), 1)
+
+    def test_management_command(self):
+        out = StringIO()
+        call_command('prune_magic_cards', stdout=out)
+
+        self.assertEqual(
+            "Deleted 1 CardSupertype, 50 CardTypes, and 200 CardSubtypes.\n", out.getvalue())
+        self.assertEqual(CardSubtype.objects.count(), 1)
+
+
+class SourceTests(ArchiveTestMixin, TestCase):
+
+    def setUp(self):
+        self.sets_data = {code: make_set(code, 3) for code in ['AAA', 'BBB', 'CCC']}
+        self.sets_data['BBB']['cards'][0]['text'] = 'Quotes "and" unicode: S\xe9ance \u2014 {T}'
+        self.tempdir = self.make_tempdir()
+
+    def path(self, *parts):
+        return os.path.join(self.tempdir, *parts)
+
+    def test_zip_archive(self):
+        make_archive(self.sets_data, self.path('AllSetFiles.zip'))
+
+        source = get_source(self.path('AllSetFiles.zip'))
+        self.assertIsInstance(source, ZipArchiveSource)
+        self.assertEqual(dict(source), self.sets_data)
+
+    def test_directory(self):
+        os.mkdir(self.path('sets'))
+        for code, data in self.sets_data.items():
+            with open(self.path('sets', '{}.json'.format(code)), 'w') as f:
+                json.dump({'meta': {}, 'data': data}, f)
+
+        source = get_source(self.path('sets'))
+        self.assertIsInstance(source, DirectorySource)
+        self.assertEqual(list(source), sorted(self.sets_data.items()))
+
+    def test_all_printings(self):
+        with open(self.path('AllPrintings.json'), 'w') as f:
+            json.dump({'meta': {'version': '5.2.1'}, 'data': self.sets_data}, f, indent=2)
+
+        source = get_source(self.path('AllPrintings.json'))
+        self.assertIsInstance(source, AllPrintingsSource)
+        self.assertEqual(list(source), list(self.sets_data.items()))
+
+    def test_all_printings_compact(self):
+        with open(self.path('AllPrintings.json'), 'w') as f:
+            json.dump({'data': self.sets_data, 'meta': {}}, f, separators=(',', ':'))
+
+        self.assertEqual(list(AllPrintingsSource(self.path('AllPrintings.json'))), list(self.sets_data.items()))
+
+    def test_all_printings_scanned_once(self):
+        """
+        Each set is scanned as it is reached, without scanning all of the data to find its end first.
+        """
+        with open(self.path('AllPrintings.json'), 'w') as f:
+            json.dump({'meta': {}, 'data': self.sets_data}, f)
+
+        value_end = sources_module._value_end
+        with mock.patch.object(sources_module, '_value_end', side_effect=value_end) as scan:
+            set_files = AllPrintingsSource(self.path('AllPrintings.json')).iter_set_files()
+            self.assertEqual(next(set_files).code, 'AAA')
+            # The meta, and the first set.
+            self.assertEqual(scan.call_count, 2)
+            self.assertEqual(len(list(set_files)), len(self.sets_data) - 1)
+
+        self.assertEqual(scan.call_count, 1 + len(self.sets_data))
+
+    def test_zip_archive_decodes_only_requested_sets(self):
+        with zipfile.ZipFile(self.path('AllSetFiles.zip'), 'w') as archive:
+            for code, data in self.sets_data.items():
+                archive.writestr('{}_.json'.format(code), json.dumps({'meta': {}, 'data': data}))
+            # A member whose name is not a set code is picked by the code near its start.
+            archive.writestr('Unusual Name.json', json.dumps({'data': make_set('DDD', 1)}))
+
+        with mock.patch.object(SetFile, 'decode', autospec=True, side_effect=SetFile.decode) as decode:
+            sets = list(ZipArchiveSource(self.path('AllSetFiles.zip')).iter_sets(['bbb', 'DDD']))
+
+        self.assertEqual([code for code, _ in sets], ['BBB', 'DDD'])
+        self.assertEqual(decode.call_count, 2)
+
+    def test_directory_decodes_only_requested_sets(self):
+        os.mkdir(self.path('sets'))
+        for code, data in self.sets_data.items():
+            with open(self.path('sets', '{}.json'.format(code)), 'w') as f:
+                json.dump({'meta': {}, 'data': data}, f)
+
+        with mock.patch.object(SetFile, 'decode', autospec=True, side_effect=SetFile.decode) as decode:
+            sets = list(DirectorySource(self.path('sets')).iter_sets(['CCC']))
+
+        self.assertEqual(sets, [('CCC', self.sets_data['CCC'])])
+        self.assertEqual(decode.call_count, 1)
+
+    def test_all_printings_decodes_only_requested_sets(self):
+        with open(self.path('AllPrintings.json'), 'w') as f:
+            json.dump({'meta': {}, 'data': self.sets_data}, f)
+
+        sets = list(AllPrintingsSource(self.path('AllPrintings.json')).iter_sets(['AAA']))
+
+        self.assertEqual(sets, [('AAA', self.sets_data['AAA'])])
+
+    def test_import_cards_from_source(self):
+        make_archive(self.sets_data, self.path('AllSetFiles.zip'))
+
+        import_cards(['AAA', 'CCC'], source=self.path('AllSetFiles.zip'))
+
+        self.assertQuerysetEqual(Set.objects.order_by('code'), ['AAA', 'CCC'], transform=lambda x: x.code)
+        self.assertEqual(Card.objects.count(), 6)
+
+    def test_management_command_source(self):
+        make_archive(self.sets_data, self.path('AllSetFiles.zip'))
+
+        out = StringIO()
+        call_command('import_magic_cards', 'BBB', source=self.path('AllSetFiles.zip'), stdout=out)
+
+        self.assertIn("Added 1 new Set, 3 new Cards, and 3 new Printings.", out.getvalue())
+        self.assertEqual(Card.objects.get(name='BBB Card 0').text, self.sets_data['BBB']['cards'][0]['text'])
+
+
+class IncrementalImportTests(ArchiveTestMixin, TestCase):
+
+    def setUp(self):
+        self.sets_data = {code: make_set(code, 5) for code in ['AAA', 'BBB', 'CCC']}
+        self.source = self.archive_path(self.sets_data)
+
+    def test_import_state_recorded(self):
+        import_cards(source=self.source)
+
+        self.assertQuerysetEqual(
+            SetImportState.objects.order_by('code'), ['AAA', 'BBB', 'CCC'], transform=lambda x: x.code)
+        with zipfile.ZipFile(self.source) as archive:
+            self.assertEqual(
+                SetImportState.objects.get(code='BBB').content_hash,
+                SetFile(archive.read('BBB.json')).content_hash)
+
+    def test_deleted_sets_imported_again(self):
+        """
+        A set whose row was deleted is imported again, although its data has not changed.
+        """
+        for options in [{}, {'fast_load': True}]:
+            import_cards(source=self.source)
+            Set.objects.all().delete()
+            Card.objects.all().delete()
+
+            plan = plan_import(source=self.source)
+            report = import_cards(source=self.source, **options)
+
+            self.assertEqual(plan.skipped, 0)
+            self.assertEqual(report.skipped, 0)
+            self.assertEqual(Set.objects.count(), 3)
+            self.assertEqual(Printing.objects.count(), 15)
+
+    def test_unchanged_sets_skipped(self):
+        import_cards(source=self.source)
+
+        self.sets_data['BBB']['cards'][0]['text'] = 'Updated text.'
+        make_archive(self.sets_data, self.source)
+        with mock.patch.object(SetFile, 'decode', autospec=True, side_effect=SetFile.decode) as decode:
+            with CaptureQueriesContext(connection) as context:
+                import_cards(source=self.source)
+
+        self.assertEqual([call[0][0].code for call in decode.call_args_list], ['BBB'])
+        self.assertEqual(len(table_queries(context, 'magic_cards_card', 'UPDATE')), 1)
+        self.assertEqual(Card.objects.get(name='BBB Card 0').text, 'Updated text.')
+
+    def test_force(self):
+        import_cards(source=self.source)
+        Card.objects.filter(name='AAA Card 0').update(text='Edited by hand.')
+
+        import_cards(source=self.source)
+        self.assertEqual(Card.objects.get(name='AAA Card 0').text, 'Edited by hand.')
+
+        import_cards(source=self.source, force=True)
+        self.assertEqual(Card.objects.get(name='AAA Card 0').text, '')
+
+    def test_import_without_file_clears_state(self):
+        import_cards(source=self.source)
+
+        parse_data({'AAA': self.sets_data['AAA']}, ['AAA'])
+
+        self.assertQuerysetEqual(
+            SetImportState.objects.order_by('code'), ['BBB', 'CCC'], transform=lambda x: x.code)
+
+    def test_management_command_force(self):
+        call_command('import_magic_cards', source=self.source, stdout=StringIO())
+        Printing.objects.filter(card__name='CCC Card 1').delete()
+
+        out = StringIO()
+        call_command('import_magic_cards', source=self.source, stdout=out)
+        self.assertIn("Added 0 new Sets, 0 new Cards, and 0 new Printings.", out.getvalue())
+
+        out = StringIO()
+        call_command('import_magic_cards', source=self.source, force=True, stdout=out)
+        self.assertIn("Added 0 new Sets, 0 new Cards, and 1 new Printing.", out.getvalue())
+
+
+class CheckpointedImportTests(ArchiveTestMixin, TestCase):
+
+    CODES = ['AAA', 'BBB', 'CCC', 'DDD', 'EEE']
+
+    def setUp(self):
+        self.sets_data = {code: make_set(code, 3) for code in self.CODES}
+        self.source = self.archive_path(self.sets_data)
+
+    def fail_on(self, code):
+        write_set = import_cards_module.write_set
+
+        def side_effect(cache, rows, *args):
+            if rows.code == code:
+                raise RuntimeError("Import of {} failed.".format(code))
+            return write_set(cache, rows, *args)
+        return mock.patch.object(import_cards_module, 'write_set', side_effect=side_effect)
+
+    def test_single_transaction_by_default(self):
+        with self.fail_on('CCC'), self.assertRaises(RuntimeError):
+            import_cards(source=self.source)
+
+        self.assertFalse(Set.objects.exists())
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+    def test_commits_every_set(self):
+        with self.fail_on('CCC'), self.assertRaises(RuntimeError):
+            import_cards(source=self.source, checkpoint_every=1)
+
+        self.assertQuerysetEqual(Set.objects.order_by('code'), ['AAA', 'BBB'], transform=lambda x: x.code)
+        self.assertQuerysetEqual(
+            ImportCheckpoint.objects.order_by('code'), ['AAA', 'BBB'], transform=lambda x: x.code)
+
+    def test_commits_every_n_sets(self):
+        with self.fail_on('EEE'), self.assertRaises(RuntimeError):
+            import_cards(source=self.source, checkpoint_every=2)
+
+        self.assertQuerysetEqual(
+            Set.objects.order_by('code'), ['AAA', 'BBB', 'CCC', 'DDD'], transform=lambda x: x.code)
+
+    def test_resume(self):
+        with self.fail_on('CCC'), self.assertRaises(RuntimeError):
+            import_cards(source=self.source, force=True, checkpoint_every=1)
+
+        with mock.patch.object(
+                import_cards_module, 'write_set', side_effect=import_cards_module.write_set) as write_set:
+            import_cards(source=self.source, force=True, resume=True)
+
+        self.assertEqual([call[0][1].code for call in write_set.call_args_list], ['CCC', 'DDD', 'EEE'])
+        self.assertEqual(Set.objects.count(), 5)
+        self.assertEqual(Card.objects.count(), 15)
+        # The import completed, so the checkpoints are cleared.
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+    def test_new_import_discards_checkpoints(self):
+        ImportCheckpoint.objects.create(code='AAA')
+
+        import_cards(source=self.source, checkpoint_every=10)
+
+        self.assertEqual(Set.objects.count(), 5)
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+    def test_management_command_resume(self):
+        with self.fail_on('DDD'), self.assertRaises(RuntimeError):
+            call_command('import_magic_cards', source=self.source, checkpoint_every=1, stdout=StringIO())
+
+        out = StringIO()
+        call_command('import_magic_cards', source=self.source, resume=True, stdout=out)
+
+        self.assertIn("Added 2 new Sets, 6 new Cards, and 6 new Printings.", out.getvalue())
+
+
+class PipelinedImportTests(ArchiveTestMixin, TestCase):
+
+    @staticmethod
+    def snapshot():
+        return {
+            'cards': list(Card.objects.order_by('name').values_list('name', 'mana_cost', 'text', 'power')),
+            'types': list(Card.objects.order_by('name', 'types__name').values_list('name', 'types__name')),
+            'printings': list(Printing.objects.order_by('pk').values_list(
+                'card__name', 'set__code', 'rarity', 'artist__full_name', 'number')),
+        }
+
+    def test_workers_match_serial_import(self):
+        sets_data = {code: make_set(code, 10) for code in ['AAA', 'BBB', 'CCC', 'DDD', 'EEE']}
+        for code, data in sets_data.items():
+            # Reprint some cards with different text, so that the order of the writes matters.
+            data['cards'].append(dict(sets_data['AAA']['cards'][0], text='Text from {}'.format(code)))
+            data['cards'][0]['types'] = ['Creature']
+        archive_path = self.archive_path(sets_data)
+
+        import_cards(source=archive_path)
+        serial = self.snapshot()
+        clear_catalog()
+
+        import_cards(source=archive_path, workers=2)
+        pipelined = self.snapshot()
+
+        self.assertEqual(Card.objects.get(name='AAA Card 0').text, 'Text from EEE')
+        self.assertEqual(pipelined, serial)
+
+
+class ImportReportTests(ArchiveTestMixin, TestCase):
+
+    def setUp(self):
+        self.sets_data = {'AAA': make_set('AAA', 3), 'BBB': make_set('BBB', 4)}
+        self.source = self.archive_path(self.sets_data)
+
+    def test_rows_per_phase(self):
+        report = import_cards(source=self.source)
+
+        self.assertEqual(report.sets, ['AAA', 'BBB'])
+        self.assertEqual(report.skipped, 0)
+        # 2 sets and 7 cards; 7 type relations and 1 type; 1 artist; 7 printings
+        self.assertEqual(report.phases['cards'].rows, 9)
+        self.assertEqual(report.phases['types'].rows, 7)
+        self.assertEqual(report.phases['artists'].rows, 1)
+        self.assertEqual(report.phases['printings'].rows, 7)
+        self.assertEqual(report.phases['cleanup'].rows, 0)
+        for stats in report.phases.values():
+            self.assertGreater(stats.seconds, 0)
+
+    @unittest.skipUnless(hasattr(tracemalloc, 'reset_peak'), "Needs tracemalloc.reset_peak()")
+    def test_peak_memory_per_phase(self):
+        report = ImportReport()
+        self.assertIsNone(report.phases['decode'].peak_memory)
+
+        tracemalloc.start()
+        try:
+            with report.phase('decode'):
+                data = bytearray(8 * 1024 * 1024)
+                del data
+            with report.phase('cards'):
+                pass
+        finally:
+            tracemalloc.stop()
+
+        # Each phase only counts what was allocated while it ran.
+        self.assertGreater(report.phases['decode'].peak_memory, 8 * 1024 * 1024)
+        self.assertLess(report.phases['cards'].peak_memory, 1024 * 1024)
+        self.assertIsNone(report.phases['types'].peak_memory)
+
+    def test_queries_counted(self):
+        with CaptureQueriesContext(connection) as context:
+            report = parse_data(self.sets_data, Everything)
+
+        self.assertEqual(report.queries, len(context.captured_queries))
+        self.assertEqual(
+            report.phases['printings'].queries, len(table_queries(context, 'magic_cards_printing', 'INSERT')))
+        self.assertEqual(report.phases['fetch'].queries, 0)
+        self.assertEqual(report.phases['decode'].queries, 0)
+
+    def test_unchanged_sets_skipped(self):
+        import_cards(source=self.source)
+        report = import_cards(source=self.source)
+
+        self.assertEqual(report.sets, [])
+        self.assertEqual(report.skipped, 2)
+        self.assertEqual(report.phases['cards'].rows, 0)
+
+    def test_signals(self):
+        received = []
+
+        def receiver(signal, **kwargs):
+            received.append((signal, kwargs.get('code')))
+
+        for signal in [import_started, set_imported, import_finished]:
+            signal.connect(receiver)
+            self.addCleanup(signal.disconnect, receiver)
+        report = import_cards(source=self.source)
+
+        self.assertEqual(received, [
+            (import_started, None), (set_imported, 'AAA'), (set_imported, 'BBB'), (import_finished, None)])
+        self.assertEqual(json.loads(json.dumps(report.as_dict()))['sets'], ['AAA', 'BBB'])
+
+    def test_management_command_stats(self):
+        out, err = StringIO(), StringIO()
+        call_command(
+            'import_magic_cards', source=self.source, stats=True, stats_json='-', stdout=out, stderr=err)
+
+        # Standard output is left to the JSON, so that it can be piped.
+        self.assertRegex(err.getvalue(), r'printings +[0-9.]+ +2 +7 ')
+        self.assertIn("Added 2 new Sets", err.getvalue())
+        stats = json.loads(out.getvalue())
+        self.assertEqual(stats['phases']['printings']['rows'], 7)
+        self.assertIsNone(stats['phases']['printings']['peak_memory'])
+
+    @unittest.skipUnless(hasattr(tracemalloc, 'reset_peak'), "Needs tracemalloc.reset_peak()")
+    def test_management_command_trace_memory(self):
+        out = StringIO()
+        call_command('import_magic_cards', source=self.source, stats=True, trace_memory=True, stdout=out)
+
+        self.assertRegex(out.getvalue(), r'printings +[0-9.]+ +2 +7 +[0-9]+ +[0-9.]+ MB')
+        self.assertNotIn("--trace-memory", out.getvalue())
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_change_counts(self):
+        report = parse_data(self.sets_data, Everything)
+
+        self.assertEqual(report.changes['Set'].as_dict(), {'created': 2, 'updated': 0, 'deleted': 0})
+        self.assertEqual(report.changes['Card'].created, 7)
+        self.assertEqual(report.changes['CardType'].created, 1)
+        self.assertEqual(report.changes['Artist'].created, 1)
+        self.assertEqual(report.set_changes['BBB']['Printing'].created, 4)
+
+        updated_data = copy.deepcopy(self.sets_data)
+        updated_data['AAA']['cards'][0]['text'] = 'Updated text.'
+        updated_data['BBB']['cards'][1]['types'] = ['Creature']
+        updated_data['BBB']['cards'][2]['number'] = '9'
+        report = parse_data(updated_data, Everything)
+
+        self.assertEqual(report.changes['Card'].as_dict(), {'created': 0, 'updated': 2, 'deleted': 0})
+        self.assertEqual(report.set_changes['AAA']['Card'].updated, 1)
+        self.assertEqual(report.changes['CardType'].as_dict(), {'created': 1, 'updated': 0, 'deleted': 0})
+        self.assertEqual(report.changes['Printing'].created, 1)
+        self.assertEqual(json.loads(json.dumps(report.as_dict()))['set_changes']['BBB'], {
+            'Card': {'created': 0, 'updated': 1, 'deleted': 0},
+            'CardType': {'created': 1, 'updated': 0, 'deleted': 0},
+            'Printing': {'created': 1, 'updated': 0, 'deleted': 0},
+        })
+
+    def test_change_counts_of_each_mode(self):
+        results = []
+        for options in [{}, {'staged': True}, {'loader': get_bulk_loader(connection)}]:
+            report = parse_data(self.sets_data, Everything, **options)
+            # Only the sets, cards, and printings of an import that writes every set at once belong to a set.
+            results.append((report.as_dict()['changes'], {
+                code: [changes[name].as_dict() for name in ['Set', 'Card', 'Printing']]
+                for code, changes in report.set_changes.items()}))
+            clear_catalog()
+
+        self.assertEqual(results[1], results[0])
+        self.assertEqual(results[2], results[0])
+
+    def test_types_deleted(self):
+        parse_data(self.sets_data, Everything)
+        CardSubtype.objects.create(name='Orphan')
+
+        report = parse_data(self.sets_data, Everything, force=True)
+
+        self.assertEqual(report.changes['CardSubtype'].deleted, 1)
+
+    def test_management_command_summary(self):
+        call_command('import_magic_cards', source=self.source, stdout=StringIO())
+        self.sets_data['BBB']['cards'][0]['text'] = 'Updated text.'
+        make_archive(self.sets_data, self.source)
+
+        out = StringIO()
+        with CaptureQueriesContext(connection) as context:
+            call_command('import_magic_cards', source=self.source, verbosity=2, stdout=out)
+
+        self.assertEqual(out.getvalue().splitlines()[-4:], [
+            "Added 0 new Sets, 0 new Cards, and 0 new Printings.",
+            "Updated 0 Sets, 1 Card, and 0 Printings.",
+            "BBB: 0 new Sets, 0 new Cards, and 0 new Printings.",
+            "BBB: updated 0 Sets, 1 Card, and 0 Printings.",
+        ])
+        self.assertFalse([query for query in context.captured_queries if 'COUNT(' in query['sql']])
+
+
+class DownloadCacheTests(ArchiveTestMixin, TestCase):
+
+    def setUp(self):
+        self.sets_data = {'AAA': make_set('AAA', 3), 'BBB': make_set('BBB', 2)}
+        self.archive_file = make_archive(self.sets_data)
+        self.addCleanup(self.archive_file.close)
+        self.server = ArchiveServer(self.archive_file.read()).start(self)
+        self.cache_dir = self.make_tempdir()
+        self.cache = DownloadCache(self.cache_dir)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_unchanged_download_revalidated(self):
+        path = self.cache.fetch(self.server.url)
+        self.assertEqual(self.read(path), self.server.body)
+
+        self.assertEqual(self.cache.fetch(self.server.url), path)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[1]['If-None-Match'], '"1"')
+        self.assertEqual(self.read(path), self.server.body)
+
+    def test_changed_download(self):
+        path = self.cache.fetch(self.server.url)
+        self.server.body = b'Changed archive'
+        self.server.etag = '"2"'
+
+        self.assertEqual(self.cache.fetch(self.server.url), path)
+        self.assertEqual(self.read(path), self.server.body)
+
+    def test_interrupted_download_resumed(self):
+        self.server.truncate_next = True
+
+        # Write in small chunks, so that the chunks before the connection drops are kept.
+        with mock.patch.object(sources_module, 'DOWNLOAD_CHUNK_SIZE', 16):
+            path = self.cache.fetch(self.server.url)
+
+        self.assertEqual(self.read(path), self.server.body)
+        self.assertEqual(len(self.server.requests), 2)
+        # The second request continues from where the first one dropped.
+        offset = int(re.match(r'bytes=(\d+)-$', self.server.requests[1]['Range']).group(1))
+        self.assertTrue(0 < offset <= len(self.server.body) // 2)
+
+    def test_import_from_cached_url(self):
+        with override_settings(MAGIC_CARDS_CACHE_DIR=self.cache_dir):
+            import_cards(source=self.server.url)
+            report = import_cards(source=self.server.url)
+
+        self.assertEqual(Set.objects.count(), 2)
+        self.assertEqual(report.skipped, 2)
+        self.assertEqual(len(self.server.requests), 2)
+
+
+class RemoteZipSourceTests(TestCase):
+
+    def setUp(self):
+        self.sets_data = {'S{:02d}'.format(i): make_set('S{:02d}'.format(i), 20) for i in range(20)}
+        with make_archive(self.sets_data) as archive_file:
+            self.server = ArchiveServer(archive_file.read()).start(self)
+        # Keep the blocks smaller than the archive, as they would be for a real one.
+        patcher = mock.patch.object(sources_module, 'RANGE_BLOCK_SIZE', 256)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fetches_only_requested_sets(self):
+        import_cards(['S03', 'S12'], source=self.server.url)
+
+        self.assertQuerysetEqual(Set.objects.order_by('code'), ['S03', 'S12'], transform=lambda x: x.code)
+        self.assertEqual(Card.objects.count(), 40)
+        self.assertTrue(all('Range' in headers for headers in self.server.requests))
+        self.assertLess(self.server.bytes_sent, len(self.server.body) / 3)
+
+    def test_falls_back_without_ranges(self):
+        self.server.accept_ranges = False
+
+        import_cards(['S03'], source=self.server.url)
+
+        self.assertQuerysetEqual(Set.objects.all(), ['S03'], transform=lambda x: x.code)
+        self.assertIn('Range', self.server.requests[0])
+        self.assertNotIn('Range', self.server.requests[-1])
+
+    def test_all_sets_downloaded_in_full(self):
+        import_cards(source=self.server.url)
+
+        self.assertEqual(Set.objects.count(), 20)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertNotIn('Range', self.server.requests[0])
+
+
+class FastLoadTests(ArchiveTestMixin, TestCase):
+
+    def setUp(self):
+        self.sets_data = generate_sets(4, 50, reprint_ratio=0.3, type_variety=10)
+
+    def snapshot(self):
+        """
+        Returns everything that was imported, independently of primary keys.
+        """
+        cards = {
+            card.name: (
+                card.mana_cost, card.text, card.power, card.toughness, card.loyalty, card.type_line, card.type_names,
+                sorted(str(t) for t in card.supertypes.all()), sorted(str(t) for t in card.types.all()),
+                sorted(str(t) for t in card.subtypes.all()))
+            for card in Card.objects.prefetch_related('supertypes', 'types', 'subtypes')
+        }
+        printings = sorted(Printing.objects.values_list(
+            'card__name', 'set__code', 'rarity', 'flavor_text', 'artist__full_name', 'number', 'multiverse_id'))
+        return cards, printings, sorted(Artist.objects.values_list('full_name', flat=True))
+
+    def test_same_as_normal_import(self):
+        parse_data(self.sets_data, Everything)
+        expected = self.snapshot()
+        clear_catalog()
+
+        report = parse_data(self.sets_data, Everything, loader=get_bulk_loader(connection))
+
+        self.assertEqual(self.snapshot(), expected)
+        self.assertEqual(report.sets, list(self.sets_data))
+        self.assertEqual(report.phases['printings'].rows, 200)
+
+    def test_loads_each_table_at_once(self):
+        loader = get_bulk_loader(connection)
+        with mock.patch.object(loader, 'insert', side_effect=loader.insert) as insert:
+            parse_data(self.sets_data, Everything, loader=loader)
+
+        tables = [call[0][0]._meta.db_table for call in insert.call_args_list]
+        self.assertEqual(sorted(tables), sorted(set(tables)))
+        self.assertIn('magic_cards_card_subtypes', tables)
+        self.assertEqual(tables[-1], 'magic_cards_printing')
+
+    def test_orm_fallback(self):
+        parse_data(self.sets_data, Everything, loader=BulkLoader(connection))
+
+        self.assertEqual(Set.objects.count(), 4)
+        self.assertEqual(Printing.objects.count(), 200)
+
+    def test_sequences_continue_after_load(self):
+        CardType.objects.create(name='Tribal')
+        parse_data(self.sets_data, Everything, loader=get_bulk_loader(connection))
+
+        card = Card.objects.create(name='Created Afterwards')
+        self.assertGreater(card.pk, max(Card.objects.exclude(pk=card.pk).values_list('pk', flat=True)))
+        self.assertTrue(Card.objects.filter(name='Z000 Card 0').exists())
+
+    def test_only_into_empty_database(self):
+        parse_data({'Z000': self.sets_data['Z000']}, Everything)
+
+        with mock.patch.object(import_cards_module, 'load_sets') as load_sets:
+            parse_data(self.sets_data, Everything, loader=get_bulk_loader(connection))
+
+        load_sets.assert_not_called()
+        self.assertEqual(Set.objects.count(), 4)
+
+    def test_import_cards(self):
+        archive_path = self.archive_path(self.sets_data)
+
+        patcher = mock.patch.object(SQLiteBulkLoader, 'insert', autospec=True, side_effect=SQLiteBulkLoader.insert)
+        with patcher as insert:
+            call_command('import_magic_cards', source=archive_path, fast_load=True, stdout=StringIO())
+
+        self.assertTrue(insert.called)
+        self.assertEqual(Printing.objects.count(), 200)
+        self.assertEqual(SetImportState.objects.count(), 4)
+
+    def test_import_cards_into_populated_database(self):
+        """
+        The connection is not tuned for loading when there is already a catalog that a crash could corrupt.
+        """
+        archive_path = self.archive_path(self.sets_data)
+        import_cards(source=archive_path)
+
+        with mock.patch.object(import_cards_module, 'get_bulk_loader') as get_loader:
+            import_cards(source=archive_path, fast_load=True, force=True)
+            import_cards(source=archive_path, fast_load=True, staged=True, force=True)
+
+        get_loader.assert_not_called()
+        self.assertEqual(Printing.objects.count(), 200)
+
+    def test_copy_file(self):
+        copy_file = CopyFile([(1, 'Tab\tand\nnewline', None), (2, 'Back\\slash', 'x')])
+
+        self.assertEqual(copy_file.read(4), '1\tTa')
+        self.assertEqual(copy_file.read(), 'b\\tand\\nnewline\t\\N\n2\tBack\\\\slash\tx\n')
+        self.assertEqual(copy_file.read(), '')
+
+
+class PlanTests(ArchiveTestMixin, TestCase):
+
+    def setUp(self):
+        self.sets_data = {'AAA': make_set('AAA', 3), 'BBB': make_set('BBB', 2)}
+
+    def test_plan_empty_database(self):
+        plan = plan_data(self.sets_data, Everything)
+
+        self.assertEqual(plan[Set].created, ['AAA', 'BBB'])
+        self.assertEqual(len(plan[Card].created), 5)
+        self.assertEqual(plan[CardType].created, ['Artifact'])
+        self.assertEqual(plan[Artist].created, ['Synthetic Artist'])
+        self.assertEqual(plan[Printing].created[0], ['AAA', 'AAA Card 0', '1'])
+        self.assertEqual(plan.counts()['Printing'], {'created': 5, 'updated': 0, 'pruned': 0})
+        self.assertFalse(Set.objects.exists())
+
+    def test_plan_changes(self):
+        parse_data(self.sets_data, Everything)
+        CardSubtype.objects.create(name='Orphan')
+        updated_data = copy.deepcopy(self.sets_data)
+        updated_data['AAA']['cards'][0]['text'] = 'Updated text.'
+        updated_data['AAA']['cards'][1]['types'] = ['Creature']
+        updated_data['BBB']['cards'].append(dict(updated_data['AAA']['cards'][2], number='3'))
+
+        plan = plan_data(updated_data, Everything)
+
+        self.assertEqual(plan[Set].created, [])
+        self.assertEqual(plan[Card].created, [])
+        self.assertEqual(plan[Card].updated, [
+            {'name': 'AAA Card 0', 'fields': ['text']},
+            {'name': 'AAA Card 1', 'fields': ['types']},
+        ])
+        self.assertEqual(plan[CardType].created, ['Creature'])
+        self.assertEqual(plan[CardSubtype].pruned, ['Orphan'])
+        self.assertEqual(plan[Printing].created, [['BBB', 'AAA Card 2', '3']])
+
+        parse_data(updated_data, Everything)
+        self.assertEqual(Printing.objects.count(), 6)
+        self.assertFalse(CardSubtype.objects.exists())
+
+    def test_plan_is_read_only(self):
+        parse_data(self.sets_data, Everything)
+        updated_data = copy.deepcopy(self.sets_data)
+        updated_data['AAA']['cards'][0]['text'] = 'Updated text.'
+
+        with CaptureQueriesContext(connection) as context:
+            plan_data(updated_data, Everything)
+
+        for query in context.captured_queries:
+            self.assertRegex(query['sql'], r'^(SELECT|SAVEPOINT|RELEASE SAVEPOINT) ')
+        # One query for each of sets, artists, cards, printings, and import states, and two for each kind of type
+        selects = [query for query in context.captured_queries if query['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 11)
+
+    def test_unchanged_sets_skipped(self):
+        archive_path = self.archive_path(self.sets_data)
+        import_cards(source=archive_path)
+
+        plan = plan_import(source=archive_path)
+
+        self.assertEqual(plan.skipped, 2)
+        self.assertEqual(plan[Printing].created, [])
+
+    def test_management_command(self):
+        archive_path = self.archive_path(self.sets_data)
+
+        out, err = StringIO(), StringIO()
+        call_command('import_magic_cards', source=archive_path, plan=True, plan_json='-', stdout=out, stderr=err)
+
+        self.assertIn("Card: 5 to create, 0 to update, 0 to prune.\n", err.getvalue())
+        self.assertEqual(json.loads(out.getvalue())['models']['Set']['created'], ['AAA', 'BBB'])
+        self.assertFalse(Set.objects.exists())
+
+
+class StagedImportTests(TestCase):
+
+    def setUp(self):
+        self.sets_data = {code: make_set(code, 10) for code in ['AAA', 'BBB', 'CCC']}
+        for code, data in self.sets_data.items():
+            # Reprint a card with different text and types, so that the order of the writes matters.
+            data['cards'].append(dict(self.sets_data['AAA']['cards'][0], text='Text from {}'.format(code)))
+            data['cards'][-1]['types'] = ['Creature', code.title()]
+
+    @staticmethod
+    def snapshot():
+        return {
+            'cards': list(Card.objects.order_by('name').values_list(
+                'name', 'mana_cost', 'text', 'power', 'type_line')),
+            'types': list(Card.objects.order_by('name', 'types__name').values_list('name', 'types__name')),
+            'printings': sorted(Printing.objects.values_list(
+                'card__name', 'set__code', 'rarity', 'artist__full_name', 'number')),
+            'import_states': sorted(SetImportState.objects.values_list('code', flat=True)),
+        }
+
+    def test_same_as_normal_import(self):
+        updated_data = copy.deepcopy(self.sets_data)
+        updated_data['BBB']['cards'][1]['text'] = 'Updated text.'
+        updated_data['DDD'] = make_set('DDD', 2)
+        results = []
+        for staged in [False, True]:
+            parse_data(self.sets_data, Everything, staged=staged)
+            parse_data(updated_data, Everything, staged=staged)
+            results.append(self.snapshot())
+            clear_catalog()
+
+        self.assertEqual(results[1], results[0])
+        self.assertIn(('AAA Card 0', 'Ccc'), results[1]['types'])
+        self.assertEqual(results[1]['cards'][0][-1], 'Creature Ccc')
+        self.assertEqual(len(results[1]['printings']), 35)
+
+    def test_decodes_before_writing(self):
+        decoded = []
+
+        def iter_sets():
+            for code, data in self.sets_data.items():
+                decoded.append(code)
+                yield code, data
+
+        def write_staged_sets(cache, staged_sets, *args):
+            self.assertEqual(decoded, list(self.sets_data))
+            self.assertFalse(Card.objects.exists())
+            return original(cache, staged_sets, *args)
+
+        original = import_cards_module.write_staged_sets
+        with mock.patch.object(import_cards_module, 'write_staged_sets', side_effect=write_staged_sets):
+            report = parse_data(iter_sets(), Everything, staged=True)
+
+        self.assertEqual(report.sets, ['AAA', 'BBB', 'CCC'])
+        self.assertEqual(Printing.objects.count(), 33)
+
+    def test_bulk_writes(self):
+        with CaptureQueriesContext(connection) as context:
+            parse_data(self.sets_data, Everything, staged=True)
+
+        self.assertEqual(len(table_queries(context, 'magic_cards_set', 'INSERT')), 1)
+        self.assertEqual(len(table_queries(context, 'magic_cards_card', 'INSERT')), 1)
+        self.assertEqual(len(table_queries(context, 'magic_cards_printing', 'INSERT')), 1)
+
+    def test_failure_keeps_old_catalog(self):
+        parse_data(self.sets_data, Everything)
+        expected = self.snapshot()
+        updated_data = copy.deepcopy(self.sets_data)
+        updated_data['BBB']['cards'][1]['text'] = 'Updated text.'
+        updated_data['DDD'] = make_set('DDD', 2)
+
+        with mock.patch.object(Printing.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                parse_data(updated_data, Everything, staged=True)
+
+        self.assertEqual(self.snapshot(), expected)
+
+    def test_not_checkpointed(self):
+        with self.assertRaises(ValueError):
+            import_cards(source={}, staged=True, checkpoint_every=1)
+        with self.assertRaises(CommandError):
+            call_command('import_magic_cards', staged=True, resume=True, stdout=StringIO())
+
+
+class WeightedSamplerTests(SimpleTestCase):
+
+    CHOICES = {'common': 10, 'uncommon': 3, 'rare': 0.875, 'mythic': 0.125, 'never': 0}
+
+    def test_frequencies(self):
+        sampler = WeightedSampler(self.CHOICES, random.Random(0))
+
+        draws = collections.Counter(sampler.choice() for _ in range(50000))
+
+        total = sum(self.CHOICES.values())
+        for label, weight in self.CHOICES.items():
+            self.assertAlmostEqual(draws[label] / 50000, weight / total, delta=0.01)
+        self.assertEqual(draws['never'], 0)
+
+    def test_alias_table(self):
+        probabilities, aliases = alias_table([0.5, 0.25, 0.125, 0.125])
+
+        # Each column holds 1/4 of the probability, split between itself and its alias.
+        totals = [0.0] * 4
+        for i, (probability, alias) in enumerate(zip(probabilities, aliases)):
+            totals[i] += probability / 4
+            totals[alias] += (1 - probability) / 4
+        self.assertEqual(totals, [0.5, 0.25, 0.125, 0.125])
+
+    def test_seeded(self):
+        def draws(seed):
+            return WeightedSampler(self.CHOICES, random.Random(seed)).sample(100)
+
+        self.assertEqual(draws(1), draws(1))
+        self.assertNotEqual(draws(1), draws(2))
+        self.assertEqual(len(draws(1)), 100)
+
+    @unittest.skipIf(random_module.numpy is None, "NumPy is not installed")
+    def test_batch_frequencies(self):
+        draws = collections.Counter(WeightedSampler(self.CHOICES, random.Random(0)).sample(50000))
+
+        self.assertAlmostEqual(draws['common'] / 50000, 10 / 14, delta=0.01)
+        self.assertEqual(draws['never'], 0)
+
+    def test_batch_same_as_choices(self):
+        """
+        A seeded batch is the same with or without NumPy, and leaves `rng` in the same state.
+        """
+        def draws(numpy):
+            rng = random.Random(3)
+            with mock.patch.object(random_module, 'numpy', numpy):
+                return WeightedSampler(self.CHOICES, rng).sample(1000), rng.random()
+
+        one_at_a_time = random.Random(3)
+        sampler = WeightedSampler(self.CHOICES, one_at_a_time)
+        expected = [sampler.choice() for _ in range(1000)], one_at_a_time.random()
+        self.assertEqual(draws(random_module.numpy), expected)
+        self.assertEqual(draws(None), expected)
+
+    def test_batch_without_numpy(self):
+        with mock.patch.object(random_module, 'numpy', None):
+            draws = WeightedSampler({'a': 1, 'b': 0}, random.Random(0)).sample(10)
+
+        self.assertEqual(draws, ['a'] * 10)
+
+    def test_invalid_weights(self):
+        with self.assertRaises(ValueError):
+            WeightedSampler({})
+        with self.assertRaises(ValueError):
+            WeightedSampler({'a': 0})
+        with self.assertRaises(ValueError):
+            WeightedSampler({'a': 1, 'b': -1})
+
+    def test_weighted_choice(self):
+        self.assertEqual(weighted_choice({'a': 0, 'b': 1e-300}), 'b')
+        self.assertIn(weighted_choice(self.CHOICES, random.Random(0)), self.CHOICES)
+
+
+class BoosterTests(TestCase):
+
+    def setUp(self):
+        self.magic_set = Set.objects.create(name='Synthetic Set', code='SYN')
+        rarities = [
+            (Printing.Rarity.MYTHIC, 4), (Printing.Rarity.RARE, 12), (Printing.Rarity.UNCOMMON, 20),
+            (Printing.Rarity.COMMON, 40), (Printing.Rarity.BASIC_LAND, 5), (Printing.Rarity.SPECIAL, 3),
+        ]
+        Card.objects.bulk_create([
+            Card(name='{} {}'.format(rarity, i)) for rarity, count in rarities for i in range(count)])
+        cards = Card.objects.in_bulk(field_name='name')
+        Printing.objects.bulk_create([
+            Printing(card=cards['{} {}'.format(rarity, i)], set=self.magic_set, rarity=rarity)
+            for rarity, count in rarities for i in range(count)])
+        self.addCleanup(boosters.pool_cache.clear)
+
+    def test_pack_contents(self):
+        for pack in self.magic_set.generate_boosters(200, seed=0):
+            rarities = [printing.rarity for printing in pack]
+            self.assertEqual(len(pack), 15)
+            self.assertEqual(len(set(pack)), 15)
+            self.assertIn(rarities[0], [Printing.Rarity.MYTHIC, Printing.Rarity.RARE])
+            self.assertEqual(rarities[1:], [Printing.Rarity.UNCOMMON] * 3 + [Printing.Rarity.COMMON] * 10 + [
+                Printing.Rarity.BASIC_LAND])
+
+    def test_mythic_upgrade(self):
+        packs = self.magic_set.generate_boosters(4000, seed=0)
+
+        mythics = sum(pack[0].rarity == Printing.Rarity.MYTHIC for pack in packs)
+        self.assertAlmostEqual(mythics / len(packs), 1 / 8, delta=0.02)
+
+    def test_seed(self):
+        def pack_ids(seed):
+            return [[printing.pk for printing in pack] for pack in self.magic_set.generate_boosters(5, seed=seed)]
+
+        self.assertEqual(pack_ids(1), pack_ids(1))
+        self.assertNotEqual(pack_ids(1), pack_ids(2))
+
+    def test_seed_same_without_numpy(self):
+        """
+        Seeded packs are the same whether or not NumPy is installed, e.g. for a draft's packs.
+        """
+        packs = self.magic_set.generate_boosters(50, seed=4)
+        with mock.patch.object(random_module, 'numpy', None):
+            packs_without_numpy = self.magic_set.generate_boosters(50, seed=4)
+
+        self.assertEqual(packs_without_numpy, packs)
+
+    def test_constant_queries(self):
+        with self.assertNumQueries(1):
+            self.magic_set.generate_boosters(10)
+        with self.assertNumQueries(0):
+            packs = self.magic_set.generate_boosters(1000)
+            self.assertTrue(str(packs[0][0]))
+
+    def test_fallback_rarities(self):
+        Printing.objects.filter(rarity__in=[Printing.Rarity.MYTHIC, Printing.Rarity.BASIC_LAND]).delete()
+        Printing.objects.filter(rarity=Printing.Rarity.COMMON).exclude(
+            pk__in=Printing.objects.filter(rarity=Printing.Rarity.COMMON).order_by('pk')[:8]).delete()
+
+        for pack in self.magic_set.generate_boosters(20, seed=0):
+            self.assertEqual(len(pack), 15)
+            self.assertEqual(len(set(pack)), 15)
+            self.assertEqual(pack[0].rarity, Printing.Rarity.RARE)
+            # The two commons that are missing, and the basic land, are made up with uncommons.
+            self.assertEqual(sum(printing.rarity == Printing.Rarity.UNCOMMON for printing in pack), 6)
+
+    def test_imported_basic_lands(self):
+        """
+        Basic lands fill the basic land slot, and only that slot, although MTGJSON says they are common.
+        """
+        sets_data = {'BAS': make_set('BAS', 20)}
+        basics = ['Plains', 'Island', 'Swamp', 'Mountain', 'Forest']
+        sets_data['BAS']['cards'].extend({
+            'name': name,
+            'layout': 'normal',
+            'supertypes': ['Basic'],
+            'types': ['Land'],
+            'subtypes': [name],
+            'rarity': 'common',
+            'number': str(21 + i),
+        } for i, name in enumerate(basics))
+        parse_data(sets_data, Everything)
+
+        for pack in Set.objects.get(code='BAS').generate_boosters(50, seed=0):
+            names = [printing.card.name for printing in pack]
+            self.assertEqual(len(pack), 15)
+            self.assertIn(names[-1], basics)
+            self.assertFalse(set(names[:-1]) & set(basics))
+
+    def test_sealed_pool(self):
+        pool = self.magic_set.generate_sealed_pool(seed=0)
+
+        self.assertEqual(len(pool), 90)
+
+    def test_pools_reloaded_after_import(self):
+        self.magic_set.generate_boosters(1)
+        Printing.objects.filter(rarity=Printing.Rarity.BASIC_LAND).delete()
+        import_finished.send(sender=ImportReport, report=ImportReport())
+
+        for pack in self.magic_set.generate_boosters(20, seed=0):
+            self.assertNotIn(Printing.Rarity.BASIC_LAND, [printing.rarity for printing in pack])
+
+
 class ImportManagementCommandTests(ImportTestBase, TestCase):
 
     command = 'import_magic_cards'